@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AnimalsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'animals'
+
+    def ready(self):
+        # Connect the view-logging signal handlers
+        from . import signals  # noqa: F401
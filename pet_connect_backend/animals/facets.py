@@ -0,0 +1,140 @@
+# animals/facets.py
+"""
+Facet counts of the animal list ("Dogs (120) · Cats (85)").
+
+All facets come from one grouped aggregate query: the filtered animals are
+grouped by every facet column at once and each facet is then summed out of
+those groups in Python. Results are cached in the 'facets' cache (see
+CACHES in settings), shared by every worker, keyed by the normalized
+filter set and a generation token; saving or deleting an animal or
+shelter forgets the token once the transaction commits, which
+invalidates every cached filter set at once (see signals.py).
+"""
+import json
+import uuid
+import hashlib
+import logging
+
+from django.core.cache import caches
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from pet_connect_backend.metrics import observe_cache_lookup
+
+from .filters import animal_filters
+from .models import Animal, Shelter
+
+logger = logging.getLogger(__name__)
+
+FACET_CACHE_ALIAS = 'facets'
+
+# Facet name -> (filter column, {key: display label} for fields with choices)
+KEY_FACETS = {
+    'species': ('species_key', {}),
+    'size': ('size_key', {value.lower(): label for value, label in Animal.SIZE_CHOICES}),
+    'energy_level': ('energy_level_key', {value.lower(): label for value, label in Animal.ENERGY_CHOICES}),
+    'gender': ('gender_key', {value.lower(): label for value, label in Animal.GENDER_CHOICES}),
+}
+
+# (bucket, age_min, age_max) in months, the bounds of recommendations.features.age_category;
+# age_min and age_max are the list parameters that select the bucket
+AGE_BUCKETS = [
+    ('young', 0, 23),
+    ('adult', 24, 95),
+    ('senior', 96, None),
+]
+
+
+def get_facet_cache():
+    return caches[FACET_CACHE_ALIAS]
+
+
+def _generation_key():
+    return "facets:generation"
+
+
+def _counts_key(generation, filters):
+    digest = hashlib.md5(json.dumps(sorted(filters.items())).encode()).hexdigest()
+    return f"facets:{generation}:{digest}"
+
+
+def _age_bucket():
+    whens = [
+        When(total_age_months__lte=age_max, then=Value(position))
+        for position, (_, _, age_max) in enumerate(AGE_BUCKETS) if age_max is not None
+    ]
+    return Case(*whens, default=Value(len(AGE_BUCKETS) - 1), output_field=IntegerField())
+
+
+def compute_facets(filters):
+    """
+    Count the animals matching filters (see filters.animal_filters) by every
+    facet value, with one grouped query.
+
+    Labels come from the field choices rather than from MAX() aggregates,
+    so the query reads nothing but the filter columns.
+    """
+    columns = [column for column, _ in KEY_FACETS.values()]
+    groups = (
+        Animal.objects.filter(**filters)
+        .annotate(age_bucket=_age_bucket())
+        .values(*columns, 'age_bucket', 'shelter_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+    total = 0
+    counts = {facet: {} for facet in [*KEY_FACETS, 'age', 'shelter']}
+    labels = {facet: {} for facet in counts}
+    for group in groups:
+        n = group['count']
+        total += n
+        for facet, (column, _) in KEY_FACETS.items():
+            counts[facet][group[column]] = counts[facet].get(group[column], 0) + n
+        for facet, value in (('age', group['age_bucket']), ('shelter', group['shelter_id'])):
+            counts[facet][value] = counts[facet].get(value, 0) + n
+
+    for facet, (_, display) in KEY_FACETS.items():
+        labels[facet] = {value: display.get(value, value.title()) for value in counts[facet]}
+
+    # Names of the shelters that appear, not worth a join on every animal
+    shelters = dict(Shelter.objects.filter(id__in=[i for i in counts['shelter'] if i is not None])
+                    .values_list('id', 'name'))
+    labels['shelter'] = {shelter_id: shelters.get(shelter_id) for shelter_id in counts['shelter']}
+
+    facets = {
+        facet: sorted(
+            ({'value': value, 'label': labels[facet][value], 'count': n} for value, n in counts[facet].items()),
+            key=lambda entry: (-entry['count'], str(entry['label'])),
+        )
+        for facet in [*KEY_FACETS, 'shelter']
+    }
+    facets['age'] = [
+        {'value': bucket, 'label': bucket, 'count': counts['age'][position], 'age_min': age_min, 'age_max': age_max}
+        for position, (bucket, age_min, age_max) in enumerate(AGE_BUCKETS)
+        if position in counts['age']
+    ]
+    return {'total': total, 'facets': facets}
+
+
+def get_facets(params):
+    """Facet counts for the list's query parameters, from the cache when possible"""
+    filters = animal_filters(params)
+    cache = get_facet_cache()
+
+    # add() never overwrites, so a concurrent first request can't undo an invalidation
+    cache.add(_generation_key(), uuid.uuid4().hex, None)
+    generation = cache.get(_generation_key())
+
+    key = _counts_key(generation, filters)
+    result = cache.get(key)
+    observe_cache_lookup(FACET_CACHE_ALIAS, result is not None)
+    if result is None:
+        result = compute_facets(filters)
+        cache.set(key, result)
+    return result
+
+
+def invalidate_facets():
+    """Drop every cached facet count by forgetting the generation"""
+    get_facet_cache().delete(_generation_key())
+    logger.debug("Invalidated cached facet counts")
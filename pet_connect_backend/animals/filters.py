@@ -0,0 +1,60 @@
+# animals/filters.py
+"""
+Structured filters of the animal list, shared by every view that takes them.
+
+Filters match the denormalized columns of Animal (lower-cased keys and
+total_age_months) with plain equality and range lookups, so each one is
+an index range scan on the filter index it leads (see Animal.Meta).
+"""
+from rest_framework.exceptions import ValidationError
+
+from .models import Animal
+
+# Query parameter -> lower-cased filter column
+KEY_FILTERS = {
+    'species': 'species_key',
+    'size': 'size_key',
+    'energy_level': 'energy_level_key',
+    'gender': 'gender_key',
+}
+
+ALL_STATUSES = [code for code, _ in Animal.STATUS_CHOICES]
+
+
+def animal_filters(params):
+    """
+    Turn the list's query parameters into Animal lookups.
+
+    species, size, energy_level and gender match case-insensitively;
+    age_min and age_max bound the age in months (years included); status
+    picks one status code, otherwise animals of every status are listed.
+    The lookups are normalized (lower-cased keys, integer ages), so equal
+    filter sets give equal dicts.
+    """
+    status = params.get('status')
+    if status and status not in ALL_STATUSES:
+        raise ValidationError({'status': f"Expected one of: {', '.join(ALL_STATUSES)}"})
+
+    filters = {}
+    for param, column in KEY_FILTERS.items():
+        value = params.get(param)
+        if value:
+            filters[column] = value.lower()
+
+    for param, lookup in (('age_min', 'gte'), ('age_max', 'lte')):
+        value = params.get(param)
+        if value:
+            try:
+                filters[f'total_age_months__{lookup}'] = int(value)
+            except ValueError:
+                raise ValidationError({param: 'Must be a whole number of months'})
+
+    if status:
+        filters['status'] = status
+
+    return filters
+
+
+def apply_animal_filters(queryset, params):
+    """Filter an Animal queryset by the list's query parameters (see animal_filters)"""
+    return queryset.filter(**animal_filters(params))
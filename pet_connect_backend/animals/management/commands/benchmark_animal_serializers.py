@@ -0,0 +1,65 @@
+"""
+Pet Connect - Benchmark Animal Serializers Command
+------------------------------------------
+Management command to compare the animal list serializers in rows/sec.
+
+AnimalSerializer (DRF, one shelter query per animal) and
+FastAnimalSerializer (one values() query) serialize the same pages of
+seeded synthetic animals, spread over a few shelters, in an isolated
+database. Each timing includes the queries, as in the list view.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Mod
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Times AnimalSerializer against FastAnimalSerializer on synthetic animals, in rows/sec'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--catalog_size', type=int, default=5000, help='Synthetic animals to create')
+        parser.add_argument('--page_sizes', type=str, default='24,100,1000', help='Comma separated rows per call')
+        parser.add_argument('--shelters', type=int, default=20, help='Shelters the animals are spread over')
+        parser.add_argument('--min_time', type=float, default=0.5, help='Seconds each serializer is timed for')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # Import here to avoid import issues
+        from animals.models import Animal, Shelter
+        from animals.serializers import AnimalSerializer, FastAnimalSerializer
+        from recommendations.benchmarks import measure
+        from recommendations.evaluation import isolated_database
+        from recommendations.synthetic import create_synthetic_data
+
+        serializers = {
+            'AnimalSerializer': lambda animals: AnimalSerializer(animals, many=True).data,
+            'FastAnimalSerializer': lambda animals: FastAnimalSerializer(animals).data,
+        }
+
+        with isolated_database():
+            self.stdout.write(f"Creating {options['catalog_size']} synthetic animals...")
+            create_synthetic_data(options['catalog_size'], 10, views_per_user=5, seed=options['seed'])
+            for i in range(options['shelters']):
+                shelter = Shelter.objects.create(name=f"Shelter {i}", city='Cape Town', website='https://example.org')
+                Animal.objects.annotate(bucket=Mod('id', options['shelters'])).filter(bucket=i).update(shelter=shelter)
+
+            for page_size in parse_sizes(options['page_sizes']):
+                page = Animal.objects.order_by('-arrival_date', '-id')[:page_size]
+                rows = len(page)
+                results = {
+                    name: measure(lambda: serialize(page.all()), min_time=options['min_time'])
+                    for name, serialize in serializers.items()
+                }
+
+                self.stdout.write(f"{rows} rows per call:")
+                for name, result in results.items():
+                    self.stdout.write(
+                        f"  {name:<22} {result['ops_per_sec'] * rows:>11.0f} rows/sec "
+                        f"{result['mean_ms']:>9.3f} ms {result['queries']:>5} queries"
+                    )
+                speedup = results['FastAnimalSerializer']['ops_per_sec'] / results['AnimalSerializer']['ops_per_sec']
+                self.stdout.write(self.style.SUCCESS(f"  {speedup:.1f}x faster"))
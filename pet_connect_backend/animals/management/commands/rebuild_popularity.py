@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized popularity and trending counters from the view history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows written per bulk insert')
+
+    def handle(self, *args, **options):
+        # Import models here to avoid import issues
+        from animals.models import AnimalPopularity, AnimalViewHistory
+
+        self.stdout.write("Aggregating view history...")
+
+        # Stream the history instead of loading model instances
+        counters = {}
+        views = AnimalViewHistory.objects.order_by().values_list('animal_id', 'timestamp')
+        for animal_id, timestamp in views.iterator(chunk_size=options['batch_size']):
+            popularity = counters.get(animal_id)
+            if popularity is None:
+                popularity = counters[animal_id] = AnimalPopularity(animal_id=animal_id)
+            popularity.add_view(timestamp)
+
+        with transaction.atomic():
+            AnimalPopularity.objects.all().delete()
+            AnimalPopularity.objects.bulk_create(counters.values(), batch_size=options['batch_size'])
+
+        total_views = sum(p.view_count for p in counters.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt popularity for {len(counters)} animals from {total_views} views"
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of animals from the animals table'
+
+    def handle(self, *args, **options):
+        # Import here to avoid import issues
+        from animals.models import Animal
+        from animals.search import get_search_backend
+
+        backend = get_search_backend()
+        self.stdout.write(f"Rebuilding the {connection.vendor} search index...")
+        backend.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the search index of {Animal.objects.count()} animals"
+        ))
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0008_alter_animalviewhistory_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnimalPopularity',
+            fields=[
+                ('animal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='animals.animal')),
+                ('view_count', models.PositiveIntegerField(db_index=True, default=0)),
+                ('trending_score', models.FloatField(blank=True, db_index=True, help_text='Log of the time-decayed view count (null without views)', null=True)),
+                ('last_viewed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Animal popularity',
+            },
+        ),
+    ]
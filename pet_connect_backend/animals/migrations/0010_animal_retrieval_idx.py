@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0009_animalpopularity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['status', 'species', 'size', 'age_years'], name='animal_retrieval_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0010_animal_retrieval_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['arrival_date', 'id'], name='animal_arrival_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['age_years', 'age_months', 'id'], name='animal_age_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animalpopularity',
+            index=models.Index(fields=['view_count', 'animal'], name='popularity_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:06
+
+from django.db import migrations, models
+
+
+def backfill_filter_columns(apps, schema_editor):
+    """Derive the filter columns of existing animals (same rules as Animal.update_filter_columns)"""
+    Animal = apps.get_model('animals', 'Animal')
+    columns = ['total_age_months', 'species_key', 'size_key', 'energy_level_key', 'gender_key']
+    batch = []
+    for animal in Animal.objects.only('id', 'age_years', 'age_months', 'species', 'size', 'energy_level', 'gender') \
+            .order_by('id').iterator(chunk_size=2000):
+        animal.total_age_months = (animal.age_years or 0) * 12 + (animal.age_months or 0)
+        animal.species_key = (animal.species or '').lower()
+        animal.size_key = (animal.size or '').lower()
+        animal.energy_level_key = (animal.energy_level or '').lower()
+        animal.gender_key = (animal.gender or '').lower()
+        batch.append(animal)
+        if len(batch) >= 2000:
+            Animal.objects.bulk_update(batch, columns)
+            batch = []
+    if batch:
+        Animal.objects.bulk_update(batch, columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0011_animal_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='energy_level_key',
+            field=models.CharField(blank=True, editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='gender_key',
+            field=models.CharField(blank=True, editable=False, max_length=1),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='size_key',
+            field=models.CharField(blank=True, editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='species_key',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='total_age_months',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_filter_columns, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['status', 'species_key', 'size_key', 'total_age_months'], name='animal_species_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['status', 'size_key', 'energy_level_key'], name='animal_size_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['status', 'energy_level_key', 'total_age_months'], name='animal_energy_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['status', 'gender_key', 'species_key'], name='animal_gender_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['status', 'total_age_months'], name='animal_age_filter_idx'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Full-text index of animals (see animals/search.py). On SQLite an
+# external-content FTS5 table reads the text from animals_animal, and
+# triggers mirror every write into it; on PostgreSQL a GIN index covers
+# the weighted tsvector expression the searches use.
+
+SEARCHED_COLUMNS = ['breed', 'description', 'behavior_notes', 'health_notes']
+
+SQLITE_CREATE = [
+    f"""CREATE VIRTUAL TABLE animals_animal_search USING fts5(
+        {', '.join(SEARCHED_COLUMNS)},
+        content='animals_animal', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    f"""CREATE TRIGGER animals_animal_search_insert AFTER INSERT ON animals_animal BEGIN
+        INSERT INTO animals_animal_search(rowid, {', '.join(SEARCHED_COLUMNS)})
+        VALUES (new.id, {', '.join(f'new.{c}' for c in SEARCHED_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER animals_animal_search_delete AFTER DELETE ON animals_animal BEGIN
+        INSERT INTO animals_animal_search(animals_animal_search, rowid, {', '.join(SEARCHED_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join(f'old.{c}' for c in SEARCHED_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER animals_animal_search_update AFTER UPDATE OF {', '.join(SEARCHED_COLUMNS)}
+    ON animals_animal BEGIN
+        INSERT INTO animals_animal_search(animals_animal_search, rowid, {', '.join(SEARCHED_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join(f'old.{c}' for c in SEARCHED_COLUMNS)});
+        INSERT INTO animals_animal_search(rowid, {', '.join(SEARCHED_COLUMNS)})
+        VALUES (new.id, {', '.join(f'new.{c}' for c in SEARCHED_COLUMNS)});
+    END""",
+    # Index the animals that already exist
+    "INSERT INTO animals_animal_search(animals_animal_search) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS animals_animal_search_insert",
+    "DROP TRIGGER IF EXISTS animals_animal_search_delete",
+    "DROP TRIGGER IF EXISTS animals_animal_search_update",
+    "DROP TABLE IF EXISTS animals_animal_search",
+]
+
+
+def search_index():
+    from django.contrib.postgres.indexes import GinIndex
+    from animals.search import SEARCH_INDEX, search_vector
+
+    # The same expression the searches filter on, so the planner matches it
+    return GinIndex(search_vector(), name=SEARCH_INDEX)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_CREATE:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('animals', 'Animal'), search_index())
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_DROP:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('animals', 'Animal'), search_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0012_animal_filter_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnimalSearchEntry',
+            fields=[
+                ('animal', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='animals.animal')),
+                ('document', models.TextField(db_column='animals_animal_search')),
+            ],
+            options={
+                'db_table': 'animals_animal_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0013_animal_search'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='animal',
+            name='animal_species_filter_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='animal',
+            name='animal_size_filter_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='animal',
+            name='animal_energy_filter_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='animal',
+            name='animal_gender_filter_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='animal',
+            name='animal_age_filter_idx',
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['species_key', 'size_key', 'total_age_months', 'status'], name='animal_species_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['size_key', 'energy_level_key', 'status'], name='animal_size_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['energy_level_key', 'total_age_months', 'status'], name='animal_energy_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['gender_key', 'species_key', 'status'], name='animal_gender_filter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animal',
+            index=models.Index(fields=['total_age_months', 'status'], name='animal_age_filter_idx'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 # animals/models.py
-from django.db import models
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import models, transaction
 from django.utils import timezone
 
 class Shelter(models.Model):
@@ -73,9 +76,64 @@ class Animal(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Denormalized filter columns, kept in step by save() (see update_filter_columns):
+    # lower-cased copies match case-insensitive filters with plain index lookups
+    total_age_months = models.IntegerField(default=0, editable=False)
+    species_key = models.CharField(max_length=50, blank=True, editable=False)
+    size_key = models.CharField(max_length=10, blank=True, editable=False)
+    energy_level_key = models.CharField(max_length=10, blank=True, editable=False)
+    gender_key = models.CharField(max_length=1, blank=True, editable=False)
+    
+    # Source field of every derived filter column
+    FILTER_COLUMNS = {
+        'total_age_months': ('age_years', 'age_months'),
+        'species_key': ('species',),
+        'size_key': ('size',),
+        'energy_level_key': ('energy_level',),
+        'gender_key': ('gender',),
+    }
+    
+    class Meta:
+        indexes = [
+            # Candidate retrieval buckets of the two-stage recommender
+            models.Index(fields=['status', 'species', 'size', 'age_years'], name='animal_retrieval_idx'),
+            # Keyset pagination sorts of the animal list (see pagination.SORTS)
+            models.Index(fields=['arrival_date', 'id'], name='animal_arrival_idx'),
+            models.Index(fields=['age_years', 'age_months', 'id'], name='animal_age_idx'),
+            # Animal list filters: each filter the browse page sends leads one
+            # of these; status comes last so it is checked in the index
+            models.Index(fields=['species_key', 'size_key', 'total_age_months', 'status'],
+                         name='animal_species_filter_idx'),
+            models.Index(fields=['size_key', 'energy_level_key', 'status'], name='animal_size_filter_idx'),
+            models.Index(fields=['energy_level_key', 'total_age_months', 'status'], name='animal_energy_filter_idx'),
+            models.Index(fields=['gender_key', 'species_key', 'status'], name='animal_gender_filter_idx'),
+            models.Index(fields=['total_age_months', 'status'], name='animal_age_filter_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.name} - {self.breed} ({self.get_status_display()})"
     
+    def update_filter_columns(self):
+        """Derive the filter columns; call before bulk_create, which bypasses save()"""
+        self.total_age_months = (self.age_years or 0) * 12 + (self.age_months or 0)
+        self.species_key = (self.species or '').lower()
+        self.size_key = (self.size or '').lower()
+        self.energy_level_key = (self.energy_level or '').lower()
+        self.gender_key = (self.gender or '').lower()
+    
+    def save(self, *args, **kwargs):
+        """Override save to keep the denormalized filter columns in step."""
+        self.update_filter_columns()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Partial saves write the derived columns of the fields they touch
+            update_fields = set(update_fields)
+            for column, sources in self.FILTER_COLUMNS.items():
+                if update_fields.intersection(sources):
+                    update_fields.add(column)
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+    
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -100,4 +158,90 @@ class AnimalViewHistory(models.Model):
         """Override save to automatically set the species from the animal."""
         if not self.species and self.animal:
             self.species = self.animal.species
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class AnimalPopularity(models.Model):
+    """
+    Materialized view counters for an animal, updated as views are logged.
+
+    trending_score is the log of the exponentially decayed view count,
+    measured against a fixed epoch: log(sum(exp(rate * (t - EPOCH)))).
+    Decaying every animal to "now" subtracts the same amount from each
+    score, so ordering by the stored column is ordering by current trend.
+    """
+    # Views lose half their trending weight after this many days
+    TRENDING_HALF_LIFE_DAYS = 7
+    TRENDING_EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+    animal = models.OneToOneField(Animal, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    view_count = models.PositiveIntegerField(default=0, db_index=True)
+    trending_score = models.FloatField(null=True, blank=True, db_index=True,
+                                       help_text="Log of the time-decayed view count (null without views)")
+    last_viewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "Animal popularity"
+        indexes = [
+            # The 'popular' sort of the animal list
+            models.Index(fields=['view_count', 'animal'], name='popularity_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.animal_id}: {self.view_count} views"
+
+    @classmethod
+    def trending_exponent(cls, timestamp):
+        """Log-weight of a single view at the given time"""
+        rate = math.log(2) / (cls.TRENDING_HALF_LIFE_DAYS * 86400)
+        return rate * (timestamp - cls.TRENDING_EPOCH).total_seconds()
+
+    @staticmethod
+    def add_log_weights(a, b):
+        """log(exp(a) + exp(b)) without overflow; None stands for no weight"""
+        if a is None:
+            return b
+        if b is None:
+            return a
+        high, low = max(a, b), min(a, b)
+        return high + math.log1p(math.exp(low - high))
+
+    def add_view(self, timestamp):
+        """Fold one view into the counters"""
+        self.view_count += 1
+        self.trending_score = self.add_log_weights(self.trending_score, self.trending_exponent(timestamp))
+        if self.last_viewed_at is None or timestamp > self.last_viewed_at:
+            self.last_viewed_at = timestamp
+
+    def decayed_view_count(self, now=None):
+        """Current time-decayed view count"""
+        if self.trending_score is None:
+            return 0.0
+        now = now or timezone.now()
+        return math.exp(self.trending_score - self.trending_exponent(now))
+
+    @classmethod
+    def record_view(cls, view):
+        """Update the counters for a newly logged AnimalViewHistory row"""
+        with transaction.atomic():
+            popularity, _ = cls.objects.select_for_update().get_or_create(animal_id=view.animal_id)
+            popularity.add_view(view.timestamp)
+            popularity.save()
+        return popularity
+
+
+class AnimalSearchEntry(models.Model):
+    """
+    Row of the SQLite FTS5 full-text index of an animal (see search.py).
+
+    The virtual table and the triggers that keep it in step with Animal are
+    created by migration 0013, so the model is unmanaged: it only lets
+    Animal queries join the index through the search_entry relation.
+    """
+    animal = models.OneToOneField(Animal, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                  db_constraint=False, related_name='search_entry')
+    # FTS5's hidden column named after the table, the left side of MATCH and the argument of bm25()
+    document = models.TextField(db_column='animals_animal_search')
+
+    class Meta:
+        managed = False
+        db_table = 'animals_animal_search'
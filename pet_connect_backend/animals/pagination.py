@@ -0,0 +1,163 @@
+# animals/pagination.py
+"""
+Keyset (cursor) pagination for the animal list.
+
+Each sort is a fixed tuple of keys ending with the id, so the order is
+total and stable. A page is fetched with a WHERE clause that starts right
+after the last row of the previous page, following a composite index on
+the sort keys, so page 500 costs the same as page one (unlike OFFSET,
+which reads and throws away every row before the page).
+"""
+import json
+import base64
+import binascii
+from collections import namedtuple
+
+from django.db.models import F, Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+SortKey = namedtuple('SortKey', ['field', 'descending'])
+
+# keys orders every animal with a value for the first key; animals without
+# one (e.g. never viewed) follow, ordered by the unranked keys
+Sort = namedtuple('Sort', ['keys', 'unranked'], defaults=[None])
+
+SORTS = {
+    # Newest arrivals first / longest stay at the shelter first (animal_arrival_idx)
+    'newest': Sort((SortKey('arrival_date', True), SortKey('id', True))),
+    'longest_stay': Sort((SortKey('arrival_date', False), SortKey('id', False))),
+    # By age (animal_age_idx)
+    'youngest': Sort((SortKey('age_years', False), SortKey('age_months', False), SortKey('id', False))),
+    'oldest': Sort((SortKey('age_years', True), SortKey('age_months', True), SortKey('id', True))),
+    # Most viewed first, walking popularity_rank_idx; animals never viewed come last
+    'popular': Sort((SortKey('popularity__view_count', True), SortKey('popularity__animal', True)),
+                    unranked=(SortKey('id', True),)),
+    # Best full-text match first; only for searches, which annotate search_rank (see search.py)
+    'relevance': Sort((SortKey('search_rank', True), SortKey('id', False))),
+}
+
+DEFAULT_SORT = 'newest'
+SEARCH_SORT = 'relevance'
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPaginator:
+    """Paginate an Animal queryset by one of SORTS with opaque cursors"""
+
+    query_params = ('sort', 'cursor', 'page_size')
+
+    def __init__(self, sort=DEFAULT_SORT, page_size=DEFAULT_PAGE_SIZE):
+        if sort not in SORTS:
+            raise ValidationError({'sort': f"Unknown sort '{sort}', expected one of: {', '.join(SORTS)}"})
+        self.sort = sort
+        self.page_size = page_size
+
+        # (keys, condition) of each part of the order, read one after the other
+        keys, unranked = SORTS[sort]
+        if unranked is None:
+            self.parts = [(keys, Q())]
+        else:
+            self.parts = [(keys, Q(**{f'{keys[0].field}__isnull': False})),
+                          (unranked, Q(**{f'{keys[0].field}__isnull': True}))]
+
+    @classmethod
+    def requested(cls, request):
+        """Whether the request asks for a page; without these parameters the list is unpaginated"""
+        return any(param in request.query_params for param in cls.query_params)
+
+    @classmethod
+    def from_request(cls, request, default_sort=DEFAULT_SORT):
+        page_size = request.query_params.get('page_size') or DEFAULT_PAGE_SIZE
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            raise ValidationError({'page_size': 'Must be an integer'})
+        if not 1 <= page_size <= MAX_PAGE_SIZE:
+            raise ValidationError({'page_size': f"Must be between 1 and {MAX_PAGE_SIZE}"})
+        return cls(request.query_params.get('sort') or default_sort, page_size)
+
+    def paginate(self, queryset, cursor=None):
+        """
+        Return (animals, next_cursor) for the page after cursor (or the first page).
+
+        queryset may be a values() queryset, the page is then a list of dicts.
+
+        next_cursor is None on the last page.
+        """
+        start, after = self.decode_cursor(cursor) if cursor else (0, None)
+
+        animals = []
+        for part in range(start, len(self.parts)):
+            keys, condition = self.parts[part]
+            page = self._ordered(queryset.filter(condition), keys)
+            if after is not None and part == start:
+                page = page.filter(self._after(keys, after))
+
+            # One extra row tells whether there is a next page
+            animals.extend((part, animal) for animal in page[:self.page_size + 1 - len(animals)])
+            if len(animals) > self.page_size:
+                break
+
+        if len(animals) <= self.page_size:
+            return [animal for _, animal in animals], None
+        animals = animals[:self.page_size]
+        part, last = animals[-1]
+        aliases = [self._alias(i) for i in range(len(self.parts[part][0]))]
+        # Rows are model instances, or dicts of a values() queryset
+        values = [last[alias] if isinstance(last, dict) else getattr(last, alias) for alias in aliases]
+        return [animal for _, animal in animals], self.encode_cursor(part, values)
+
+    def next_link(self, request, next_cursor):
+        if next_cursor is None:
+            return None
+        return replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+
+    def encode_cursor(self, part, values):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        payload = json.dumps({'sort': self.sort, 'part': part, 'after': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Return the (part, values) a cursor points after"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            sort, part, values = payload['sort'], payload['part'], payload['after']
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            raise ValidationError({'cursor': 'Invalid cursor'})
+        if sort != self.sort:
+            raise ValidationError({'cursor': 'Cursor does not belong to this sort'})
+        if part not in range(len(self.parts)) or not isinstance(values, list) \
+                or len(values) != len(self.parts[part][0]) or None in values:
+            raise ValidationError({'cursor': 'Invalid cursor'})
+        return part, values
+
+    def _ordered(self, queryset, keys):
+        annotations = {self._alias(i): F(key.field) for i, key in enumerate(keys)}
+        ordering = [
+            F(self._alias(i)).desc() if key.descending else F(self._alias(i)).asc()
+            for i, key in enumerate(keys)
+        ]
+        return queryset.annotate(**annotations).order_by(*ordering)
+
+    def _after(self, keys, values):
+        """
+        Rows strictly after values in the order of keys: a lexicographic
+        tuple comparison, plus a range bound on the first key so the database
+        reads an index range instead of sorting every remaining row.
+        """
+        first = keys[0]
+        bound = Q(**{f"{self._alias(0)}__{'lte' if first.descending else 'gte'}": values[0]})
+        after = Q(pk__in=[])
+        equal = Q()
+        for i, (key, value) in enumerate(zip(keys, values)):
+            alias = self._alias(i)
+            after |= equal & Q(**{f"{alias}__{'lt' if key.descending else 'gt'}": value})
+            equal &= Q(**{alias: value})
+        return bound & after
+
+    @staticmethod
+    def _alias(position):
+        return f'keyset_{position}'
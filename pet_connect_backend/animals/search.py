@@ -0,0 +1,133 @@
+# animals/search.py
+"""
+Full-text search over the free-text fields of animals.
+
+Each database has its own backend behind the same interface: search()
+narrows an Animal queryset to the animals matching the words of a query
+and annotates them with search_rank (higher is more relevant), so it
+combines with the structured filters and sorts like any other queryset.
+
+- SQLite: an external-content FTS5 table, animals_animal_search, ranked
+  with bm25(). Triggers on animals_animal keep it in step with every
+  insert, update and delete, bulk ones included (see migration 0013).
+- PostgreSQL: a weighted tsvector over the same fields, ranked with
+  ts_rank() and served by the GIN expression index animal_search_idx.
+"""
+import re
+import logging
+from abc import ABC, abstractmethod
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import F, FloatField, Func, Lookup, Value
+
+from .models import AnimalSearchEntry
+
+logger = logging.getLogger(__name__)
+
+# Searched fields and their weight class, most significant first
+SEARCH_FIELDS = [
+    ('breed', 'A'),
+    ('description', 'B'),
+    ('behavior_notes', 'B'),
+    ('health_notes', 'C'),
+]
+
+# Relative weight of each class, PostgreSQL's ts_rank defaults; bm25() gets the same
+SEARCH_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+
+# Text search configuration / tokenizer: both stem English words
+SEARCH_CONFIG = 'english'
+
+SEARCH_INDEX = 'animal_search_idx'
+
+
+class Match(Lookup):
+    """document__match=<FTS5 query>, on the hidden column of an FTS5 table"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+
+AnimalSearchEntry._meta.get_field('document').register_lookup(Match)
+
+
+def search_terms(query):
+    """The words of a query; punctuation and operators are dropped, every word must match"""
+    return re.findall(r'\w+', query or '')
+
+
+def search_vector():
+    """The weighted document of an animal; migration 0013 indexes this exact expression"""
+    return sum(
+        (SearchVector(field, weight=weight, config=SEARCH_CONFIG) for field, weight in SEARCH_FIELDS[1:]),
+        SearchVector(SEARCH_FIELDS[0][0], weight=SEARCH_FIELDS[0][1], config=SEARCH_CONFIG),
+    )
+
+
+class SearchBackend(ABC):
+    """Full-text search of one database vendor"""
+
+    @abstractmethod
+    def search(self, queryset, terms):
+        """Animals of queryset matching every term, annotated with search_rank"""
+
+    @abstractmethod
+    def rebuild(self):
+        """Rebuild the index from the animals table"""
+
+
+class SQLiteSearchBackend(SearchBackend):
+
+    def search(self, queryset, terms):
+        # Quoted, each word is a plain token rather than FTS5 syntax
+        match = ' '.join(f'"{term}"' for term in terms)
+        weights = [Value(SEARCH_WEIGHTS[weight]) for _, weight in SEARCH_FIELDS]
+        # bm25() is lower for better matches
+        rank = Func(F('search_entry__document'), *weights, function='bm25', output_field=FloatField())
+        return queryset.filter(search_entry__document__match=match).annotate(search_rank=-rank)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO animals_animal_search(animals_animal_search) VALUES ('rebuild')")
+
+
+class PostgresSearchBackend(SearchBackend):
+
+    def search(self, queryset, terms):
+        query = SearchQuery(' '.join(terms), search_type='plain', config=SEARCH_CONFIG)
+        vector = search_vector()
+        return (
+            queryset.alias(search_document=vector)
+            .filter(search_document=query)
+            .annotate(search_rank=SearchRank(vector, query))
+        )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"REINDEX INDEX {SEARCH_INDEX}")
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend():
+    backend = SEARCH_BACKENDS.get(connection.vendor)
+    if backend is None:
+        raise ImproperlyConfigured(f"No full-text search backend for {connection.vendor}")
+    return backend()
+
+
+def search_animals(queryset, query):
+    """Animals of queryset matching every word of query, annotated with search_rank"""
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return get_search_backend().search(queryset, terms)
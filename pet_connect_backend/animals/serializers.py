@@ -1,7 +1,35 @@
 # animals/serializers.py
-from rest_framework import serializers
+from functools import lru_cache
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import Animal, Shelter, AnimalViewHistory
 
+
+@lru_cache(maxsize=None)
+def format_age(age_years, age_months):
+    """Age in years and months as a string, e.g. '2 years, 1 month'"""
+    if age_years == 0:
+        if age_months == 1:
+            return "1 month"
+        return f"{age_months} months"
+    elif age_years == 1:
+        if age_months == 0:
+            return "1 year"
+        elif age_months == 1:
+            return "1 year, 1 month"
+        return f"1 year, {age_months} months"
+    else:
+        if age_months == 0:
+            return f"{age_years} years"
+        elif age_months == 1:
+            return f"{age_years} years, 1 month"
+        return f"{age_years} years, {age_months} months"
+
+
 class ShelterSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shelter
@@ -21,22 +49,7 @@ class AnimalSerializer(serializers.ModelSerializer):
     
     def get_age(self, obj):
         """Calculate age in years and months as a string"""
-        if obj.age_years == 0:
-            if obj.age_months == 1:
-                return "1 month"
-            return f"{obj.age_months} months"
-        elif obj.age_years == 1:
-            if obj.age_months == 0:
-                return "1 year"
-            elif obj.age_months == 1:
-                return "1 year, 1 month"
-            return f"1 year, {obj.age_months} months"
-        else:
-            if obj.age_months == 0:
-                return f"{obj.age_years} years"
-            elif obj.age_months == 1:
-                return f"{obj.age_years} years, 1 month"
-            return f"{obj.age_years} years, {obj.age_months} months"
+        return format_age(obj.age_years, obj.age_months)
     
     class Meta:
         model = Animal
@@ -47,6 +60,105 @@ class AnimalSerializer(serializers.ModelSerializer):
             'description', 'status', 'status_display', 'arrival_date', 'created_at', 'updated_at'
         ]
 
+class FastAnimalSerializer:
+    """
+    Read-only stand-in for AnimalSerializer(many=True) on list responses.
+
+    Reads exactly the serialized columns, the shelter's included, with one
+    values() query over a LEFT JOIN, and builds plain dicts: display values
+    come from precomputed choice maps and ages from the cached format_age,
+    so no model instance or serializer field is created per row. The output
+    is the same as AnimalSerializer's, key order included (see tests).
+    """
+    SHELTER_FIELDS = ShelterSerializer.Meta.fields
+    COLUMNS = (
+        'id', 'name', 'species', 'breed', 'age_years', 'age_months', 'gender',
+        'vaccinated', 'neutered', 'health_notes', 'good_with_kids', 'good_with_cats', 'good_with_dogs',
+        'behavior_notes', 'description', 'status', 'arrival_date', 'created_at', 'updated_at',
+        'shelter_id', *(f'shelter__{field}' for field in SHELTER_FIELDS if field != 'id'),
+    )
+
+    GENDER_DISPLAY = dict(Animal.GENDER_CHOICES)
+    STATUS_DISPLAY = dict(Animal.STATUS_CHOICES)
+
+    # DRF's own fields, so dates follow the DATE_FORMAT / DATETIME_FORMAT settings and timezone
+    date_field = serializers.DateField()
+    datetime_field = serializers.DateTimeField()
+
+    def __init__(self, animals):
+        """animals: an Animal queryset, or rows of values(*COLUMNS) (see values)"""
+        self.animals = animals
+        self.format_datetime = self.datetime_field.to_representation
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.COLUMNS)
+
+    @property
+    def data(self):
+        rows = self.animals
+        if isinstance(rows, QuerySet):
+            rows = self.values(rows)
+        self.format_datetime = self.datetime_formatter()
+        return [self.to_representation(row) for row in rows]
+
+    def datetime_formatter(self):
+        """
+        DateTimeField.to_representation for ISO 8601 output, with the current
+        timezone looked up once instead of once per value.
+        """
+        output_format = api_settings.DATETIME_FORMAT
+        if not settings.USE_TZ or not isinstance(output_format, str) or output_format.lower() != ISO_8601:
+            return self.datetime_field.to_representation
+        current_timezone = timezone.get_current_timezone()
+        fallback = self.datetime_field.to_representation
+
+        def format_datetime(value):
+            if not value or timezone.is_naive(value):
+                return fallback(value)
+            value = value.astimezone(current_timezone).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+
+        return format_datetime
+
+    def to_representation(self, row):
+        gender = row['gender']
+        status = row['status']
+        shelter_id = row['shelter_id']
+        shelter = None
+        if shelter_id is not None:
+            shelter = {'id': shelter_id}
+            for field in self.SHELTER_FIELDS[1:]:
+                shelter[field] = row[f'shelter__{field}']
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'species': row['species'],
+            'breed': row['breed'],
+            'age_years': row['age_years'],
+            'age_months': row['age_months'],
+            'age': format_age(row['age_years'], row['age_months']),
+            'gender': gender,
+            'gender_display': self.GENDER_DISPLAY.get(gender, gender),
+            'shelter': shelter,
+            'vaccinated': row['vaccinated'],
+            'neutered': row['neutered'],
+            'health_notes': row['health_notes'],
+            'good_with_kids': row['good_with_kids'],
+            'good_with_cats': row['good_with_cats'],
+            'good_with_dogs': row['good_with_dogs'],
+            'behavior_notes': row['behavior_notes'],
+            'description': row['description'],
+            'status': status,
+            'status_display': self.STATUS_DISPLAY.get(status, status),
+            'arrival_date': self.date_field.to_representation(row['arrival_date']),
+            'created_at': self.format_datetime(row['created_at']),
+            'updated_at': self.format_datetime(row['updated_at']),
+        }
+
+
 class AnimalViewHistorySerializer(serializers.ModelSerializer):
     animal = AnimalSerializer(read_only=True)
     
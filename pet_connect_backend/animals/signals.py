@@ -0,0 +1,33 @@
+# animals/signals.py
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .facets import invalidate_facets
+from .models import Animal, AnimalPopularity, AnimalViewHistory, Shelter
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=AnimalViewHistory)
+def update_popularity_on_view(sender, instance, created, **kwargs):
+    """Count every newly logged view towards the animal's popularity."""
+    if not created:
+        return
+
+    try:
+        AnimalPopularity.record_view(instance)
+    except Exception as e:
+        # Never fail the view logging because of the counters
+        logger.error(f"Error updating popularity for animal {instance.animal_id}: {str(e)}")
+
+
+@receiver(post_save, sender=Animal)
+@receiver(post_delete, sender=Animal)
+@receiver(post_save, sender=Shelter)
+@receiver(post_delete, sender=Shelter)
+def invalidate_facets_on_change(sender, instance, **kwargs):
+    """Any change to the catalog can move facet counts (shelters for their names)."""
+    transaction.on_commit(invalidate_facets)
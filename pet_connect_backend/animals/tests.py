@@ -1,3 +1,312 @@
+"""
+Pet Connect - Tests for Animals
+------------------------------
+Unit tests for the animal list API and the popularity counters.
+"""
+
+import json
+from datetime import date, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .facets import get_facet_cache
+from .models import Animal, AnimalPopularity, AnimalViewHistory, Shelter
+from .serializers import AnimalSerializer, FastAnimalSerializer
+
+
+class AnimalListTestCase(TestCase):
+    """Shared fixture: a dozen animals with distinct arrival dates, ages and view counts"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.animals = []
+        for i in range(12):
+            animal = Animal.objects.create(
+                name=f'Animal {i}', species='Dog' if i % 2 else 'Cat', breed='Mixed', gender='F',
+                age_years=i % 5, age_months=i % 3, arrival_date=date(2025, 1, 1) + timedelta(days=i // 2),
+            )
+            self.animals.append(animal)
+            if i % 3:
+                AnimalPopularity.objects.create(animal=animal, view_count=i % 4)
+
+    def fetch_all(self, params):
+        """Follow the next links from the first page, returning every page's ids"""
+        pages = []
+        response = self.client.get('/api/animals/', params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([animal['id'] for animal in response.data['results']])
+            if response.data['next'] is None:
+                return pages
+            response = self.client.get(response.data['next'])
+
+
+class KeysetPaginationTests(AnimalListTestCase):
+    """Cursor pagination of AnimalListView"""
+
+    def test_unpaginated_by_default(self):
+        response = self.client.get('/api/animals/')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 12)
+
+    def test_sorts_page_through_everything_in_order(self):
+        popularity = {p.animal_id: p.view_count for p in AnimalPopularity.objects.all()}
+        expected = {
+            'newest': sorted(self.animals, key=lambda a: (a.arrival_date, a.id), reverse=True),
+            'longest_stay': sorted(self.animals, key=lambda a: (a.arrival_date, a.id)),
+            'youngest': sorted(self.animals, key=lambda a: (a.age_years, a.age_months, a.id)),
+            'oldest': sorted(self.animals, key=lambda a: (a.age_years, a.age_months, a.id), reverse=True),
+            # Never viewed animals (no counter row) last
+            'popular': sorted(self.animals, key=lambda a: (a.id in popularity, popularity.get(a.id, 0), a.id),
+                              reverse=True),
+        }
+        for sort, animals in expected.items():
+            pages = self.fetch_all({'sort': sort, 'page_size': 5})
+            self.assertEqual([len(page) for page in pages], [5, 5, 2], sort)
+            self.assertEqual(sum(pages, []), [animal.id for animal in animals], sort)
+
+    def test_filters_apply_to_every_page(self):
+        pages = self.fetch_all({'species': 'dog', 'sort': 'oldest', 'page_size': 4})
+        ids = sum(pages, [])
+        self.assertEqual(sorted(ids), [animal.id for animal in self.animals if animal.species == 'Dog'])
+
+    def test_invalid_parameters(self):
+        for params in [{'sort': 'name'}, {'page_size': 0}, {'page_size': 'ten'}, {'cursor': 'not-a-cursor'}]:
+            self.assertEqual(self.client.get('/api/animals/', params).status_code, 400, params)
+
+        # A cursor only continues the sort it was issued for
+        next_link = self.client.get('/api/animals/', {'sort': 'newest', 'page_size': 2}).data['next']
+        cursor = next_link.split('cursor=')[1]
+        response = self.client.get('/api/animals/', {'sort': 'youngest', 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+
+
+class AnimalFilterTests(AnimalListTestCase):
+    """Structured filters of AnimalListView on the denormalized columns"""
+
+    def get_ids(self, params):
+        response = self.client.get('/api/animals/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(animal['id'] for animal in response.data)
+
+    def test_save_keeps_filter_columns_in_step(self):
+        animal = self.animals[0]
+        animal.age_years, animal.age_months, animal.species = 3, 4, 'Rabbit'
+        animal.save(update_fields=['age_years', 'age_months', 'species'])
+        animal = Animal.objects.get(pk=animal.pk)
+        self.assertEqual(animal.total_age_months, 40)
+        self.assertEqual(animal.species_key, 'rabbit')
+
+    def test_age_range_includes_years(self):
+        ids = self.get_ids({'age_min': 13, 'age_max': 36})
+        expected = [a.id for a in self.animals if 13 <= a.age_years * 12 + a.age_months <= 36]
+        self.assertEqual(ids, expected)
+
+    def test_filters_ignore_case(self):
+        self.assertEqual(self.get_ids({'species': 'CAT', 'gender': 'f'}),
+                         [a.id for a in self.animals if a.species == 'Cat'])
+
+    def test_status_filter(self):
+        Animal.objects.filter(pk=self.animals[0].pk).update(status='AD')
+        self.assertEqual(self.get_ids({'status': 'AD'}), [self.animals[0].id])
+        self.assertEqual(len(self.get_ids({'species': 'cat'})), 6)
+        self.assertEqual(self.client.get('/api/animals/', {'status': 'X'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/animals/', {'age_min': 'two'}).status_code, 400)
+
+
+class AnimalFacetTests(AnimalListTestCase):
+    """Cached facet counts of AnimalFacetsView"""
+
+    def setUp(self):
+        super().setUp()
+        get_facet_cache().clear()
+
+    def get_facets(self, params=None):
+        response = self.client.get('/api/animals/facets/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_follow_filters(self):
+        data = self.get_facets()
+        self.assertEqual(data['total'], 12)
+        self.assertEqual({e['label']: e['count'] for e in data['facets']['species']}, {'Cat': 6, 'Dog': 6})
+        # Ages 0y0m - 4y1m, young below 24 months
+        young = sum(1 for a in self.animals if a.age_years * 12 + a.age_months < 24)
+        self.assertEqual([(e['value'], e['count']) for e in data['facets']['age']],
+                         [('young', young), ('adult', 12 - young)])
+
+        data = self.get_facets({'species': 'DOG', 'age_min': 24})
+        expected = [a for a in self.animals if a.species == 'Dog' and a.age_years * 12 + a.age_months >= 24]
+        self.assertEqual(data['total'], len(expected))
+        self.assertEqual(data['facets']['species'], [{'value': 'dog', 'label': 'Dog', 'count': len(expected)}])
+
+    def catalog_queries(self, params):
+        """Queries a facets request runs against the catalog tables, leaving out the cache's"""
+        with CaptureQueriesContext(connection) as queries:
+            self.get_facets(params)
+        return [query for query in queries.captured_queries if '"animals_' in query['sql']]
+
+    def test_cached_until_an_animal_changes(self):
+        # One grouped query (no shelters yet, so no name lookup)
+        self.assertEqual(len(self.catalog_queries({'species': 'cat'})), 1)
+        # Same filter set, normalized
+        self.assertEqual(self.catalog_queries({'species': 'Cat'}), [])
+
+        shelter = Shelter.objects.create(name='North Shelter')
+        with self.captureOnCommitCallbacks(execute=True):
+            animal = self.animals[0]
+            animal.shelter = shelter
+            animal.save()
+        data = self.get_facets({'species': 'cat'})
+        self.assertIn({'value': shelter.id, 'label': 'North Shelter', 'count': 1}, data['facets']['shelter'])
+
+    def test_invalid_filters(self):
+        self.assertEqual(self.client.get('/api/animals/facets/', {'age_max': 'old'}).status_code, 400)
+
+
+class AnimalSearchTests(AnimalListTestCase):
+    """Full-text search (q) of AnimalListView"""
+
+    def setUp(self):
+        super().setUp()
+        self.shy, self.calm, self.both = self.animals[:3]
+        Animal.objects.filter(pk=self.shy.pk).update(description='A shy terrier who loves long walks')
+        self.calm.behavior_notes = 'Calm and gentle'
+        self.calm.save()
+        self.both.description = 'Shy at first, then calm'
+        self.both.breed = 'Walker Hound'
+        self.both.save()
+
+    def search(self, params):
+        response = self.client.get('/api/animals/', params)
+        self.assertEqual(response.status_code, 200)
+        return [animal['id'] for animal in response.data]
+
+    def test_index_follows_writes(self):
+        # Stemmed: "walking" matches "walks", and the breed "Walker" does not
+        self.assertEqual(self.search({'q': 'walking'}), [self.shy.id])
+        self.assertEqual(set(self.search({'q': 'calm'})), {self.calm.id, self.both.id})
+
+        self.calm.behavior_notes = ''
+        self.calm.save()
+        Animal.objects.filter(pk=self.shy.pk).delete()
+        self.assertEqual(self.search({'q': 'calm'}), [self.both.id])
+        self.assertEqual(self.search({'q': 'walking'}), [])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search({'q': 'shy calm'}), [self.both.id])
+        # Operators and punctuation are plain text, not FTS syntax
+        self.assertEqual(self.search({'q': 'shy" (calm*: -'}), [self.both.id])
+        self.assertEqual(self.search({'q': '!!!'}), [])
+
+    def test_ranked_and_combined_with_filters(self):
+        # The breed weighs more than the description, and a shorter breed more than a longer one
+        Animal.objects.filter(pk=self.calm.pk).update(breed='Hound')
+        Animal.objects.filter(pk=self.shy.pk).update(description='Hound mix, hound at heart')
+        self.assertEqual(self.search({'q': 'hound'}), [self.calm.id, self.both.id, self.shy.id])
+
+        self.assertEqual(self.search({'q': 'hound', 'species': self.calm.species}), [self.calm.id])
+
+        response = self.client.get('/api/animals/', {'q': 'hound', 'page_size': 2})
+        self.assertEqual([a['id'] for a in response.data['results']], [self.calm.id, self.both.id])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([a['id'] for a in response.data['results']], [self.shy.id])
+        self.assertIsNone(response.data['next'])
+
+        self.assertEqual(self.client.get('/api/animals/', {'sort': 'relevance'}).status_code, 400)
+
+
+class FastAnimalSerializerTests(AnimalListTestCase):
+    """FastAnimalSerializer against the DRF AnimalSerializer it stands in for"""
+
+    def setUp(self):
+        super().setUp()
+        north = Shelter.objects.create(name='North', city='Leeds', website='https://north.example.org')
+        south = Shelter.objects.create(name='South')
+        for i, animal in enumerate(self.animals):
+            animal.shelter = [north, south, None][i % 3]
+            animal.status = ['A', 'P', 'AD'][i % 3]
+            animal.gender = ['M', 'F', 'U'][i % 3]
+            animal.age_years, animal.age_months = i % 3, (i * 5) % 12
+            animal.save()
+
+    def test_same_payload_as_animal_serializer(self):
+        animals = Animal.objects.order_by('id')
+        expected = AnimalSerializer(animals, many=True).data
+        # Same keys in the same order and the same JSON values
+        self.assertEqual(json.dumps(FastAnimalSerializer(animals).data), json.dumps(expected))
+
+        # Datetimes follow the active timezone like DRF's
+        with timezone.override('Africa/Johannesburg'):
+            self.assertEqual(json.dumps(FastAnimalSerializer(animals).data),
+                             json.dumps(AnimalSerializer(animals, many=True).data))
+
+    def test_list_view_runs_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/animals/')
+        expected = AnimalSerializer(Animal.objects.all(), many=True).data
+        self.assertEqual(json.loads(json.dumps(response.data)), json.loads(json.dumps(expected)))
+
+        # One query per page, whatever the number of shelters
+        with self.assertNumQueries(2):
+            pages = self.fetch_all({'sort': 'newest', 'page_size': 8})
+        self.assertEqual(sum(len(page) for page in pages), 12)
+
+
+class AnimalPopularityTests(TestCase):
+    """Materialized view and trending counters"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='password123')
+        self.now = timezone.now()
+
+    def view(self, animal, days_ago):
+        return AnimalViewHistory.objects.create(
+            user=self.user, animal=animal, species=animal.species, view_duration=30,
+            timestamp=self.now - timedelta(days=days_ago),
+        )
+
+    def test_views_update_the_counters(self):
+        animal = Animal.objects.create(name='Rex', species='Dog', gender='M')
+        self.view(animal, AnimalPopularity.TRENDING_HALF_LIFE_DAYS)
+        self.view(animal, 0)
+
+        popularity = AnimalPopularity.objects.get(animal=animal)
+        self.assertEqual(popularity.view_count, 2)
+        self.assertEqual(popularity.last_viewed_at, self.now)
+        # The older view has lost half its weight
+        self.assertAlmostEqual(popularity.decayed_view_count(self.now), 1.5)
+
+    def test_trending_favours_recent_views(self):
+        classic = Animal.objects.create(name='Classic', species='Dog', gender='M')
+        newcomer = Animal.objects.create(name='Newcomer', species='Cat', gender='F')
+        for _ in range(3):
+            self.view(classic, 30)
+        self.view(newcomer, 0)
+
+        by_views = AnimalPopularity.objects.order_by('-view_count').values_list('animal_id', flat=True)
+        by_trend = AnimalPopularity.objects.order_by('-trending_score').values_list('animal_id', flat=True)
+        self.assertEqual(list(by_views), [classic.id, newcomer.id])
+        self.assertEqual(list(by_trend), [newcomer.id, classic.id])
+
+    def test_rebuild_matches_incremental_counters(self):
+        animals = [Animal.objects.create(name=f'Pet {i}', species='Dog', gender='M') for i in range(3)]
+        for days_ago, animal in [(20, animals[0]), (3, animals[0]), (1, animals[1]), (0, animals[0])]:
+            self.view(animal, days_ago)
+        incremental = {p.animal_id: p for p in AnimalPopularity.objects.all()}
+
+        call_command('rebuild_popularity', stdout=StringIO())
 
-# Create your tests here.
+        rebuilt = {p.animal_id: p for p in AnimalPopularity.objects.all()}
+        self.assertEqual(set(rebuilt), {animals[0].id, animals[1].id})
+        for animal_id, popularity in rebuilt.items():
+            self.assertEqual(popularity.view_count, incremental[animal_id].view_count)
+            self.assertEqual(popularity.last_viewed_at, incremental[animal_id].last_viewed_at)
+            self.assertAlmostEqual(popularity.trending_score, incremental[animal_id].trending_score)
@@ -11,11 +11,16 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.utils.decorators import method_decorator
 from django.http import JsonResponse
+from .facets import get_facets
+from .filters import apply_animal_filters
 from .models import Animal, AnimalViewHistory
-from .serializers import AnimalSerializer
+from .pagination import DEFAULT_SORT, SEARCH_SORT, KeysetPaginator
+from .search import search_animals
+from .serializers import AnimalSerializer, FastAnimalSerializer
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.permissions import AllowAny
 
@@ -69,47 +74,59 @@ class AnimalViewSet(viewsets.ModelViewSet):
 class AnimalListView(APIView):
     """
     API view for filtering animals by various criteria.
+
+    q searches breed, description and behavior and health notes (see
+    search.py), every word must match; results come best match first.
+
+    Passing sort, cursor or page_size returns one keyset-paginated page as
+    {"next": <url or null>, "results": [...]}; sort is one of newest,
+    longest_stay, youngest, oldest, popular and, when searching, relevance
+    (the default then; see pagination.SORTS).
+    Without them every matching animal is returned as a plain list.
+
+    Animals are serialized by FastAnimalSerializer, the same payload as
+    AnimalSerializer in a single query.
     """
     permission_classes = [AllowAny]
     @method_decorator(ensure_csrf_cookie)
     def get(self, request):
         """Get filtered animals"""
-        animals = Animal.objects.all()
-
-        # Apply filters from query parameters
-        species = request.query_params.get('species')
-        size = request.query_params.get('size')
-        energy_level = request.query_params.get('energy_level')
-        gender = request.query_params.get('gender')
-        age_min = request.query_params.get('age_min')
-        age_max = request.query_params.get('age_max')
-
-        # Apply filters if specified
-        if species:
-            animals = animals.filter(species__iexact=species)
-        if size:
-            animals = animals.filter(size__iexact=size)
-        if energy_level:
-            animals = animals.filter(energy_level__iexact=energy_level)
-        if gender:
-            animals = animals.filter(gender__iexact=gender)
-        if age_min:
-            # Handle both age_months and age fields
-            if hasattr(Animal, 'age_months'):
-                animals = animals.filter(age_months__gte=int(age_min))
-            else:
-                animals = animals.filter(age__gte=float(age_min) / 12)
-        if age_max:
-            # Handle both age_months and age fields
-            if hasattr(Animal, 'age_months'):
-                animals = animals.filter(age_months__lte=int(age_max))
-            else:
-                animals = animals.filter(age__lte=float(age_max) / 12)
-
-        serializer = AnimalSerializer(animals, many=True)
+        animals = apply_animal_filters(Animal.objects.all(), request.query_params)
+
+        query = request.query_params.get('q', '').strip()
+        if query:
+            animals = search_animals(animals, query)
+
+        if KeysetPaginator.requested(request):
+            paginator = KeysetPaginator.from_request(request, default_sort=SEARCH_SORT if query else DEFAULT_SORT)
+            if paginator.sort == SEARCH_SORT and not query:
+                raise ValidationError({'sort': f"'{SEARCH_SORT}' needs a search query (q)"})
+            page, next_cursor = paginator.paginate(FastAnimalSerializer.values(animals),
+                                                   request.query_params.get('cursor'))
+            serializer = FastAnimalSerializer(page)
+            return Response({'next': paginator.next_link(request, next_cursor), 'results': serializer.data})
+
+        if query:
+            animals = animals.order_by('-search_rank', 'id')
+        serializer = FastAnimalSerializer(animals)
         return Response(serializer.data)
 
 
+class AnimalFacetsView(APIView):
+    """
+    Facet counts of the animals matching the list's filters.
+
+    Takes the same filter parameters as AnimalListView and returns
+    {"total": n, "facets": {"species": [{"value", "label", "count"}, ...], ...}}
+    for species, size, energy_level, gender, age (buckets, with the
+    age_min/age_max that select them) and shelter.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response(get_facets(request.query_params))
+
+
 class LogAnimalViewView(APIView):
         """API view to log animal views for recommendation tracking"""
         
@@ -0,0 +1,41 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings, read automatically when gunicorn starts in this directory.
+
+Each worker writes its Prometheus metrics to PROMETHEUS_MULTIPROC_DIR so
+/metrics can add them up whichever worker serves the scrape.
+
+The application is preloaded in the master, which publishes a fresh
+catalog snapshot and loads the recommendation artifacts before forking:
+workers share those pages instead of each building its own copy. Code
+changes then need a full restart, a HUP only re-forks the same code.
+"""
+import os
+import shutil
+import tempfile
+
+# prometheus_client picks its value class when it is first imported, so the
+# directory has to be in the environment before anything imports it; that
+# includes this file, hence the import inside child_exit.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'petconnect_prometheus_multiproc')
+)
+
+# Values left over from a previous run would be added to the new ones. This
+# runs when the config is read, before the preloaded app creates its metrics.
+shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+preload_app = os.environ.get('GUNICORN_PRELOAD_APP', '1') == '1'
+
+
+def when_ready(server):
+    # Runs in the master once the (preloaded) app is imported, before any fork
+    if server.cfg.preload_app:
+        from recommendations.artifacts import preload_artifacts
+        preload_artifacts()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
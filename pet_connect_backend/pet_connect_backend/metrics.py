@@ -0,0 +1,116 @@
+# metrics.py
+"""
+Prometheus metrics for the backend, served in text format at /metrics.
+
+Under gunicorn every worker is its own process, so when the
+PROMETHEUS_MULTIPROC_DIR environment variable points at a shared directory
+prometheus_client keeps each worker's values in memory-mapped files there
+and the /metrics view adds them up across workers (see gunicorn.conf.py,
+which empties the directory on start and cleans up after dead workers).
+Without it the metrics are those of the current process.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+REQUEST_LATENCY = Histogram(
+    'petconnect_http_request_duration_seconds', 'Request latency by view',
+    ['view', 'method', 'status'], buckets=LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    'petconnect_http_request_db_queries', 'SQL queries run per request by view',
+    ['view'], buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_QUERY_TIME = Histogram(
+    'petconnect_http_request_db_duration_seconds', 'Time spent in SQL per request by view',
+    ['view'], buckets=LATENCY_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    'petconnect_cache_requests_total', 'Cache lookups by cache and result (hit or miss)',
+    ['cache', 'result'],
+)
+VIEWS_RECORDED = Counter(
+    'petconnect_animal_views_recorded_total', 'AnimalViewHistory rows written',
+)
+STAGE_LATENCY = Histogram(
+    'petconnect_recommendation_stage_duration_seconds', 'Recommendation request stage latency',
+    ['stage'], buckets=LATENCY_BUCKETS,
+)
+STAGE_QUERIES = Histogram(
+    'petconnect_recommendation_stage_db_queries', 'SQL queries run per recommendation request stage',
+    ['stage'], buckets=QUERY_COUNT_BUCKETS,
+)
+
+
+def observe_cache_lookup(cache_name, hit):
+    CACHE_REQUESTS.labels(cache_name, 'hit' if hit else 'miss').inc()
+
+
+def observe_stage(name, seconds, queries):
+    STAGE_LATENCY.labels(name).observe(seconds)
+    STAGE_QUERIES.labels(name).observe(queries)
+
+
+class _QueryTimer:
+    """connection.execute_wrapper hook adding up the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Record latency and SQL usage of every request, labelled by the view that served it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = _QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        # Route names keep the label set small, unlike raw paths with ids in them
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else 'unmatched'
+
+        REQUEST_LATENCY.labels(view, request.method, str(response.status_code)).observe(elapsed)
+        REQUEST_QUERIES.labels(view).observe(queries.count)
+        REQUEST_QUERY_TIME.labels(view).observe(queries.seconds)
+        return response
+
+
+def metrics_view(request):
+    """Expose every metric in the Prometheus text format"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        if request.headers.get('Authorization') != f"Bearer {token}":
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        # Without a token the metrics are only served in development
+        return HttpResponseForbidden()
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -56,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pet_connect_backend.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware', 
@@ -169,6 +170,73 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Recommendation engine
+# Offline artifacts (content vectors, model files) that workers load memory-mapped
+RECOMMENDATION_ARTIFACT_DIR = os.environ.get(
+    'RECOMMENDATION_ARTIFACT_DIR', os.path.join(BASE_DIR, 'artifacts')
+)
+
+# Seconds between a worker's checks of the artifact manifest for new
+# versions, and how many versions of each artifact are kept on disk
+RECOMMENDATION_ARTIFACT_CHECK_INTERVAL = int(os.environ.get('RECOMMENDATION_ARTIFACT_CHECK_INTERVAL', 30))
+RECOMMENDATION_ARTIFACT_KEEP_VERSIONS = 3
+
+# 'full' scores every available animal per request; 'two_stage' re-ranks a
+# bounded candidate pool fetched with indexed queries, so request cost stays
+# flat as the catalog grows
+RECOMMENDATION_RETRIEVAL_MODE = os.environ.get('RECOMMENDATION_RETRIEVAL_MODE', 'full')
+
+# Seconds between republishes of the catalog snapshot by
+# build_catalog_snapshot --watch (requests never republish it); a worker's
+# own saves and deletes patch its copy immediately, this bounds how long
+# changes made by other workers take to show up
+RECOMMENDATION_CATALOG_MAX_AGE = int(os.environ.get('RECOMMENDATION_CATALOG_MAX_AGE', 60))
+
+# Metrics
+# /metrics serves Prometheus text format; scrapers must send METRICS_TOKEN
+# as a bearer token, and without one it is only served when DEBUG is on.
+# Set PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py) to aggregate the
+# metrics of every gunicorn worker.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Caches
+# The 'recommendations' cache holds each user's ranked recommendation list.
+# Invalidations must reach every worker process, so it defaults to the
+# shared database cache (run `python manage.py createcachetable` once);
+# point RECOMMENDATION_CACHE_BACKEND/LOCATION at Redis or memcached to take
+# it off the database. Past MAX_ENTRIES the database cache culls a third
+# of its entries in key order, not least recently used; for LRU eviction
+# use django.core.cache.backends.redis.RedisCache with the server's
+# maxmemory-policy set to allkeys-lru. A per-process LocMemCache is only correct with a
+# single worker. The 'facets' cache holds the animal list's facet counts
+# per filter set and is shared the same way, so a save invalidates the
+# counts of every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recommendations': {
+        'BACKEND': os.environ.get(
+            'RECOMMENDATION_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'
+        ),
+        'LOCATION': os.environ.get('RECOMMENDATION_CACHE_LOCATION', 'recommendation_cache'),
+        'TIMEOUT': 15 * 60,  # Seconds a cached list stays fresh
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'facets': {
+        'BACKEND': os.environ.get(
+            'FACET_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'
+        ),
+        'LOCATION': os.environ.get('FACET_CACHE_LOCATION', 'facet_cache'),
+        'TIMEOUT': 10 * 60,  # Also bounds staleness after bulk writes, which skip the signals
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
@@ -7,10 +7,13 @@ from django.views.decorators.csrf import ensure_csrf_cookie
 from django.http import JsonResponse
 from rest_framework.routers import DefaultRouter  # Add this line
 from animals.views import AnimalViewSet
+from .metrics import metrics_view
 from recommendations.views import (
     RecommendationView, 
+    RecommendationTimingsView,
     record_animal_view, 
     RecentViewsView,
+    SimilarAnimalsView,
     get_csrf_token
 )
 
@@ -26,14 +29,17 @@ def get_csrf_token(request):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/csrf/', get_csrf_token, name='csrf'),
+    path('api/animals/<int:pk>/similar/', SimilarAnimalsView.as_view(), name='similar_animals'),
     path('api/animals/', include('animals.urls')),
     path('api/', include(router.urls)),
     path('api/users/', include('users.urls')),
     path('', include('pet_connect_backend.csrf_urls')),
     path('api/recommendations/csrf-token/', get_csrf_token, name='csrf_token'),
     path('api/recommendations/', RecommendationView.as_view(), name='recommendations'),
+    path('api/recommendations/timings/', RecommendationTimingsView.as_view(), name='recommendation_timings'),
     path('api/recommendations/record-view/', record_animal_view, name='record_animal_view'),
     path('api/recommendations/recent-views/', RecentViewsView.as_view(), name='recent_views'),
+    path('metrics', metrics_view, name='metrics'),
     
     
  
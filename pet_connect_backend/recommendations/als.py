@@ -0,0 +1,224 @@
+# recommendations/als.py
+
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from django.utils import timezone
+
+from .artifacts import get_artifact_registry, get_artifact_store
+
+logger = logging.getLogger(__name__)
+
+FACTORS_ARTIFACT = 'factors'
+
+
+def load_interactions(half_life_days=30, chunk_size=10000):
+    """
+    Stream the view history into a sparse user x animal strength matrix.
+
+    Every view counts 1 + log(1 + seconds viewed), halved for every
+    half_life_days it is old; repeat views of an animal add up. Returns
+    (user_ids, animal_ids, matrix) with sorted id arrays aligned with the
+    matrix rows and columns.
+    """
+    from animals.models import Animal, AnimalViewHistory
+
+    now = timezone.now()
+    animal_ids = np.asarray(Animal.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+
+    users, animals, strengths = [], [], []
+    history = AnimalViewHistory.objects.values_list('user_id', 'animal_id', 'timestamp', 'view_duration')
+    for user_id, animal_id, timestamp, view_duration in history.iterator(chunk_size=chunk_size):
+        age_days = max((now - timestamp).total_seconds(), 0) / 86400
+        users.append(user_id)
+        animals.append(animal_id)
+        strengths.append((1 + np.log1p(max(view_duration or 0, 0))) * 0.5 ** (age_days / half_life_days))
+
+    users = np.asarray(users, dtype=np.int64)
+    animals = np.asarray(animals, dtype=np.int64)
+    strengths = np.asarray(strengths, dtype=np.float64)
+
+    # Drop views of animals deleted since they were logged
+    if len(animal_ids):
+        columns = np.minimum(np.searchsorted(animal_ids, animals), len(animal_ids) - 1)
+        known = animal_ids[columns] == animals
+    else:
+        columns = np.zeros(len(animals), dtype=np.int64)
+        known = np.zeros(len(animals), dtype=bool)
+
+    user_ids, rows = np.unique(users[known], return_inverse=True)
+    matrix = sp.csr_matrix(
+        (strengths[known], (rows, columns[known])), shape=(len(user_ids), len(animal_ids))
+    )
+    return user_ids, animal_ids, matrix
+
+
+class ImplicitALS:
+    """
+    Implicit-feedback matrix factorization (Hu, Koren & Volinsky 2008).
+
+    Every observed user/animal pair has preference 1 with confidence
+    1 + alpha * strength; everything else has preference 0 with confidence
+    1. Alternating least squares solves all user factors with the item
+    factors fixed and vice versa. Rows are solved in blocks on a thread
+    pool: each block stacks its normal equations and hands them to one
+    batched LAPACK solve, which runs outside the GIL.
+    """
+
+    def __init__(self, factors=32, regularization=0.1, alpha=40.0, iterations=10,
+                 workers=4, block_size=256, random_state=42):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.workers = workers
+        self.block_size = block_size
+        self.random_state = random_state
+
+    def fit(self, matrix):
+        """Fit on a users x items strength matrix, returning (user_factors, item_factors)"""
+        rng = np.random.default_rng(self.random_state)
+        n_users, n_items = matrix.shape
+        user_factors = rng.normal(scale=0.01, size=(n_users, self.factors))
+        item_factors = rng.normal(scale=0.01, size=(n_items, self.factors))
+
+        confidence = matrix.tocsr(copy=True)
+        confidence.data = 1 + self.alpha * confidence.data
+        confidence_t = confidence.T.tocsr()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for iteration in range(self.iterations):
+                user_factors = self._solve(confidence, item_factors, pool)
+                item_factors = self._solve(confidence_t, user_factors, pool)
+                logger.debug(f"ALS iteration {iteration + 1}/{self.iterations} done")
+
+        return user_factors.astype(np.float32), item_factors.astype(np.float32)
+
+    def _solve(self, confidence, fixed, pool):
+        """Solve every row's factors against the fixed side"""
+        n_rows = confidence.shape[0]
+        solved = np.zeros((n_rows, self.factors))
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.factors)
+
+        blocks = [(start, min(start + self.block_size, n_rows)) for start in range(0, n_rows, self.block_size)]
+        for _ in pool.map(lambda block: self._solve_block(confidence, fixed, gram, solved, *block), blocks):
+            pass
+        return solved
+
+    def _solve_block(self, confidence, fixed, gram, solved, start, end):
+        lhs = np.repeat(gram[None, :, :], end - start, axis=0)
+        rhs = np.zeros((end - start, self.factors))
+        for i, row in enumerate(range(start, end)):
+            begin, finish = confidence.indptr[row], confidence.indptr[row + 1]
+            if begin == finish:
+                continue
+            columns = confidence.indices[begin:finish]
+            weights = confidence.data[begin:finish]
+            observed = fixed[columns]
+            # Y^T (C_u - I) Y only involves the observed items
+            lhs[i] += observed.T @ ((weights - 1)[:, None] * observed)
+            rhs[i] = observed.T @ weights
+        solved[start:end] = np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+
+class FactorModel:
+    """Trained user and animal factors; scoring a user is one dot product"""
+
+    def __init__(self, user_ids, animal_ids, user_factors, item_factors, version=None):
+        self.user_ids = user_ids        # Sorted, aligned with user_factors
+        self.animal_ids = animal_ids    # Sorted, aligned with item_factors
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.version = version
+
+    def user_vector(self, user_id):
+        """Return the user's factor vector, or None if they were not in the training data"""
+        if not len(self.user_ids):
+            return None
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position >= len(self.user_ids) or self.user_ids[position] != user_id:
+            return None
+        return self.user_factors[position]
+
+    def score_users(self, user_ids, candidate_ids):
+        """
+        Score candidates for several users at once.
+
+        Returns a (users x candidates) array of predicted preferences
+        clipped to [0, 1], and a mask of the users the model knows.
+        """
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        scores = np.zeros((len(user_ids), len(candidate_ids)))
+        known_users = np.zeros(len(user_ids), dtype=bool)
+        if not len(self.user_ids) or not len(self.animal_ids) or not len(candidate_ids):
+            return scores, known_users
+
+        user_positions = np.minimum(np.searchsorted(self.user_ids, user_ids), len(self.user_ids) - 1)
+        known_users = self.user_ids[user_positions] == user_ids
+        item_positions = np.minimum(np.searchsorted(self.animal_ids, candidate_ids), len(self.animal_ids) - 1)
+        known_items = self.animal_ids[item_positions] == candidate_ids
+
+        products = self.user_factors[user_positions[known_users]] @ self.item_factors[item_positions[known_items]].T
+        scores[np.ix_(known_users, known_items)] = np.clip(products, 0, 1)
+        return scores, known_users
+
+    def save(self, directory):
+        """Write the id and factor arrays into a directory"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'user_ids.npy'), np.asarray(self.user_ids, dtype=np.int64))
+        np.save(os.path.join(directory, 'animal_ids.npy'), np.asarray(self.animal_ids, dtype=np.int64))
+        np.save(os.path.join(directory, 'user_factors.npy'), np.asarray(self.user_factors, dtype=np.float32))
+        np.save(os.path.join(directory, 'item_factors.npy'), np.asarray(self.item_factors, dtype=np.float32))
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'users': len(self.user_ids), 'animals': len(self.animal_ids),
+                       'factors': int(self.user_factors.shape[1]) if self.user_factors.ndim == 2 else 0,
+                       'trained_at': timezone.now().isoformat()}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load the arrays saved in a directory, memory-mapping them"""
+        def load_array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        return cls(load_array('user_ids'), load_array('animal_ids'),
+                   load_array('user_factors'), load_array('item_factors'),
+                   version=os.path.basename(os.path.normpath(directory)))
+
+
+def train_factor_model(directory=None, half_life_days=30, **als_options):
+    """
+    Fit implicit ALS on the view history.
+
+    Publishes the factors as a new version in the artifact store, or
+    writes them into a directory when one is given.
+    """
+    user_ids, animal_ids, matrix = load_interactions(half_life_days=half_life_days)
+    user_factors, item_factors = ImplicitALS(**als_options).fit(matrix)
+
+    model = FactorModel(user_ids, animal_ids, user_factors, item_factors)
+    if directory:
+        model.save(directory)
+    else:
+        model.version = get_artifact_store().publish(FACTORS_ARTIFACT, model.save)
+    return model, matrix.nnz
+
+
+def get_factor_model():
+    """
+    Return the process-wide factor model, or None if none has been trained.
+
+    The current published version is loaded memory-mapped and swapped for
+    newer versions as they are published. Unlike the content vectors,
+    factors are never fit on the request path.
+    """
+    return get_artifact_registry().get(FACTORS_ARTIFACT)
+
+
+def reset_factor_model():
+    """Drop the process-wide copy so the next call reloads it"""
+    get_artifact_registry().forget(FACTORS_ARTIFACT)
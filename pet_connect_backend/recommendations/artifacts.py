@@ -0,0 +1,333 @@
+# recommendations/artifacts.py
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_LOCK_FILENAME = 'manifest.lock'
+
+# Process-wide registry of loaded artifacts
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class ArtifactStore:
+    """
+    Versioned directory of offline-built recommendation artifacts.
+
+    Every build is written to <root>/<name>/<version>/ and only then made
+    current by rewriting manifest.json, which maps each artifact name to its
+    current version. Both the version directory and the manifest are
+    swapped in with os.replace, so readers never see a half-written build.
+    Versions beyond the newest keep_versions of each artifact are deleted
+    after every publish.
+    """
+
+    def __init__(self, root, keep_versions=3):
+        self.root = root
+        self.keep_versions = keep_versions
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, MANIFEST_FILENAME)
+
+    def read_manifest(self):
+        """Return {name: {'version': ..., 'published_at': ...}} for the current versions"""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f).get('artifacts', {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable artifact manifest {self.manifest_path}: {str(e)}")
+            return {}
+
+    def version_dir(self, name, version):
+        return os.path.join(self.root, name, version)
+
+    def current_dir(self, name):
+        """Directory of the current version of an artifact, or None"""
+        entry = self.read_manifest().get(name)
+        return self.version_dir(name, entry['version']) if entry else None
+
+    def publish(self, name, write):
+        """
+        Write a new version of an artifact and make it current.
+
+        write(directory) fills an empty directory with the artifact's files.
+        Returns the new version.
+        """
+        version = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+        version_dir = self.version_dir(name, version)
+        tmp_dir = f"{version_dir}.tmp"
+        os.makedirs(tmp_dir)
+        try:
+            write(tmp_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        os.replace(tmp_dir, version_dir)
+
+        with self._manifest_lock():
+            manifest = self.read_manifest()
+            manifest[name] = {'version': version, 'published_at': timezone.now().isoformat()}
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'artifacts': manifest}, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+
+        logger.info(f"Published {name} version {version}")
+        self.collect_garbage(name)
+        return version
+
+    def collect_garbage(self, name):
+        """Delete all but the newest keep_versions versions of an artifact"""
+        current = (self.read_manifest().get(name) or {}).get('version')
+        directory = os.path.join(self.root, name)
+        versions = sorted(
+            entry for entry in os.listdir(directory)
+            if os.path.isdir(os.path.join(directory, entry)) and not entry.endswith('.tmp')
+        )
+        # Workers that still map an old version keep their (unlinked) files
+        for version in versions[:-self.keep_versions] if self.keep_versions > 0 else versions:
+            if version != current:
+                shutil.rmtree(os.path.join(directory, version), ignore_errors=True)
+                logger.info(f"Removed {name} version {version}")
+
+    def writer_lock(self, name, blocking=True):
+        """
+        Elect one process to rebuild an artifact: the lock's acquired is
+        False when another process holds it and blocking is False.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        return _FileLock(os.path.join(self.root, f"{name}.lock"), blocking=blocking)
+
+    def _manifest_lock(self):
+        """Serialize manifest rewrites across processes"""
+        os.makedirs(self.root, exist_ok=True)
+        return _FileLock(os.path.join(self.root, MANIFEST_LOCK_FILENAME))
+
+
+class _FileLock:
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self.acquired = False
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.acquired = True
+        except BlockingIOError:
+            pass
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.acquired:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class ArtifactRegistry:
+    """
+    The artifacts loaded in this worker process, kept in step with the manifest.
+
+    get() stats the manifest at most once every check_interval seconds.
+    When its mtime changed, the request that noticed loads the new versions
+    while every other request carries on with the old objects; the new
+    object is then swapped in with a single reference assignment, so
+    nothing ever blocks on a reload.
+    """
+
+    def __init__(self, store, check_interval=30):
+        self.store = store
+        self.check_interval = check_interval
+        self._loaders = {}
+        self._loaded = {}    # name -> (version, object)
+        self._manifest = {}
+        self._manifest_mtime = None
+        self._next_check = 0
+        self._refresh_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def register(self, name, loader):
+        """Register loader(directory) for an artifact name"""
+        self._loaders[name] = loader
+
+    def get(self, name):
+        """Return the loaded artifact, or None if no version has been published"""
+        self._maybe_refresh()
+
+        entry = self._loaded.get(name)
+        if entry is None:
+            version = (self._manifest.get(name) or {}).get('version')
+            if version is None:
+                return None
+            with self._load_lock:
+                entry = self._loaded.get(name) or self._load(name, version)
+        return entry[1]
+
+    @contextmanager
+    def override(self, **objects):
+        """
+        Serve the given objects instead of the published versions.
+
+        Used by the evaluation harness to score against models built on a
+        different dataset; manifest checks are paused until exit.
+        """
+        loaded, next_check = dict(self._loaded), self._next_check
+        self._next_check = float('inf')
+        for name, obj in objects.items():
+            self._loaded[name] = ('override', obj)
+        try:
+            yield self
+        finally:
+            self._loaded, self._next_check = loaded, next_check
+
+    def forget(self, name=None):
+        """Drop loaded artifacts so the next get() loads them again"""
+        if name is None:
+            self._loaded = {}
+        else:
+            self._loaded.pop(name, None)
+        self._manifest_mtime = None
+        self._next_check = 0
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        # Only one request per process does the check; the rest keep serving
+        # (the very first check waits, so a cold worker never skips the manifest)
+        if not self._refresh_lock.acquire(blocking=self._next_check == 0):
+            return
+        try:
+            self._next_check = now + self.check_interval
+            try:
+                mtime = os.stat(self.store.manifest_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._manifest_mtime and self._manifest_mtime is not None:
+                return
+            self._manifest_mtime = mtime
+
+            manifest = self.store.read_manifest() if mtime is not None else {}
+            self._manifest = manifest
+            for name, (version, _) in list(self._loaded.items()):
+                current = (manifest.get(name) or {}).get('version')
+                if current and current != version:
+                    try:
+                        self._load(name, current)
+                    except Exception as e:
+                        # Keep serving the old version rather than failing requests
+                        logger.error(f"Error loading {name} version {current}: {str(e)}")
+        finally:
+            self._refresh_lock.release()
+
+    def _load(self, name, version):
+        obj = self._loaders[name](self.store.version_dir(name, version))
+        entry = (version, obj)
+        self._loaded[name] = entry
+        logger.info(f"Loaded {name} version {version}")
+        return entry
+
+
+def get_artifact_store():
+    """The artifact store under RECOMMENDATION_ARTIFACT_DIR"""
+    return ArtifactStore(
+        settings.RECOMMENDATION_ARTIFACT_DIR,
+        keep_versions=getattr(settings, 'RECOMMENDATION_ARTIFACT_KEEP_VERSIONS', 3),
+    )
+
+
+def get_artifact_registry():
+    """Return the process-wide artifact registry"""
+    global _registry
+
+    if _registry is not None:
+        return _registry
+
+    with _registry_lock:
+        if _registry is None:
+            registry = ArtifactRegistry(
+                get_artifact_store(),
+                check_interval=getattr(settings, 'RECOMMENDATION_ARTIFACT_CHECK_INTERVAL', 30),
+            )
+            from .als import FACTORS_ARTIFACT, FactorModel
+            from .catalog import CATALOG_ARTIFACT, CatalogSnapshot
+            from .content_vectors import CONTENT_VECTORS_ARTIFACT, ContentVectors
+            from .coview import COVIEW_ARTIFACT, CoviewModel
+            registry.register(CATALOG_ARTIFACT, CatalogSnapshot.load)
+            registry.register(CONTENT_VECTORS_ARTIFACT, ContentVectors.load_dir)
+            registry.register(COVIEW_ARTIFACT, CoviewModel.load_dir)
+            registry.register(FACTORS_ARTIFACT, FactorModel.load)
+            _registry = registry
+
+    return _registry
+
+
+def preload_artifacts(publish_catalog=True, publish_missing=True):
+    """
+    Load the catalog snapshot and every model in the current process.
+
+    The gunicorn master calls this under preload_app (see gunicorn.conf.py),
+    after publishing a fresh catalog snapshot: forked workers then inherit
+    the mapped arrays and serve their first request without loading
+    anything. With publish_missing, the content vectors and co-view model
+    are built first if no version has been published yet, so a fresh
+    deploy scores with every stage the baseline had; the build commands
+    refresh them from then on. The factor model needs an explicit
+    training run and stays unloaded (its stage skipped) until one.
+    """
+    from django.db import connections
+    from .als import get_factor_model
+    from .catalog import get_catalog_snapshot, publish_catalog_snapshot
+    from .content_vectors import CONTENT_VECTORS_ARTIFACT, build_content_vectors, get_content_vectors
+    from .coview import COVIEW_ARTIFACT, build_coview_model, get_coview_model
+
+    if publish_catalog:
+        try:
+            publish_catalog_snapshot()
+        except Exception as e:
+            logger.error(f"Error publishing the catalog snapshot: {str(e)}")
+
+    if publish_missing:
+        registry = get_artifact_registry()
+        for name, build in [(CONTENT_VECTORS_ARTIFACT, build_content_vectors), (COVIEW_ARTIFACT, build_coview_model)]:
+            if registry.get(name) is not None:
+                continue
+            try:
+                build()
+                registry.forget(name)   # Re-read the manifest now, not at the next throttled check
+                logger.info(f"Published a first {name} version")
+            except Exception as e:
+                logger.error(f"Error publishing {name}: {str(e)}")
+
+    started = time.monotonic()
+    snapshot = get_catalog_snapshot()
+    get_content_vectors()
+    get_coview_model()
+    get_factor_model()
+    logger.info(f"Preloaded {len(snapshot)} animals and the recommendation models "
+                f"in {time.monotonic() - started:.2f}s")
+
+    # Forked workers must open their own database connections
+    connections.close_all()
+
+
+def reset_artifact_registry():
+    """Drop the process-wide registry, e.g. after changing the artifact settings"""
+    global _registry
+    _registry = None
@@ -0,0 +1,212 @@
+# recommendations/benchmarks.py
+
+import time
+import random
+import logging
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .evaluation import isolated_database, models_for_current_data
+
+logger = logging.getLogger(__name__)
+
+# Stages timed by run_stage_benchmarks, in report order
+STAGES = [
+    'score_by_preferences',
+    'score_by_view_history',
+    'score_by_content_similarity',
+    'get_popular_animals',
+    'get_recommendation_reason',
+]
+
+
+@contextmanager
+def quiet_engine_logging():
+    """Keep the engine's per-call INFO lines out of the timings"""
+    engine_logger = logging.getLogger('recommendations.recommendation_engine')
+    level = engine_logger.level
+    engine_logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        engine_logger.setLevel(level)
+
+
+def create_benchmark_user(history_length, animal_ids, seed=0, days=90):
+    """
+    Create a user with a fixed profile and exactly history_length views.
+
+    The profile sets every preference, so the preference stage always does
+    its full amount of work whatever the history length.
+    """
+    from django.contrib.auth.models import User
+    from animals.models import AnimalViewHistory
+    from users.models import UserProfile
+    from .models import UserTasteProfile
+
+    rng = random.Random(seed * 100003 + history_length)
+    now = timezone.now()
+
+    user = User.objects.create(username=f"benchmark_{seed}_{history_length}", password='!')
+    UserProfile.objects.update_or_create(user=user, defaults={
+        'preferred_species': 'Dog',
+        'preferred_age_min': 1,
+        'preferred_age_max': 6,
+        'preferred_size': 'Medium',
+        'preferred_energy_level': 'High',
+        'good_with_children': True,
+        'good_with_other_pets': True,
+    })
+
+    AnimalViewHistory.objects.bulk_create([
+        AnimalViewHistory(
+            user=user,
+            animal_id=rng.choice(animal_ids),
+            timestamp=now - timedelta(seconds=rng.randint(0, days * 86400)),
+            view_duration=int(rng.expovariate(1 / 30)),
+        )
+        for _ in range(history_length)
+    ])
+    UserTasteProfile.rebuild_for_user(user)
+    return user
+
+
+def measure(func, min_time=0.5, min_calls=3):
+    """
+    Benchmark a zero-argument callable.
+
+    After one warm-up call it is called until both min_time seconds and
+    min_calls calls have passed. Allocations and queries are taken from a
+    separate call: peak_bytes is the high-water mark of memory traced
+    during the call, allocated_blocks the blocks it allocated that were
+    still alive when it returned (its result and anything it cached).
+    """
+    func()
+
+    calls = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time or calls < min_calls:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - started
+
+    # The query log is a bounded deque, keep it from filling up
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as context:
+        func()
+    queries = len(context.captured_queries)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()
+        after = tracemalloc.take_snapshot()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    allocated_blocks = sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'lineno'))
+
+    return {
+        'calls': calls,
+        'ops_per_sec': calls / elapsed,
+        'mean_ms': elapsed / calls * 1000,
+        'queries': queries,
+        'peak_bytes': peak_bytes,
+        'allocated_blocks': allocated_blocks,
+    }
+
+
+def benchmark_stages(engine, user, stages=None, min_time=0.5):
+    """Time each engine stage for one user against the current catalog"""
+    from animals.models import Animal, AnimalViewHistory
+    from users.models import UserProfile
+    from .models import UserTasteProfile
+
+    profile = UserProfile.objects.get(user=user)
+    taste_profile = UserTasteProfile.objects.get(user=user)
+    viewed_animal_ids = list(
+        AnimalViewHistory.objects.filter(user=user).order_by('-timestamp').values_list('animal_id', flat=True)
+    )
+    candidates = Animal.objects.filter(status='A').exclude(id__in=viewed_animal_ids[:3])
+    animal = candidates.order_by('id').first()
+
+    # Querysets are re-evaluated on every call, as they are inside the engine
+    stage_calls = {
+        'score_by_preferences': lambda: engine._score_by_preferences(candidates.all(), profile),
+        'score_by_view_history': lambda: engine._score_by_view_history(candidates.all(), taste_profile),
+        'score_by_content_similarity': lambda: engine._score_by_content_similarity(candidates.all(), viewed_animal_ids),
+        'get_popular_animals': lambda: engine._get_popular_animals(10, exclude_ids=viewed_animal_ids[:5]),
+        'get_recommendation_reason': lambda: engine.get_recommendation_reason(user.id, animal),
+    }
+
+    results = {}
+    for stage in stages or STAGES:
+        results[stage] = measure(stage_calls[stage], min_time=min_time)
+        logger.info(f"{stage}: {results[stage]['ops_per_sec']:.1f} ops/sec, {results[stage]['queries']} queries")
+    return results
+
+
+def run_stage_benchmarks(engine, catalog_sizes, history_lengths, stages=None, seed=0, min_time=0.5,
+                         n_users=100, views_per_user=20):
+    """
+    Benchmark every stage across catalog sizes and history lengths.
+
+    Each catalog is built from seeded synthetic data in an isolated
+    database (see evaluation.isolated_database), with n_users background
+    users so popularity and co-view data look realistic. Returns a list of
+    rows, one per (catalog size, history length), each holding the
+    per-stage results of measure().
+    """
+    from .synthetic import create_synthetic_data
+
+    rows = []
+    for catalog_size in catalog_sizes:
+        with isolated_database():
+            data = create_synthetic_data(catalog_size, n_users, views_per_user=views_per_user, seed=seed)
+            users = [create_benchmark_user(length, data.animal_ids, seed=seed) for length in history_lengths]
+
+            with models_for_current_data(), quiet_engine_logging():
+                for history_length, user in zip(history_lengths, users):
+                    # The popular top-up samples with the random module
+                    random.seed(seed)
+                    rows.append({
+                        'catalog_size': catalog_size,
+                        'history_length': history_length,
+                        'stages': benchmark_stages(engine, user, stages=stages, min_time=min_time),
+                    })
+    return rows
+
+
+def compare_to_baseline(rows, baseline_rows, tolerance=0.25):
+    """
+    List the stages that got slower or heavier than in a saved baseline.
+
+    A stage regresses when its ops/sec drops by more than tolerance, or
+    when it runs more queries than before. Returns human readable lines.
+    """
+    baseline = {
+        (row['catalog_size'], row['history_length'], stage): result
+        for row in baseline_rows for stage, result in row['stages'].items()
+    }
+
+    regressions = []
+    for row in rows:
+        for stage, result in row['stages'].items():
+            previous = baseline.get((row['catalog_size'], row['history_length'], stage))
+            if previous is None:
+                continue
+            where = f"{stage} (catalog {row['catalog_size']}, history {row['history_length']})"
+            if result['ops_per_sec'] < previous['ops_per_sec'] * (1 - tolerance):
+                regressions.append(
+                    f"{where}: {previous['ops_per_sec']:.1f} -> {result['ops_per_sec']:.1f} ops/sec"
+                )
+            if result['queries'] > previous['queries']:
+                regressions.append(f"{where}: {previous['queries']} -> {result['queries']} queries")
+    return regressions
@@ -0,0 +1,93 @@
+# recommendations/cache.py
+"""
+Per-user cache of ranked recommendation lists.
+
+Entries live in the 'recommendations' cache (see CACHES in settings), which
+applies the TTL and bounds the number of entries. The default database
+cache culls by key order rather than recency; Redis with
+maxmemory-policy allkeys-lru gives true LRU eviction. Each user's entries are keyed by a
+generation token, so invalidating a user just forgets the token. Animals
+have generation tokens too: a cached list records the token of every
+animal in it and is only served while all of them are unchanged, so an
+adoption invalidates exactly the lists that contain the animal. Tokens
+are only ever created with add() and dropped with delete(), both atomic,
+so concurrent workers never overwrite each other's invalidations.
+"""
+import logging
+import uuid
+
+from django.core.cache import caches
+
+from pet_connect_backend.metrics import observe_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_CACHE_ALIAS = 'recommendations'
+
+
+def get_recommendation_cache():
+    return caches[RECOMMENDATION_CACHE_ALIAS]
+
+
+def _generation_key(user_id):
+    return f"recs:user:{user_id}:generation"
+
+
+def _list_key(user_id, generation, limit):
+    return f"recs:user:{user_id}:{generation}:{limit}"
+
+
+def _animal_key(animal_id):
+    return f"recs:animal:{animal_id}:generation"
+
+
+def _get_or_add_generation(cache, key):
+    """The current token under key, creating one unless another worker just did"""
+    cache.add(key, uuid.uuid4().hex, None)
+    return cache.get(key)
+
+
+def get_cached_recommendations(user_id, limit):
+    """Return the cached ranked list of (animal_id, score, component) triples for a user, or None"""
+    cache = get_recommendation_cache()
+    generation = cache.get(_generation_key(user_id))
+    scored_animals = None
+    if generation is not None:
+        entry = cache.get(_list_key(user_id, generation, limit))
+        if entry is not None:
+            # Stale as soon as any of its animals has been invalidated since
+            animal_generations = entry['animal_generations']
+            current = cache.get_many(list(animal_generations))
+            if all(current.get(key) == token for key, token in animal_generations.items()):
+                scored_animals = entry['scored_animals']
+    observe_cache_lookup(RECOMMENDATION_CACHE_ALIAS, scored_animals is not None)
+    return scored_animals
+
+
+def cache_recommendations(user_id, limit, scored_animals):
+    """Store a user's ranked (animal_id, score, component) list with the generations of its animals"""
+    cache = get_recommendation_cache()
+    generation = _get_or_add_generation(cache, _generation_key(user_id))
+
+    animal_keys = [_animal_key(animal_id) for animal_id, _, _ in scored_animals]
+    animal_generations = cache.get_many(animal_keys)
+    for key in animal_keys:
+        if animal_generations.get(key) is None:
+            animal_generations[key] = _get_or_add_generation(cache, key)
+
+    cache.set(_list_key(user_id, generation, limit), {
+        'scored_animals': list(scored_animals),
+        'animal_generations': animal_generations,
+    })
+
+
+def invalidate_user(user_id):
+    """Drop every cached list for a user by forgetting their generation"""
+    get_recommendation_cache().delete(_generation_key(user_id))
+    logger.debug(f"Invalidated cached recommendations for user {user_id}")
+
+
+def invalidate_animal(animal_id):
+    """Drop the cached lists of every user who was recommended this animal by forgetting its generation"""
+    get_recommendation_cache().delete(_animal_key(animal_id))
+    logger.debug(f"Invalidated cached recommendations containing animal {animal_id}")
@@ -0,0 +1,301 @@
+# recommendations/catalog.py
+
+import os
+import json
+import time
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .artifacts import get_artifact_registry, get_artifact_store
+from .features import CANDIDATE_FIELDS, AnimalColumns
+
+logger = logging.getLogger(__name__)
+
+CATALOG_ARTIFACT = 'catalog'
+CATALOG_METADATA_FILENAME = 'catalog.json'
+
+CATEGORICALS = ('species', 'breed', 'size', 'energy_level')
+
+# Bit of each compatibility flag in CatalogSnapshot.flags
+FLAG_BITS = {'good_with_kids': 1, 'good_with_cats': 2, 'good_with_dogs': 4}
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+# Whether this process has already warned that the snapshot is stale
+_warned_stale = False
+
+
+class CatalogSnapshot:
+    """
+    Compact, immutable struct of arrays of every available animal.
+
+    Rows are sorted by id, so np.searchsorted is the id -> row index.
+    Categoricals are stored as integer codes into per-field vocabularies,
+    ages as the small integers they are in the database and the
+    compatibility flags as one bit field per animal. Changes never touch a
+    snapshot in place: with_animal and without return a new one, which
+    replaces the process-wide reference in a single assignment.
+
+    Published snapshots are plain .npy files, so every worker maps the
+    same pages read-only instead of holding its own copy.
+    """
+
+    def __init__(self, ids, codes, vocabularies, age_years, age_months, flags, built_at=None):
+        self.ids = ids
+        self.codes = codes                  # {field: int32 codes aligned with ids}
+        self.vocabularies = vocabularies    # {field: object array of the coded values}
+        self.age_years = age_years
+        self.age_months = age_months
+        self.flags = flags
+        self.built_at = time.time() if built_at is None else built_at
+
+    @classmethod
+    def build(cls):
+        """Load the available animals with a single values_list query"""
+        from animals.models import Animal
+
+        rows = Animal.objects.filter(status='A').order_by('id').values_list(*CANDIDATE_FIELDS)
+        return cls.from_rows(rows)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Encode CANDIDATE_FIELDS rows, which must be sorted by id"""
+        rows = list(rows)
+        n = len(rows)
+
+        codes, vocabularies = {}, {}
+        for position, field in enumerate(CATEGORICALS, start=1):
+            values, inverse = np.unique(
+                np.array([row[position] or '' for row in rows], dtype=object), return_inverse=True
+            )
+            codes[field] = inverse.astype(np.int32)
+            vocabularies[field] = values.astype(object)
+
+        flags = np.zeros(n, dtype=np.uint8)
+        for position, bit in zip((7, 8, 9), FLAG_BITS.values()):
+            flags |= np.fromiter((bool(row[position]) for row in rows), dtype=bool, count=n).astype(np.uint8) * bit
+
+        return cls(
+            ids=np.fromiter((row[0] for row in rows), dtype=np.int64, count=n),
+            codes=codes,
+            vocabularies=vocabularies,
+            age_years=np.fromiter((row[5] or 0 for row in rows), dtype=np.int16, count=n),
+            age_months=np.fromiter((row[6] or 0 for row in rows), dtype=np.int16, count=n),
+            flags=flags,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_for(self, animal_ids):
+        """Rows of the given ids, in id order; ids not in the snapshot are skipped"""
+        animal_ids = np.unique(np.asarray(list(animal_ids), dtype=np.int64))
+        rows = np.searchsorted(self.ids, animal_ids)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == animal_ids[found]
+        return rows[found]
+
+    def select(self, animal_ids=None, exclude_ids=None):
+        """Rows of animal_ids (every row when None) minus those of exclude_ids"""
+        rows = np.arange(len(self.ids)) if animal_ids is None else self.rows_for(animal_ids)
+        if exclude_ids:
+            rows = np.setdiff1d(rows, self.rows_for(exclude_ids), assume_unique=True)
+        return rows
+
+    def flag(self, name, rows=slice(None)):
+        return (self.flags[rows] & FLAG_BITS[name]) != 0
+
+    def columns(self, rows=None):
+        """
+        Decode rows (all of them by default) into AnimalColumns, so the
+        vectorized scorers run on the snapshot without a query.
+        """
+        if rows is None:
+            rows = slice(None)
+        return AnimalColumns.from_arrays(
+            ids=self.ids[rows],
+            age=self.age_years[rows].astype(np.float64) + self.age_months[rows].astype(np.float64) / 12,
+            good_with_kids=self.flag('good_with_kids', rows),
+            good_with_cats=self.flag('good_with_cats', rows),
+            good_with_dogs=self.flag('good_with_dogs', rows),
+            **{field: self.vocabularies[field][self.codes[field][rows]] for field in CATEGORICALS}
+        )
+
+    def with_animal(self, animal):
+        """A copy with the animal added, updated or, if no longer available, removed"""
+        if animal.status != 'A':
+            return self.without([animal.id])
+
+        row = int(np.searchsorted(self.ids, animal.id))
+        replace = row < len(self.ids) and self.ids[row] == animal.id
+
+        codes, vocabularies = {}, {}
+        for field in CATEGORICALS:
+            value = getattr(animal, field) or ''
+            vocabulary = self.vocabularies[field]
+            matches = np.flatnonzero(vocabulary == value)
+            if len(matches):
+                code = matches[0]
+            else:
+                # New values go to the end so existing codes stay valid
+                code = len(vocabulary)
+                vocabulary = np.append(vocabulary, np.array([value], dtype=object))
+            codes[field] = self._put(self.codes[field], row, replace, code)
+            vocabularies[field] = vocabulary
+
+        flags = 0
+        for name, bit in FLAG_BITS.items():
+            if getattr(animal, name):
+                flags |= bit
+
+        return CatalogSnapshot(
+            ids=self._put(self.ids, row, replace, animal.id),
+            codes=codes,
+            vocabularies=vocabularies,
+            age_years=self._put(self.age_years, row, replace, animal.age_years or 0),
+            age_months=self._put(self.age_months, row, replace, animal.age_months or 0),
+            flags=self._put(self.flags, row, replace, flags),
+            built_at=self.built_at,
+        )
+
+    def without(self, animal_ids):
+        """A copy without the given animals"""
+        rows = self.rows_for(animal_ids)
+        if not len(rows):
+            return self
+        return CatalogSnapshot(
+            ids=np.delete(self.ids, rows),
+            codes={field: np.delete(codes, rows) for field, codes in self.codes.items()},
+            vocabularies=self.vocabularies,
+            age_years=np.delete(self.age_years, rows),
+            age_months=np.delete(self.age_months, rows),
+            flags=np.delete(self.flags, rows),
+            built_at=self.built_at,
+        )
+
+    def save(self, directory):
+        """Write the arrays as .npy files workers can memory-map, and the vocabularies as JSON"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ('ids', 'age_years', 'age_months', 'flags'):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        for field in CATEGORICALS:
+            np.save(os.path.join(directory, f"{field}_codes.npy"), self.codes[field])
+        with open(os.path.join(directory, CATALOG_METADATA_FILENAME), 'w') as f:
+            json.dump({
+                'animals': len(self.ids),
+                'built_at': self.built_at,
+                'vocabularies': {field: self.vocabularies[field].tolist() for field in CATEGORICALS},
+            }, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load a saved snapshot, memory-mapping its arrays"""
+        def load_array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        with open(os.path.join(directory, CATALOG_METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+        return cls(
+            ids=load_array('ids'),
+            codes={field: load_array(f"{field}_codes") for field in CATEGORICALS},
+            vocabularies={field: np.array(values, dtype=object) for field, values in metadata['vocabularies'].items()},
+            age_years=load_array('age_years'),
+            age_months=load_array('age_months'),
+            flags=load_array('flags'),
+            built_at=metadata['built_at'],
+        )
+
+    @staticmethod
+    def _put(array, row, replace, value):
+        if replace:
+            array = array.copy()
+            array[row] = value
+            return array
+        return np.insert(array, row, value)
+
+
+def publish_catalog_snapshot(snapshot=None):
+    """
+    Publish a snapshot (built from the database by default) as a new
+    version in the artifact store, for every worker to map.
+    """
+    if snapshot is None:
+        snapshot = CatalogSnapshot.build()
+    get_artifact_store().publish(CATALOG_ARTIFACT, snapshot.save)
+    # Don't wait for the next manifest check to serve it in this process
+    get_artifact_registry().forget(CATALOG_ARTIFACT)
+    return snapshot
+
+
+def get_catalog_snapshot():
+    """
+    The process-wide snapshot.
+
+    The current published version is mapped read-only and shared by every
+    worker; newer versions replace it as they are published, which costs a
+    request no more than the registry's throttled stat of the manifest.
+    Saves and deletes in this process patch a private copy right away (see
+    signals.py). Requests never publish: the build_catalog_snapshot command
+    (run with --watch, see the Procfile) republishes the catalog every
+    RECOMMENDATION_CATALOG_MAX_AGE seconds, which bounds how long changes
+    made by other processes take to show up. Until a version has been
+    published, each process builds a private copy once.
+
+    Readers keep the reference they got for the whole request, so a
+    concurrent swap never changes the catalog under them.
+    """
+    global _snapshot, _warned_stale
+    snapshot = _snapshot
+    published = get_artifact_registry().get(CATALOG_ARTIFACT)
+    if published is not None and (snapshot is None or published.built_at > snapshot.built_at):
+        with _snapshot_lock:
+            if _snapshot is snapshot:
+                _snapshot = published
+            snapshot = _snapshot
+
+    if snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                logger.warning("No catalog snapshot has been published, building a private copy; "
+                               "run the build_catalog_snapshot command")
+                _snapshot = CatalogSnapshot.build()
+            snapshot = _snapshot
+    elif not _warned_stale and _is_stale(snapshot):
+        _warned_stale = True
+        logger.warning(f"The catalog snapshot is {time.time() - snapshot.built_at:.0f}s old; "
+                       "is build_catalog_snapshot --watch running?")
+    return snapshot
+
+
+def _is_stale(snapshot):
+    """Older than a republish missed twice over, not just waiting for the next one"""
+    max_age = getattr(settings, 'RECOMMENDATION_CATALOG_MAX_AGE', 60)
+    check_interval = getattr(settings, 'RECOMMENDATION_ARTIFACT_CHECK_INTERVAL', 30)
+    return time.time() - snapshot.built_at >= 2 * max_age + check_interval
+
+
+def patch_catalog_snapshot(animal):
+    """Apply a saved animal to the snapshot, if one has been built"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is not None:
+            _snapshot = _snapshot.with_animal(animal)
+
+
+def remove_from_catalog_snapshot(animal_ids):
+    """Drop deleted (or no longer available) animals from the snapshot"""
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is not None:
+            _snapshot = _snapshot.without(animal_ids)
+
+
+def reset_catalog_snapshot():
+    """Drop the snapshot so the next request maps the published one again (tests, bulk imports)"""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
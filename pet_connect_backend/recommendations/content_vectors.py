@@ -0,0 +1,193 @@
+# recommendations/content_vectors.py
+
+import os
+import logging
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from django.utils import timezone
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from .artifacts import get_artifact_registry, get_artifact_store
+from .features import AnimalColumns
+
+logger = logging.getLogger(__name__)
+
+CONTENT_VECTORS_ARTIFACT = 'content_vectors'
+CONTENT_VECTORS_FILENAME = 'content_vectors.joblib'
+
+# Whether this process has already warned that nothing is published
+_warned_unpublished = False
+
+
+class ContentVectors:
+    """
+    TF-IDF vectors for the animal catalog with a fixed vocabulary.
+
+    The vocabulary and IDF weights are fit once (see the
+    build_content_vectors command) together with the L2-normalised vector of
+    every animal. Workers load the artifact memory-mapped, so scoring a
+    request never refits the vectorizer.
+    """
+
+    def __init__(self, vocabulary, idf, animal_ids, matrix, fitted_at=None):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.animal_ids = animal_ids    # Sorted, aligned with the matrix rows
+        self.matrix = matrix
+        self.fitted_at = fitted_at
+        self._analyzer = TfidfVectorizer().build_analyzer()
+
+    @classmethod
+    def fit(cls, columns):
+        """Fit the vocabulary and IDF weights on an AnimalColumns pool"""
+        order = np.argsort(columns.ids, kind='stable')
+        texts = columns.feature_texts()
+        texts = [texts[i] for i in order]
+
+        vectorizer = TfidfVectorizer()
+        vectorizer.fit(texts)
+
+        vocabulary = {term: int(index) for term, index in vectorizer.vocabulary_.items()}
+        vectors = cls(vocabulary, vectorizer.idf_.astype(np.float64), columns.ids[order], None,
+                      fitted_at=timezone.now())
+        vectors.matrix = vectors.transform(texts)
+        return vectors
+
+    def transform(self, texts):
+        """Vectorize feature documents with the fixed vocabulary (no refitting)"""
+        rows, cols, counts = [], [], []
+        for row, text in enumerate(texts):
+            term_counts = {}
+            for term in self._analyzer(text):
+                index = self.vocabulary.get(term)
+                if index is not None:
+                    term_counts[index] = term_counts.get(index, 0) + 1
+            for index, count in term_counts.items():
+                rows.append(row)
+                cols.append(index)
+                counts.append(count)
+
+        matrix = sp.csr_matrix(
+            (np.asarray(counts, dtype=np.float64), (rows, cols)),
+            shape=(len(texts), len(self.vocabulary)),
+        )
+        matrix = matrix @ sp.diags(np.asarray(self.idf))
+        return normalize(sp.csr_matrix(matrix), norm='l2', copy=False)
+
+    def vectors_for(self, animal_ids):
+        """
+        Return the CSR rows for the given animal ids, in the same order.
+
+        Animals added after the artifact was built are vectorized on the fly
+        with the fixed vocabulary.
+        """
+        from animals.models import Animal
+
+        animal_ids = np.asarray(animal_ids, dtype=np.int64)
+        if len(animal_ids) == 0:
+            return sp.csr_matrix((0, len(self.vocabulary)))
+
+        if len(self.animal_ids):
+            positions = np.searchsorted(self.animal_ids, animal_ids)
+            positions = np.minimum(positions, len(self.animal_ids) - 1)
+            found = self.animal_ids[positions] == animal_ids
+        else:
+            positions = np.zeros(len(animal_ids), dtype=np.int64)
+            found = np.zeros(len(animal_ids), dtype=bool)
+
+        if found.all():
+            return self.matrix[positions]
+
+        # Vectorize the animals the artifact does not know about yet
+        missing_ids = animal_ids[~found]
+        missing = AnimalColumns.from_queryset(Animal.objects.filter(id__in=missing_ids.tolist()))
+        missing_matrix = self.transform(missing.feature_texts())
+        missing_rows = {animal_id: row for row, animal_id in enumerate(missing.ids.tolist())}
+
+        empty = sp.csr_matrix((1, len(self.vocabulary)))
+        rows = []
+        for animal_id, is_found, position in zip(animal_ids.tolist(), found, positions):
+            if is_found:
+                rows.append(self.matrix[position])
+            elif animal_id in missing_rows:
+                rows.append(missing_matrix[missing_rows[animal_id]])
+            else:
+                rows.append(empty)
+        return sp.vstack(rows, format='csr')
+
+    def save(self, path):
+        """Persist the artifact so workers can memory-map it"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        joblib.dump({
+            'vocabulary': self.vocabulary,
+            'idf': np.asarray(self.idf),
+            'animal_ids': np.asarray(self.animal_ids),
+            'data': self.matrix.data,
+            'indices': self.matrix.indices,
+            'indptr': self.matrix.indptr,
+            'fitted_at': self.fitted_at,
+        }, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a saved artifact, memory-mapping its arrays"""
+        state = joblib.load(path, mmap_mode=mmap_mode)
+        matrix = sp.csr_matrix(
+            (state['data'], state['indices'], state['indptr']),
+            shape=(len(state['animal_ids']), len(state['vocabulary'])),
+            copy=False,
+        )
+        return cls(state['vocabulary'], state['idf'], state['animal_ids'], matrix,
+                   fitted_at=state.get('fitted_at'))
+
+    @classmethod
+    def load_dir(cls, directory):
+        """Load the artifact from a published version directory"""
+        return cls.load(os.path.join(directory, CONTENT_VECTORS_FILENAME))
+
+
+def build_content_vectors(path=None):
+    """
+    Fit the content vectors on the whole catalog.
+
+    Publishes them as a new version in the artifact store, or writes a
+    single file when a path is given.
+    """
+    from animals.models import Animal
+
+    vectors = ContentVectors.fit(AnimalColumns.from_queryset(Animal.objects.all()))
+    if path:
+        vectors.save(path)
+    else:
+        get_artifact_store().publish(
+            CONTENT_VECTORS_ARTIFACT, lambda directory: vectors.save(os.path.join(directory, CONTENT_VECTORS_FILENAME))
+        )
+    return vectors
+
+
+def get_content_vectors():
+    """
+    Return the process-wide content vectors, or None.
+
+    The current published version is loaded memory-mapped and swapped for
+    newer versions as they are published. Until the build_content_vectors
+    command has published one this returns None and callers skip content
+    similarity: fitting the vocabulary is never done on the request path.
+    """
+    global _warned_unpublished
+    vectors = get_artifact_registry().get(CONTENT_VECTORS_ARTIFACT)
+    if vectors is None and not _warned_unpublished:
+        _warned_unpublished = True
+        logger.warning("No content vectors artifact has been published, skipping content similarity; "
+                       "run the build_content_vectors command")
+    return vectors
+
+
+def reset_content_vectors():
+    """Drop the process-wide copy so the next call reloads it"""
+    get_artifact_registry().forget(CONTENT_VECTORS_ARTIFACT)
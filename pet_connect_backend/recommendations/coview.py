@@ -0,0 +1,356 @@
+# recommendations/coview.py
+
+import os
+import logging
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from django.utils import timezone
+
+from .artifacts import get_artifact_registry, get_artifact_store
+
+logger = logging.getLogger(__name__)
+
+COVIEW_ARTIFACT = 'coview'
+COVIEW_FILENAME = 'coview.joblib'
+
+# Neighbors kept per animal in the item-item similarity matrix
+DEFAULT_NEIGHBORS = 50
+
+# Users folded into the co-occurrence counts per sparse product
+DEFAULT_BLOCK_SIZE = 5000
+
+# Whether this process has already warned that nothing is published
+_warned_unpublished = False
+
+
+class CoviewModel:
+    """
+    Item-item collaborative filtering on "people who viewed X also viewed Y".
+
+    The view history is folded into a sparse animal x animal co-occurrence
+    matrix C = B.T @ B, where B is the binary user x animal matrix of who
+    viewed what. The diagonal of C holds how many users viewed each animal,
+    so the cosine similarity of two animals is C[i, j] / sqrt(C[i, i] C[j, j]).
+    Each similarity row keeps only its strongest neighbors.
+
+    B is never materialised in full: views are streamed ordered by user and
+    folded in blocks of users, so building stays memory-bounded however long
+    the history is. The id of the last folded view is kept as a watermark,
+    which lets update() fold in only the views logged since.
+    """
+
+    def __init__(self, animal_ids, cooccurrence, watermark=0, neighbors=DEFAULT_NEIGHBORS,
+                 similarity=None, built_at=None):
+        self.animal_ids = animal_ids    # Sorted, aligned with the matrix rows and columns
+        self.cooccurrence = cooccurrence
+        self.watermark = watermark
+        self.neighbors = neighbors
+        self.similarity = similarity if similarity is not None else self._similarity()
+        self.built_at = built_at
+
+    @classmethod
+    def build(cls, neighbors=DEFAULT_NEIGHBORS, block_size=DEFAULT_BLOCK_SIZE):
+        """Fold the whole view history into a new model"""
+        from animals.models import Animal, AnimalViewHistory
+
+        watermark = AnimalViewHistory.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        animal_ids = np.asarray(Animal.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        model = cls(animal_ids, sp.csr_matrix((len(animal_ids), len(animal_ids))),
+                    watermark=watermark, neighbors=neighbors, similarity=sp.csr_matrix((0, 0)))
+
+        history = AnimalViewHistory.objects.filter(id__lte=watermark) \
+            .order_by('user_id').values_list('user_id', 'animal_id')
+
+        users, animals = [], []
+        block_users = 0
+        previous_user = None
+        for user_id, animal_id in history.iterator(chunk_size=block_size):
+            if user_id != previous_user:
+                if block_users == block_size:
+                    model.cooccurrence = model.cooccurrence + model._block_cooccurrence(users, animals)
+                    users, animals, block_users = [], [], 0
+                previous_user = user_id
+                block_users += 1
+            users.append(user_id)
+            animals.append(animal_id)
+        if users:
+            model.cooccurrence = model.cooccurrence + model._block_cooccurrence(users, animals)
+
+        model.similarity = model._similarity()
+        model.built_at = timezone.now()
+        logger.info(f"Built co-view model over {len(animal_ids)} animals up to view {watermark}")
+        return model
+
+    def update(self, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Fold in the views logged since the watermark.
+
+        Only users with new views are touched: their binary rows are rebuilt
+        with and without the new views and the difference of the two
+        products is added to the co-occurrence counts. Returns the number of
+        new views folded in.
+        """
+        from animals.models import AnimalViewHistory
+
+        new_views = AnimalViewHistory.objects.filter(id__gt=self.watermark) \
+            .order_by('id').values_list('id', 'user_id', 'animal_id')
+
+        watermark = self.watermark
+        affected_users, new_animals = set(), set()
+        count = 0
+        for view_id, user_id, animal_id in new_views.iterator(chunk_size=block_size):
+            watermark = view_id
+            affected_users.add(user_id)
+            new_animals.add(animal_id)
+            count += 1
+
+        if not count:
+            return 0
+
+        self._extend_animals(new_animals)
+
+        affected_users = sorted(affected_users)
+        for start in range(0, len(affected_users), block_size):
+            block = affected_users[start:start + block_size]
+            history = AnimalViewHistory.objects.filter(user_id__in=block, id__lte=watermark) \
+                .values_list('id', 'user_id', 'animal_id')
+
+            old_users, old_animals, all_users, all_animals = [], [], [], []
+            for view_id, user_id, animal_id in history.iterator(chunk_size=block_size):
+                all_users.append(user_id)
+                all_animals.append(animal_id)
+                if view_id <= self.watermark:
+                    old_users.append(user_id)
+                    old_animals.append(animal_id)
+
+            delta = self._block_cooccurrence(all_users, all_animals) - \
+                self._block_cooccurrence(old_users, old_animals)
+            self.cooccurrence = self.cooccurrence + delta
+
+        self.cooccurrence.eliminate_zeros()
+        self.similarity = self._similarity()
+        self.watermark = watermark
+        self.built_at = timezone.now()
+        logger.info(f"Folded {count} new views from {len(affected_users)} users into the co-view model")
+        return count
+
+    def _block_cooccurrence(self, users, animals):
+        """Return B.T @ B for the binary user x animal matrix of a block of views"""
+        n = len(self.animal_ids)
+        if not users:
+            return sp.csr_matrix((n, n))
+
+        animals = np.asarray(animals, dtype=np.int64)
+        columns = np.minimum(np.searchsorted(self.animal_ids, animals), max(n - 1, 0))
+        known = self.animal_ids[columns] == animals if n else np.zeros(len(animals), dtype=bool)
+
+        # Row per distinct user in the block
+        _, rows = np.unique(np.asarray(users, dtype=np.int64), return_inverse=True)
+        block = sp.csr_matrix(
+            (np.ones(int(known.sum())), (rows[known], columns[known])),
+            shape=(int(rows.max()) + 1, n),
+        )
+        # Repeat views of the same animal count once
+        block.data[:] = 1
+        return (block.T @ block).tocsr()
+
+    def _extend_animals(self, animal_ids):
+        """Grow the matrices to cover animals added since the last build"""
+        missing = np.setdiff1d(np.asarray(sorted(animal_ids), dtype=np.int64), self.animal_ids)
+        if not len(missing):
+            return
+
+        merged = np.union1d(self.animal_ids, missing)
+        positions = np.searchsorted(merged, self.animal_ids)
+        coo = self.cooccurrence.tocoo()
+        self.cooccurrence = sp.csr_matrix(
+            (coo.data, (positions[coo.row], positions[coo.col])), shape=(len(merged), len(merged))
+        )
+        self.animal_ids = merged
+
+    def _similarity(self):
+        """Cosine similarity from the co-occurrence counts, pruned to the top neighbors per row"""
+        counts = self.cooccurrence.diagonal().astype(np.float64)
+        norms = np.zeros_like(counts)
+        norms[counts > 0] = 1 / np.sqrt(counts[counts > 0])
+
+        similarity = sp.diags(norms) @ self.cooccurrence @ sp.diags(norms)
+        similarity = sp.csr_matrix(similarity)
+        similarity.setdiag(0)
+        similarity.eliminate_zeros()
+
+        # Keep only the strongest neighbors of every animal
+        indptr = similarity.indptr
+        keep = np.ones(similarity.nnz, dtype=bool)
+        for row in np.flatnonzero(np.diff(indptr) > self.neighbors):
+            start, end = indptr[row], indptr[row + 1]
+            weakest = np.argpartition(-similarity.data[start:end], self.neighbors)[self.neighbors:]
+            keep[start + weakest] = False
+        if not keep.all():
+            coo = similarity.tocoo()
+            similarity = sp.csr_matrix(
+                (coo.data[keep], (coo.row[keep], coo.col[keep])), shape=similarity.shape
+            )
+        return similarity
+
+    def score_users(self, viewed_lists, candidate_ids):
+        """
+        Score candidates for several users at once.
+
+        Returns a (users x candidates) array with the mean co-view
+        similarity of every candidate to each user's distinct viewed
+        animals, in [0, 1].
+        """
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        scores = np.zeros((len(viewed_lists), len(candidate_ids)))
+        n = len(self.animal_ids)
+        if not n or not len(candidate_ids):
+            return scores
+
+        rows, cols = [], []
+        for i, viewed in enumerate(viewed_lists):
+            viewed = np.unique(np.asarray(viewed, dtype=np.int64))
+            positions = np.minimum(np.searchsorted(self.animal_ids, viewed), n - 1)
+            positions = positions[self.animal_ids[positions] == viewed]
+            rows.extend([i] * len(positions))
+            cols.extend(positions.tolist())
+        if not rows:
+            return scores
+
+        membership = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(viewed_lists), n))
+        counts = np.asarray(membership.sum(axis=1)).ravel()
+        membership = sp.diags(1 / np.maximum(counts, 1)) @ membership
+        user_scores = (membership @ self.similarity).toarray()
+
+        # Align the model's animals with the candidate ids
+        positions = np.minimum(np.searchsorted(self.animal_ids, candidate_ids), n - 1)
+        known = self.animal_ids[positions] == candidate_ids
+        scores[:, known] = user_scores[:, positions[known]]
+        return scores
+
+    def neighbors_of(self, animal_ids):
+        """Ids of the animals most often co-viewed with any of the given ones"""
+        n = len(self.animal_ids)
+        animal_ids = np.unique(np.asarray(animal_ids, dtype=np.int64))
+        if not n or not len(animal_ids):
+            return []
+
+        positions = np.minimum(np.searchsorted(self.animal_ids, animal_ids), n - 1)
+        positions = positions[self.animal_ids[positions] == animal_ids]
+        neighbors = np.unique(self.similarity[positions].indices)
+        return self.animal_ids[neighbors].tolist()
+
+    def save(self, path):
+        """Persist the artifact so workers can memory-map it"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        joblib.dump({
+            'animal_ids': np.asarray(self.animal_ids),
+            'cooccurrence_data': self.cooccurrence.data,
+            'cooccurrence_indices': self.cooccurrence.indices,
+            'cooccurrence_indptr': self.cooccurrence.indptr,
+            'similarity_data': self.similarity.data,
+            'similarity_indices': self.similarity.indices,
+            'similarity_indptr': self.similarity.indptr,
+            'watermark': self.watermark,
+            'neighbors': self.neighbors,
+            'built_at': self.built_at,
+        }, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a saved artifact, memory-mapping its arrays"""
+        state = joblib.load(path, mmap_mode=mmap_mode)
+        n = len(state['animal_ids'])
+        cooccurrence = sp.csr_matrix(
+            (state['cooccurrence_data'], state['cooccurrence_indices'], state['cooccurrence_indptr']),
+            shape=(n, n), copy=False,
+        )
+        similarity = sp.csr_matrix(
+            (state['similarity_data'], state['similarity_indices'], state['similarity_indptr']),
+            shape=(n, n), copy=False,
+        )
+        return cls(state['animal_ids'], cooccurrence, watermark=state['watermark'],
+                   neighbors=state['neighbors'], similarity=similarity, built_at=state.get('built_at'))
+
+    @classmethod
+    def load_dir(cls, directory, mmap_mode='r'):
+        """Load the artifact from a published version directory"""
+        return cls.load(os.path.join(directory, COVIEW_FILENAME), mmap_mode=mmap_mode)
+
+
+def publish_coview_model(model):
+    """Publish a model as a new version in the artifact store"""
+    return get_artifact_store().publish(
+        COVIEW_ARTIFACT, lambda directory: model.save(os.path.join(directory, COVIEW_FILENAME))
+    )
+
+
+def build_coview_model(path=None, neighbors=DEFAULT_NEIGHBORS, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Build the co-view model from the whole view history.
+
+    Publishes it as a new version in the artifact store, or writes a single
+    file when a path is given.
+    """
+    model = CoviewModel.build(neighbors=neighbors, block_size=block_size)
+    if path:
+        model.save(path)
+    else:
+        publish_coview_model(model)
+    return model
+
+
+def update_coview_model(path=None, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Fold the views logged since the last build into the saved model.
+
+    Works on the current published version (or the file at path) and
+    saves the result as a new version. Builds from scratch if there is no
+    saved model yet. Returns the model and the number of views folded in.
+    """
+    if path:
+        current = path if os.path.exists(path) else None
+    else:
+        directory = get_artifact_store().current_dir(COVIEW_ARTIFACT)
+        current = os.path.join(directory, COVIEW_FILENAME) if directory else None
+
+    if current is None:
+        model = build_coview_model(path, block_size=block_size)
+        return model, None
+
+    # Load into memory, the arrays are modified in place
+    model = CoviewModel.load(current, mmap_mode=None)
+    count = model.update(block_size=block_size)
+    if count:
+        if path:
+            model.save(path)
+        else:
+            publish_coview_model(model)
+    return model, count
+
+
+def get_coview_model():
+    """
+    Return the process-wide co-view model, or None.
+
+    The current published version is loaded memory-mapped and swapped for
+    newer versions as they are published. Until the build_coview_model
+    command has published one this returns None and callers skip the
+    co-view stage: the view history is never folded on the request path.
+    """
+    global _warned_unpublished
+    model = get_artifact_registry().get(COVIEW_ARTIFACT)
+    if model is None and not _warned_unpublished:
+        _warned_unpublished = True
+        logger.warning("No co-view model artifact has been published, skipping co-view scores; "
+                       "run the build_coview_model command")
+    return model
+
+
+def reset_coview_model():
+    """Drop the process-wide copy so the next call reloads it"""
+    get_artifact_registry().forget(COVIEW_ARTIFACT)
@@ -0,0 +1,240 @@
+# recommendations/evaluation.py
+
+import io
+import time
+import random
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .artifacts import get_artifact_registry
+from .als import FACTORS_ARTIFACT, FactorModel, ImplicitALS, load_interactions
+from .catalog import CATALOG_ARTIFACT, reset_catalog_snapshot
+from .content_vectors import CONTENT_VECTORS_ARTIFACT, ContentVectors
+from .coview import COVIEW_ARTIFACT, CoviewModel
+from .features import AnimalColumns
+
+logger = logging.getLogger(__name__)
+
+
+# The tables a chronological split reads, in dependency order; taste
+# profiles and popularity counters are rebuilt from the views
+EVALUATION_MODELS = ['auth.User', 'users.UserProfile', 'animals.Shelter', 'animals.Animal', 'animals.AnimalViewHistory']
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def isolated_database(verbosity=0):
+    """
+    Point the default connection at a fresh, migrated test database.
+
+    The database is destroyed on exit (for SQLite it lives in memory), so
+    synthetic data never touches the real one. The catalog snapshot is
+    dropped on the way in and out, as it describes the other database.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    reset_catalog_snapshot()
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        reset_catalog_snapshot()
+
+
+@contextmanager
+def copied_database(models=EVALUATION_MODELS, verbosity=0):
+    """
+    isolated_database holding a copy of models from the current database.
+
+    The rows are read before switching and bulk inserted afterwards, so no
+    signal handler runs for them. Replaying the real history on the copy
+    never writes to, or locks, the live tables.
+    """
+    rows = [
+        (model, list(model._base_manager.order_by().values()))
+        for model in (apps.get_model(label) for label in models)
+    ]
+    with isolated_database(verbosity=verbosity):
+        for model, values in rows:
+            model._base_manager.bulk_create((model(**row) for row in values), batch_size=1000)
+        yield
+
+
+@contextmanager
+def models_for_current_data(with_factors=False, factor_iterations=5):
+    """
+    Serve content vectors, co-view and factor models fit on the current data.
+
+    Published artifacts describe the production history, which would leak
+    the held-out views into an evaluation (or not match a synthetic
+    catalog at all), so they are overridden for the duration.
+    """
+    from animals.models import Animal
+
+    overrides = {
+        CATALOG_ARTIFACT: None,    # Built from the current database on first use
+        CONTENT_VECTORS_ARTIFACT: ContentVectors.fit(AnimalColumns.from_queryset(Animal.objects.all())),
+        COVIEW_ARTIFACT: CoviewModel.build(),
+        FACTORS_ARTIFACT: None,
+    }
+    if with_factors:
+        user_ids, animal_ids, matrix = load_interactions()
+        user_factors, item_factors = ImplicitALS(iterations=factor_iterations).fit(matrix)
+        overrides[FACTORS_ARTIFACT] = FactorModel(user_ids, animal_ids, user_factors, item_factors)
+
+    with get_artifact_registry().override(**overrides):
+        yield
+
+
+def evaluate_chronological_split(engine, k=10, test_fraction=0.2, max_users=None, with_factors=False, seed=0):
+    """
+    Replay a chronological split of the view history against the engine.
+
+    The newest test_fraction of all views is held out: inside a transaction
+    that is always rolled back, those views are deleted, the taste profiles
+    and popularity counters are rebuilt from what is left, and the engine
+    recommends k animals to every user with held-out views. Returns
+    precision@k, recall@k (against the distinct animals each user viewed
+    in the held-out period) and catalog coverage.
+
+    The replay holds write locks on the view, taste profile and popularity
+    tables until it is done, so run it on an isolated database: synthetic
+    data (run_synthetic_benchmark) or a copy of the real one
+    (copied_database), never the live tables.
+    """
+    from django.contrib.auth.models import User
+    from animals.models import Animal, AnimalViewHistory
+    from .models import UserTasteProfile
+
+    total_views = AnimalViewHistory.objects.count()
+    if total_views < 2:
+        return None
+
+    cutoff_offset = min(int(total_views * (1 - test_fraction)), total_views - 1)
+    cutoff = AnimalViewHistory.objects.order_by('timestamp').values_list('timestamp', flat=True)[cutoff_offset]
+
+    held_out = {}
+    test_views = AnimalViewHistory.objects.filter(timestamp__gte=cutoff)
+    for user_id, animal_id in test_views.values_list('user_id', 'animal_id').iterator():
+        held_out.setdefault(user_id, set()).add(animal_id)
+
+    test_count = test_views.count()
+    user_ids = sorted(held_out)
+    if max_users and len(user_ids) > max_users:
+        user_ids = sorted(random.Random(seed).sample(user_ids, max_users))
+
+    results = None
+    try:
+        with transaction.atomic():
+            test_views.delete()
+
+            # Bring the derived state back to what it was at the cutoff
+            for user in User.objects.filter(id__in=user_ids).iterator():
+                UserTasteProfile.rebuild_for_user(user)
+            call_command('rebuild_popularity', stdout=io.StringIO())
+
+            available = Animal.objects.filter(status='A').count()
+            started = time.perf_counter()
+            with models_for_current_data(with_factors=with_factors):
+                if engine.retrieval_mode == 'full':
+                    recommendations = engine.get_recommendations_batch(user_ids, limit=k)
+                else:
+                    # The batch path always scores the whole catalog
+                    recommendations = {user_id: engine.get_recommendations(user_id, limit=k) for user_id in user_ids}
+            elapsed = time.perf_counter() - started
+
+            precisions, recalls, recommended = [], [], set()
+            for user_id in user_ids:
+                recommended_ids = recommendations.get(user_id, [])[:k]
+                hits = len(set(recommended_ids) & held_out[user_id])
+                precisions.append(hits / k)
+                recalls.append(hits / len(held_out[user_id]))
+                recommended.update(recommended_ids)
+
+            results = {
+                'k': k,
+                'users': len(user_ids),
+                'train_views': total_views - test_count,
+                'test_views': test_count,
+                'precision_at_k': float(np.mean(precisions)) if precisions else 0.0,
+                'recall_at_k': float(np.mean(recalls)) if recalls else 0.0,
+                'coverage': len(recommended) / available if available else 0.0,
+                'seconds': elapsed,
+            }
+            raise _Rollback()
+    except _Rollback:
+        pass
+
+    return results
+
+
+def measure_latency(engine, user_ids, limit=10):
+    """
+    Time get_recommendations for each user.
+
+    Returns p50/p95/p99 latency in milliseconds and the mean number of
+    queries per call. The first call is a warm-up and is not counted.
+    """
+    if not user_ids:
+        return None
+
+    engine.get_recommendations(user_ids[0], limit)
+
+    timings, queries = [], []
+    for user_id in user_ids:
+        # The query log is a bounded deque, keep it from filling up
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            engine.get_recommendations(user_id, limit)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(context.captured_queries))
+
+    return {
+        'calls': len(timings),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'queries_per_call': float(np.mean(queries)),
+    }
+
+
+def run_synthetic_benchmark(engine, n_animals, n_users=200, views_per_user=20, latency_users=50,
+                            k=10, test_fraction=0.2, with_factors=False, seed=0):
+    """
+    Build a synthetic catalog in an isolated database and evaluate the engine on it.
+
+    Returns the chronological-split metrics and the latency figures.
+    """
+    from .synthetic import create_synthetic_data
+
+    with isolated_database():
+        started = time.perf_counter()
+        data = create_synthetic_data(n_animals, n_users, views_per_user=views_per_user, seed=seed)
+        setup_seconds = time.perf_counter() - started
+
+        quality = evaluate_chronological_split(
+            engine, k=k, test_fraction=test_fraction, with_factors=with_factors, seed=seed
+        )
+
+        sample = random.Random(seed).sample(data.user_ids, min(latency_users, len(data.user_ids)))
+        with models_for_current_data(with_factors=with_factors):
+            latency = measure_latency(engine, sample, limit=k)
+
+    return {
+        'animals': n_animals,
+        'users': n_users,
+        'views': data.view_count,
+        'setup_seconds': setup_seconds,
+        'quality': quality,
+        'latency': latency,
+    }
@@ -0,0 +1,210 @@
+# recommendations/features.py
+
+import numpy as np
+import scipy.sparse as sp
+
+# Species that count as a match for the 'Small Animal' preference
+SMALL_ANIMALS = ['Hamster', 'Guinea Pig', 'Rabbit', 'Gerbil', 'Mouse', 'Rat', 'Ferret']
+
+# Animal columns the scorers need, in the order they are fetched
+CANDIDATE_FIELDS = (
+    'id', 'species', 'breed', 'size', 'energy_level', 'age_years', 'age_months',
+    'good_with_kids', 'good_with_cats', 'good_with_dogs',
+)
+
+
+class AnimalColumns:
+    """
+    Column-oriented (struct of arrays) view of a pool of animals.
+
+    Built from a single values_list query so the scorers can work on whole
+    NumPy columns instead of instantiating one Django model per animal.
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        n = len(rows)
+
+        self.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+        self.species = np.array([row[1] or '' for row in rows], dtype=object)
+        self.breed = np.array([row[2] or '' for row in rows], dtype=object)
+        self.size = np.array([row[3] or '' for row in rows], dtype=object)
+        self.energy_level = np.array([row[4] or '' for row in rows], dtype=object)
+
+        # Age in (fractional) years, matching age_years + age_months / 12
+        age_years = np.fromiter((row[5] or 0 for row in rows), dtype=np.float64, count=n)
+        age_months = np.fromiter((row[6] or 0 for row in rows), dtype=np.float64, count=n)
+        self.age = age_years + age_months / 12
+
+        # Compatibility flags
+        self.good_with_kids = np.fromiter((bool(row[7]) for row in rows), dtype=bool, count=n)
+        self.good_with_cats = np.fromiter((bool(row[8]) for row in rows), dtype=bool, count=n)
+        self.good_with_dogs = np.fromiter((bool(row[9]) for row in rows), dtype=bool, count=n)
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """Load the candidate columns for an Animal queryset in one query"""
+        return cls(queryset.values_list(*CANDIDATE_FIELDS))
+
+    @classmethod
+    def from_arrays(cls, ids, species, breed, size, energy_level, age,
+                    good_with_kids, good_with_cats, good_with_dogs):
+        """Wrap columns that are already decoded (see catalog.CatalogSnapshot)"""
+        columns = cls([])
+        columns.ids = ids
+        columns.species = species
+        columns.breed = breed
+        columns.size = size
+        columns.energy_level = energy_level
+        columns.age = age
+        columns.good_with_kids = good_with_kids
+        columns.good_with_cats = good_with_cats
+        columns.good_with_dogs = good_with_dogs
+        return columns
+
+    def __len__(self):
+        return len(self.ids)
+
+    def feature_texts(self):
+        """Build the content-similarity feature document for every animal"""
+        return [
+            animal_feature_text(
+                self.species[i], self.breed[i], self.size[i], self.age[i], self.energy_level[i],
+                self.good_with_kids[i], self.good_with_cats[i], self.good_with_dogs[i],
+            )
+            for i in range(len(self.ids))
+        ]
+
+    def align(self, scores):
+        """Turn an {animal_id: score} dict into an array aligned with self.ids"""
+        return np.fromiter(
+            (scores.get(animal_id, 0.0) for animal_id in self.ids.tolist()),
+            dtype=np.float64,
+            count=len(self.ids),
+        )
+
+
+class CatalogFeatures:
+    """
+    Sparse one-hot encoding of an AnimalColumns pool.
+
+    Columns cover species, breed, size and energy level values plus the
+    compatibility flags, so any per-user weight vector over them scores the
+    whole pool with one matrix product.
+    """
+
+    CATEGORICALS = ['species', 'breed', 'size', 'energy_level']
+    FLAGS = ['good_with_kids', 'good_with_cats', 'good_with_dogs', 'good_with_other_pets', 'small_animal']
+
+    def __init__(self, columns):
+        n = len(columns)
+        self.index = {}
+        row_blocks, col_blocks = [], []
+        offset = 0
+
+        for field in self.CATEGORICALS:
+            values, inverse = np.unique(getattr(columns, field), return_inverse=True)
+            present = np.ones(n, dtype=bool)
+            for position, value in enumerate(values):
+                if value:
+                    self.index[(field, value)] = offset + position
+                else:
+                    # Blank values never match anything
+                    present &= inverse != position
+            row_blocks.append(np.flatnonzero(present))
+            col_blocks.append(offset + inverse[present])
+            offset += len(values)
+
+        flags = {
+            'good_with_kids': columns.good_with_kids,
+            'good_with_cats': columns.good_with_cats,
+            'good_with_dogs': columns.good_with_dogs,
+            'good_with_other_pets': columns.good_with_cats | columns.good_with_dogs,
+            'small_animal': np.isin(columns.species, SMALL_ANIMALS),
+        }
+        for flag in self.FLAGS:
+            self.index[('flag', flag)] = offset
+            rows = np.flatnonzero(flags[flag])
+            row_blocks.append(rows)
+            col_blocks.append(np.full(len(rows), offset))
+            offset += 1
+
+        rows = np.concatenate(row_blocks).astype(np.int64)
+        cols = np.concatenate(col_blocks).astype(np.int64)
+        self.matrix = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, offset))
+
+    @property
+    def width(self):
+        return self.matrix.shape[1]
+
+    def column(self, field, value):
+        """Return the column for a field value, or None if no animal has it"""
+        return self.index.get((field, value))
+
+
+def age_category(age_in_years):
+    """Bucket an age in years into young / adult / senior"""
+    return "young" if age_in_years < 2 else "adult" if age_in_years < 8 else "senior"
+
+
+def animal_feature_text(species, breed, size, age_in_years, energy_level,
+                        good_with_kids, good_with_cats, good_with_dogs):
+    """Combine an animal's attributes into a space separated feature document"""
+    text_features = [f"species_{species}"]
+
+    if breed:
+        text_features.append(f"breed_{breed}")
+    if size:
+        text_features.append(f"size_{size}")
+
+    text_features.append(f"age_{age_category(age_in_years)}")
+
+    if energy_level:
+        text_features.append(f"energy_{energy_level}")
+
+    # Add compatibility features
+    if good_with_kids:
+        text_features.append('good_with_kids')
+    if good_with_cats:
+        text_features.append('good_with_cats')
+    if good_with_dogs:
+        text_features.append('good_with_dogs')
+
+    return " ".join(text_features)
+
+
+def lookup_column(column, values):
+    """
+    Map every entry of a categorical column through a {value: weight} dict.
+
+    Looks each distinct value up once; missing and empty values score 0.
+    """
+    if len(column) == 0:
+        return np.zeros(0)
+    uniques, inverse = np.unique(column, return_inverse=True)
+    weights = np.array([values.get(value, 0.0) if value else 0.0 for value in uniques], dtype=np.float64)
+    return weights[inverse]
+
+
+def top_k(ids, scores, k):
+    """
+    Return the ids with the k highest scores, best first.
+
+    Uses argpartition so only the k winners are sorted. Ties are broken by
+    position, which gives the same order as a stable full sort.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return []
+
+    if k < n:
+        partition = np.argpartition(-scores, k - 1)[:k]
+        threshold = scores[partition].min()
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        selected = np.concatenate([above, ties])
+    else:
+        selected = np.arange(n)
+
+    order = selected[np.lexsort((selected, -scores[selected]))]
+    return ids[order].tolist()
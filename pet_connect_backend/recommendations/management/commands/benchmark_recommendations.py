@@ -0,0 +1,90 @@
+"""
+Pet Connect - Benchmark Recommendations Command
+------------------------------------------
+Management command to microbenchmark the recommendation engine stages.
+
+Every stage is timed on its own across catalog sizes and history lengths,
+against seeded synthetic data in an isolated database, and the ops/sec,
+allocations and query counts are written to a JSON baseline. The previous
+baseline is compared first, so regressions show up both in the output and
+in the diff of the baseline file.
+"""
+
+import os
+import json
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from recommendations.benchmarks import STAGES, compare_to_baseline, run_stage_benchmarks
+from recommendations.recommendation_engine import MLRecommendationEngine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'benchmark_baseline.json'
+)
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size.strip()]
+
+class Command(BaseCommand):
+    help = 'Times each recommendation engine stage on synthetic data and saves a JSON baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--catalog_sizes', type=str, default='1000,10000', help='Comma separated catalog sizes')
+        parser.add_argument('--history_lengths', type=str, default='0,20,200', help='Comma separated view counts')
+        parser.add_argument('--stages', type=str, help=f'Comma separated subset of {", ".join(STAGES)}')
+        parser.add_argument('--min_time', type=float, default=0.5, help='Seconds each stage is timed for')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='Baseline to compare to and update')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed drop in ops/sec before flagging')
+        parser.add_argument('--no_save', action='store_true', help='Compare only, leave the baseline untouched')
+
+    def handle(self, *args, **options):
+        stages = STAGES
+        if options.get('stages'):
+            stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+            unknown = set(stages) - set(STAGES)
+            if unknown:
+                raise CommandError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+        catalog_sizes = parse_sizes(options['catalog_sizes'])
+        history_lengths = parse_sizes(options['history_lengths'])
+        self.stdout.write(
+            f"Benchmarking {len(stages)} stages over catalogs of {catalog_sizes} animals "
+            f"and histories of {history_lengths} views..."
+        )
+
+        rows = run_stage_benchmarks(
+            MLRecommendationEngine(), catalog_sizes, history_lengths,
+            stages=stages, seed=options['seed'], min_time=options['min_time'],
+        )
+
+        for row in rows:
+            self.stdout.write(f"catalog {row['catalog_size']}, history {row['history_length']}:")
+            for stage, result in row['stages'].items():
+                self.stdout.write(
+                    f"  {stage:<28} {result['ops_per_sec']:>10.1f} ops/sec {result['mean_ms']:>9.3f} ms "
+                    f"{result['queries']:>3} queries {result['allocated_blocks']:>7} blocks "
+                    f"{result['peak_bytes'] / 1024:>9.1f} KiB peak"
+                )
+
+        baseline_path = options['baseline']
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                regressions = compare_to_baseline(rows, json.load(f)['results'], options['tolerance'])
+            if regressions:
+                self.stdout.write(self.style.WARNING(f"{len(regressions)} regressions against {baseline_path}:"))
+                for line in regressions:
+                    self.stdout.write(self.style.WARNING(f"  {line}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline_path}"))
+
+        if not options['no_save']:
+            for row in rows:
+                for result in row['stages'].values():
+                    result['ops_per_sec'] = round(result['ops_per_sec'], 1)
+                    result['mean_ms'] = round(result['mean_ms'], 3)
+            with open(baseline_path, 'w') as f:
+                json.dump({'seed': options['seed'], 'results': rows}, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {baseline_path}"))
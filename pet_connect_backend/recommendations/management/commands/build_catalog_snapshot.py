@@ -0,0 +1,65 @@
+"""
+Pet Connect - Build Catalog Snapshot Command
+------------------------------------------
+Management command to publish the columnar snapshot of the available animals that workers memory-map.
+
+Requests never republish the snapshot themselves. Run the command with
+--watch next to the web workers (see the Procfile) to republish it every
+RECOMMENDATION_CATALOG_MAX_AGE seconds, or schedule it that often.
+"""
+
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from recommendations.artifacts import get_artifact_store
+from recommendations.catalog import CATALOG_ARTIFACT, CatalogSnapshot, publish_catalog_snapshot
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Builds the columnar snapshot of the available animals and publishes it as an artifact'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, help='Write the snapshot into a directory instead of publishing a new version')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep republishing every RECOMMENDATION_CATALOG_MAX_AGE seconds')
+
+    def handle(self, *args, **options):
+        if not options.get('watch'):
+            self.build(options.get('output'))
+            return
+
+        interval = settings.RECOMMENDATION_CATALOG_MAX_AGE
+        self.stdout.write(f"Republishing the catalog snapshot every {interval}s")
+        while True:
+            started = time.monotonic()
+            try:
+                close_old_connections()
+                # With several watchers on one store, one publishes per round
+                with get_artifact_store().writer_lock(CATALOG_ARTIFACT, blocking=False) as lock:
+                    if lock.acquired:
+                        self.build(options.get('output'))
+            except Exception as e:
+                # Workers keep the last published version until the next run
+                logger.error(f"Error publishing the catalog snapshot: {str(e)}")
+                self.stdout.write(self.style.ERROR("Error publishing the catalog snapshot"))
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+
+    def build(self, path):
+        destination = path or "the artifact store"
+        started = time.monotonic()
+
+        self.stdout.write("Building the catalog snapshot...")
+        snapshot = CatalogSnapshot.build()
+        if path:
+            snapshot.save(path)
+        else:
+            publish_catalog_snapshot(snapshot)
+
+        logger.info(f"Saved catalog snapshot of {len(snapshot)} animals to {destination}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved catalog snapshot of {len(snapshot)} available animals "
+            f"to {destination} in {time.monotonic() - started:.2f}s"
+        ))
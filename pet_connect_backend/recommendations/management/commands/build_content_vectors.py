@@ -0,0 +1,30 @@
+"""
+Pet Connect - Build Content Vectors Command
+------------------------------------------
+Management command to fit the fixed TF-IDF vocabulary used for content similarity.
+"""
+
+import logging
+from django.core.management.base import BaseCommand
+from recommendations.content_vectors import build_content_vectors
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Fits the content-similarity vocabulary and animal vectors and saves them as an artifact'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, help='Write a single artifact file instead of publishing a new version')
+
+    def handle(self, *args, **options):
+        path = options.get('output')
+
+        self.stdout.write("Fitting content vectors on the animal catalog...")
+        vectors = build_content_vectors(path)
+
+        destination = path or "the artifact store"
+        logger.info(f"Saved content vectors for {len(vectors.animal_ids)} animals to {destination}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {len(vectors.animal_ids)} animal vectors with "
+            f"{len(vectors.vocabulary)} terms to {destination}"
+        ))
@@ -0,0 +1,38 @@
+"""
+Pet Connect - Build Similar Animals Command
+------------------------------------------
+Management command to precompute the content-similar neighbors of every available animal.
+
+With --pending only the animals queued by saves and deletes since the last
+run are refreshed; schedule that every few minutes and the full build
+nightly.
+"""
+
+import logging
+import time
+from django.core.management.base import BaseCommand
+from recommendations.similar_animals import DEFAULT_NEIGHBORS, build_similar_animals, refresh_similar_animals
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Precomputes the most similar available animals for every available animal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbors', type=int, default=DEFAULT_NEIGHBORS, help='Neighbors kept per animal')
+        parser.add_argument('--block_size', type=int, default=512, help='Animals compared per matrix block')
+        parser.add_argument('--pending', action='store_true', help='Only refresh the animals queued since the last run')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        if options.get('pending'):
+            self.stdout.write("Refreshing queued similar animal lists...")
+            count = refresh_similar_animals(options.get('neighbors'), options.get('block_size'))
+        else:
+            self.stdout.write("Computing similar animal lists...")
+            count = build_similar_animals(options.get('neighbors'), options.get('block_size'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored neighbor lists for {count} animals in {time.monotonic() - started:.1f}s"
+        ))
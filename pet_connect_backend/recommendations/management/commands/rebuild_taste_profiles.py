@@ -0,0 +1,45 @@
+"""
+Pet Connect - Rebuild Taste Profiles Command
+-------------------------------------------
+Management command to rebuild users' taste profiles from their view history.
+"""
+
+import logging
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from animals.models import AnimalViewHistory
+from recommendations.models import UserTasteProfile
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Rebuilds the decayed taste profiles from AnimalViewHistory for all users or a specific user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user_id', type=int, help='User ID to rebuild the taste profile for')
+
+    def handle(self, *args, **options):
+        user_id = options.get('user_id')
+
+        if user_id:
+            users = User.objects.filter(id=user_id)
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f"User with ID {user_id} not found"))
+                return
+        else:
+            # Only users who have viewed something need a profile
+            viewer_ids = AnimalViewHistory.objects.values_list('user_id', flat=True).distinct()
+            users = User.objects.filter(id__in=viewer_ids)
+
+        total = users.count()
+        self.stdout.write(f"Rebuilding taste profiles for {total} users")
+
+        for i, user in enumerate(users.iterator()):
+            try:
+                profile = UserTasteProfile.rebuild_for_user(user)
+                self.stdout.write(f"[{i+1}/{total}] Rebuilt profile for {user.username} from {profile.view_count} views")
+            except Exception as e:
+                logger.error(f"Error rebuilding taste profile for user {user.id}: {str(e)}")
+                self.stdout.write(self.style.ERROR(f"Error rebuilding taste profile for user {user.username}"))
+
+        self.stdout.write(self.style.SUCCESS("Successfully rebuilt taste profiles"))
@@ -1,80 +1,58 @@
+"""
+Pet Connect - Train Recommendation Model Command
+------------------------------------------
+Management command to fit the implicit-feedback matrix factorization model.
+
+The view history is streamed straight into a sparse user x animal matrix
+(weighted by view duration and recency), factorized with implicit ALS and
+published as a new version of the user and animal factor arrays, which
+running workers pick up without a restart.
+"""
+
 import logging
-import pandas as pd
+import time
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User
-from animals.models import Animal, AnimalViewHistory
-from recommendations.recommendation_engine import HybridRecommendationEngine
+from recommendations.als import train_factor_model
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Train the recommendation engine with existing data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--output', type=str, help='Write the factors into a directory instead of publishing a new version')
+        parser.add_argument('--factors', type=int, default=32, help='Number of latent factors')
+        parser.add_argument('--regularization', type=float, default=0.1, help='L2 regularization')
+        parser.add_argument('--alpha', type=float, default=40.0, help='Confidence scaling of view strength')
+        parser.add_argument('--iterations', type=int, default=10, help='ALS iterations')
+        parser.add_argument('--workers', type=int, default=4, help='Threads solving row blocks')
+        parser.add_argument('--block_size', type=int, default=256, help='Rows per batched solve')
+        parser.add_argument('--half_life_days', type=float, default=30, help='Days after which a view counts half')
+
     def handle(self, *args, **options):
         self.stdout.write('Starting recommendation model training...')
-        
+        directory = options.get('output')
+        started = time.monotonic()
+
         try:
-            # Initialize the recommendation engine
-            engine = HybridRecommendationEngine()
-            
-            # Get animal data
-            animals = Animal.objects.all()
-            self.stdout.write(f'Found {animals.count()} animals in database')
-            
-            # Convert to dataframe
-            animal_data = []
-            for animal in animals:
-                animal_data.append({
-                    'id': animal.id,
-                    'name': animal.name,
-                    'species': animal.species,
-                    'breed': animal.breed,
-                    'age': animal.age_years,
-                    'gender': animal.gender,
-                    'size': animal.size,
-                    'energy_level': animal.energy_level,
-                    'behavior_traits': animal.behavior_traits,
-                    'description': animal.description,
-                })
-            
-            animals_df = pd.DataFrame(animal_data)
-            self.stdout.write(f'Converted {len(animals_df)} animals to DataFrame')
-            
-            # Get interaction data
-            views = AnimalViewHistory.objects.all()
-            self.stdout.write(f'Found {views.count()} view records in database')
-            
-            # Convert to dataframe
-            interaction_data = []
-            for view in views:
-                interaction_data.append({
-                    'user_id': view.user.id,
-                    'pet_id': view.animal.id,
-                    'interaction_type': 'view',
-                    'timestamp': view.timestamp,
-                })
-            
-            interactions_df = pd.DataFrame(interaction_data)
-            self.stdout.write(f'Converted {len(interactions_df)} interactions to DataFrame')
-            
-            # Train the content-based model
-            if not animals_df.empty:
-                self.stdout.write('Training content-based model...')
-                engine.train_content_based_model(animals_df)
-                self.stdout.write(self.style.SUCCESS('Content-based model trained successfully!'))
-            
-            # Train the collaborative model if we have enough data
-            if not interactions_df.empty and len(interactions_df) >= 10:
-                self.stdout.write('Training collaborative model...')
-                engine.train_collaborative_model(interactions_df)
-                self.stdout.write(self.style.SUCCESS('Collaborative model trained successfully!'))
-            else:
-                self.stdout.write(self.style.WARNING(
-                    f'Not enough interaction data to train collaborative model ({len(interactions_df)} < 10)'
-                ))
-            
-            self.stdout.write(self.style.SUCCESS('Recommendation model training completed!'))
-            
+            model, interactions = train_factor_model(
+                directory,
+                half_life_days=options.get('half_life_days'),
+                factors=options.get('factors'),
+                regularization=options.get('regularization'),
+                alpha=options.get('alpha'),
+                iterations=options.get('iterations'),
+                workers=options.get('workers'),
+                block_size=options.get('block_size'),
+            )
+
+            logger.info(f"Trained factor model version {model.version} on {interactions} user/animal pairs")
+            self.stdout.write(self.style.SUCCESS(
+                f'Trained {options.get("factors")} factors for {len(model.user_ids)} users and '
+                f'{len(model.animal_ids)} animals from {interactions} user/animal pairs '
+                f'in {time.monotonic() - started:.1f}s (version {model.version or directory})'
+            ))
+
         except Exception as e:
             self.stderr.write(self.style.ERROR(f'Error training recommendation model: {str(e)}'))
-            logger.error(f'Error training recommendation model: {str(e)}', exc_info=True)
\ No newline at end of file
+            logger.error(f'Error training recommendation model: {str(e)}', exc_info=True)
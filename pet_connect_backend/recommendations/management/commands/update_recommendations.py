@@ -3,54 +3,192 @@ Pet Connect - Update Recommendations Command
 ------------------------------------------
 Management command to update all recommendations.
 
+Users are split into shards of consecutive ids. Shards are scored with the
+batch engine, optionally across a pool of worker processes, and each
+shard's top-k is saved into AnimalRecommendation. Completed shards are
+checkpointed so a killed run picks up where it stopped.
+
 Author: Macayla van der Merwe
 """
 
+import json
 import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from recommendations.recommendation_engine import PetConnectRecommendationEngine
+from django.db import connections
+from recommendations.recommendation_engine import MLRecommendationEngine
+from recommendations.utils import store_recommendations
 
 logger = logging.getLogger(__name__)
 
+CHECKPOINT_FILENAME = 'update_recommendations.checkpoint.json'
+
+
+def _init_worker():
+    """Give each worker process its own database connections"""
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def _score_shard(first_id, last_id, limit):
+    """Score every user in an id range (runs in a worker process)"""
+    user_ids = list(
+        User.objects.filter(id__gte=first_id, id__lte=last_id).order_by('id').values_list('id', flat=True)
+    )
+    return MLRecommendationEngine().get_recommendations_batch(user_ids, limit, with_scores=True)
+
+
 class Command(BaseCommand):
     help = 'Updates recommendations for all users or a specific user'
-    
+
     def add_arguments(self, parser):
         parser.add_argument('--user_id', type=int, help='User ID to update recommendations for')
         parser.add_argument('--limit', type=int, default=20, help='Number of recommendations to generate per user')
-    
+        parser.add_argument('--batch_size', type=int, default=500, help='Number of users per shard (one catalog pass each)')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes scoring shards')
+        parser.add_argument('--checkpoint', type=str, help='Checkpoint file (defaults to RECOMMENDATION_ARTIFACT_DIR)')
+        parser.add_argument('--fresh', action='store_true', help='Ignore an existing checkpoint and start over')
+
     def handle(self, *args, **options):
-        recommendation_engine = PetConnectRecommendationEngine()
+        recommendation_engine = MLRecommendationEngine()
         user_id = options.get('user_id')
         limit = options.get('limit')
-        
+
         if user_id:
             # Update for specific user
             try:
                 user = User.objects.get(id=user_id)
                 self.stdout.write(f"Updating recommendations for user: {user.username}")
-                
-                recommendations = recommendation_engine.get_recommendations(user_id, limit)
-                
+
+                results = recommendation_engine.get_recommendations_batch([user_id], limit, with_scores=True)
+                store_recommendations(results)
+
                 self.stdout.write(self.style.SUCCESS(
-                    f"Successfully updated {len(recommendations)} recommendations for user {user.username}"
+                    f"Successfully updated {len(results.get(user_id, []))} recommendations for user {user.username}"
                 ))
             except User.DoesNotExist:
                 self.stdout.write(self.style.ERROR(f"User with ID {user_id} not found"))
         else:
-            # Update for all users
-            users = User.objects.all()
-            total = users.count()
-            
-            self.stdout.write(f"Updating recommendations for {total} users")
-            
-            for i, user in enumerate(users):
+            self.update_all_users(options)
+
+    def update_all_users(self, options):
+        """Score and store every user's recommendations, shard by shard"""
+        limit = options.get('limit')
+        workers = max(1, options.get('workers'))
+        checkpoint_path = options.get('checkpoint') or os.path.join(
+            settings.RECOMMENDATION_ARTIFACT_DIR, CHECKPOINT_FILENAME
+        )
+
+        checkpoint = None if options.get('fresh') else self.load_checkpoint(checkpoint_path, limit)
+        if checkpoint:
+            self.stdout.write(
+                f"Resuming from {checkpoint_path}: {len(checkpoint['completed'])} of "
+                f"{len(checkpoint['shards'])} shards already done"
+            )
+            # Users who signed up since the run started get shards of their own
+            last_id = checkpoint['shards'][-1][1] if checkpoint['shards'] else 0
+            checkpoint['shards'].extend(self.make_shards(options.get('batch_size'), after_id=last_id))
+        else:
+            checkpoint = {'limit': limit, 'shards': self.make_shards(options.get('batch_size')), 'completed': []}
+        self.save_checkpoint(checkpoint_path, checkpoint)
+
+        completed = {tuple(shard) for shard in checkpoint['completed']}
+        pending = [shard for shard in checkpoint['shards'] if tuple(shard) not in completed]
+
+        self.stdout.write(
+            f"Updating recommendations in {len(pending)} shards "
+            f"with {workers} worker{'s' if workers != 1 else ''}"
+        )
+
+        started = time.monotonic()
+        users_done = 0
+
+        def shard_finished(shard, results):
+            nonlocal users_done
+            rows = store_recommendations(results)
+            checkpoint['completed'].append(list(shard))
+            self.save_checkpoint(checkpoint_path, checkpoint)
+
+            users_done += len(results)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"[{len(checkpoint['completed'])}/{len(checkpoint['shards'])}] Shard {shard[0]}-{shard[1]}: "
+                f"{len(results)} users, {rows} rows stored "
+                f"({users_done / elapsed if elapsed else 0:.1f} users/s)"
+            )
+
+        failed = 0
+        if workers == 1:
+            for shard in pending:
                 try:
-                    recommendations = recommendation_engine.get_recommendations(user.id, limit)
-                    self.stdout.write(f"[{i+1}/{total}] Updated {len(recommendations)} recommendations for user {user.username}")
+                    shard_finished(shard, _score_shard(shard[0], shard[1], limit))
                 except Exception as e:
-                    logger.error(f"Error updating recommendations for user {user.id}: {str(e)}")
-                    self.stdout.write(self.style.ERROR(f"Error updating recommendations for user {user.username}"))
-            
-            self.stdout.write(self.style.SUCCESS("Successfully updated recommendations for all users"))
\ No newline at end of file
+                    failed += 1
+                    logger.error(f"Error updating recommendations for users {shard[0]}-{shard[1]}: {str(e)}")
+                    self.stdout.write(self.style.ERROR(f"Error updating recommendations for users {shard[0]}-{shard[1]}"))
+        else:
+            # Forked workers must not share the parent's connection
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                futures = {pool.submit(_score_shard, shard[0], shard[1], limit): shard for shard in pending}
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    try:
+                        shard_finished(shard, future.result())
+                    except Exception as e:
+                        failed += 1
+                        logger.error(f"Error updating recommendations for users {shard[0]}-{shard[1]}: {str(e)}")
+                        self.stdout.write(self.style.ERROR(f"Error updating recommendations for users {shard[0]}-{shard[1]}"))
+
+        elapsed = time.monotonic() - started
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f"{failed} shards failed; run the command again to retry them (checkpoint kept at {checkpoint_path})"
+            ))
+            return
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully updated recommendations for {users_done} users in {elapsed:.1f}s "
+            f"({users_done / elapsed if elapsed else 0:.1f} users/s)"
+        ))
+
+    def make_shards(self, batch_size, after_id=0):
+        """Split user ids into [first_id, last_id] ranges of batch_size users"""
+        user_ids = list(User.objects.filter(id__gt=after_id).order_by('id').values_list('id', flat=True))
+        return [
+            [user_ids[start], user_ids[min(start + batch_size, len(user_ids)) - 1]]
+            for start in range(0, len(user_ids), batch_size)
+        ]
+
+    def load_checkpoint(self, path, limit):
+        """Return the checkpoint of an interrupted run, if it is compatible"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {path}: {str(e)}")
+            return None
+        if checkpoint.get('limit') != limit:
+            self.stdout.write(self.style.WARNING(
+                f"Checkpoint {path} was written with --limit {checkpoint.get('limit')}, starting over"
+            ))
+            return None
+        return checkpoint
+
+    def save_checkpoint(self, path, checkpoint):
+        """Write the checkpoint atomically"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
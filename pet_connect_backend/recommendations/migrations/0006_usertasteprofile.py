@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recommendations', '0005_remove_animalrecommendation_recommendat_user_id_c27e2b_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTasteProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('species_counts', models.JSONField(default=dict, help_text='Decayed view weight per species')),
+                ('breed_counts', models.JSONField(default=dict, help_text='Decayed view weight per breed')),
+                ('size_counts', models.JSONField(default=dict, help_text='Decayed view weight per size')),
+                ('feature_counts', models.JSONField(default=dict, help_text='Decayed view weight per feature value')),
+                ('view_count', models.PositiveIntegerField(default=0, help_text='Number of views folded into the profile')),
+                ('decayed_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Reference time of the counters')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='taste_profile', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
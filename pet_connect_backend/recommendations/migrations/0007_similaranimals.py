@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('animals', '0009_animalpopularity'),
+        ('recommendations', '0006_usertasteprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarAnimals',
+            fields=[
+                ('animal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similar_animals', serialize=False, to='animals.animal')),
+                ('neighbor_ids', models.JSONField(default=list, help_text='Ids of the most similar animals, best first')),
+                ('scores', models.JSONField(default=list, help_text='Cosine similarity of each neighbor')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Similar animals',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0007_similaranimals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarAnimalsRefresh',
+            fields=[
+                ('animal_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('queued_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,6 +1,7 @@
 # recommendations/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
 from animals.models import Animal
 
 class AnimalRecommendation(models.Model):
@@ -35,4 +36,136 @@ class AnimalRecommendation(models.Model):
             self.interaction_score * weights['interaction'] +
             self.similarity_score * weights['similarity']
         )
-        self.save()
\ No newline at end of file
+        self.save()
+
+class UserTasteProfile(models.Model):
+    """
+    Exponentially decayed counters of what a user has been viewing.
+
+    Updated in place every time a view is logged, so the recommendation
+    engine reads a single row instead of scanning the whole view history.
+    All counters share the same reference time (decayed_at); decaying them
+    to any later time multiplies every counter by the same factor, which
+    cancels out once they are normalised.
+    """
+    # Daily decay factor applied to older views
+    DAILY_DECAY = 0.9
+    # Counters that decay below this weight are dropped
+    MIN_WEIGHT = 1e-4
+    # Features counted as "<feature>_<value>" when truthy
+    FEATURES = ['good_with_kids', 'good_with_cats', 'good_with_dogs', 'energy_level']
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='taste_profile')
+    species_counts = models.JSONField(default=dict, help_text="Decayed view weight per species")
+    breed_counts = models.JSONField(default=dict, help_text="Decayed view weight per breed")
+    size_counts = models.JSONField(default=dict, help_text="Decayed view weight per size")
+    feature_counts = models.JSONField(default=dict, help_text="Decayed view weight per feature value")
+    view_count = models.PositiveIntegerField(default=0, help_text="Number of views folded into the profile")
+    decayed_at = models.DateTimeField(default=timezone.now, help_text="Reference time of the counters")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Taste profile for {self.user.username} ({self.view_count} views)"
+
+    def _counters(self):
+        return [self.species_counts, self.breed_counts, self.size_counts, self.feature_counts]
+
+    def add_view(self, animal, timestamp, daily_decay=None):
+        """Fold one view into the counters using closed-form decay by elapsed time"""
+        if daily_decay is None:
+            daily_decay = self.DAILY_DECAY
+
+        elapsed_days = (timestamp - self.decayed_at).total_seconds() / 86400
+        if elapsed_days >= 0:
+            # Move the reference time forward: decay everything seen so far
+            factor = daily_decay ** elapsed_days
+            for counter in self._counters():
+                for key in list(counter):
+                    counter[key] *= factor
+                    if counter[key] < self.MIN_WEIGHT:
+                        del counter[key]
+            self.decayed_at = timestamp
+            weight = 1.0
+        else:
+            # An older view (e.g. during a rebuild) is decayed to the reference time
+            weight = daily_decay ** -elapsed_days
+
+        self.species_counts[animal.species] = self.species_counts.get(animal.species, 0) + weight
+
+        if animal.breed:
+            self.breed_counts[animal.breed] = self.breed_counts.get(animal.breed, 0) + weight
+
+        if animal.size:
+            self.size_counts[animal.size] = self.size_counts.get(animal.size, 0) + weight
+
+        for feature in self.FEATURES:
+            value = getattr(animal, feature, None)
+            if value:
+                feature_key = f"{feature}_{value}"
+                self.feature_counts[feature_key] = self.feature_counts.get(feature_key, 0) + weight
+
+        self.view_count += 1
+
+    def normalized_counts(self):
+        """Return (species, breed, size, feature) counters as shares of all views"""
+        total_views = sum(self.species_counts.values())
+        if total_views <= 0:
+            return {}, {}, {}, {}
+        return tuple(
+            {key: value / total_views for key, value in counter.items()}
+            for counter in self._counters()
+        )
+
+    @classmethod
+    def record_view(cls, view):
+        """Update the viewer's profile for a newly logged AnimalViewHistory row"""
+        with transaction.atomic():
+            profile, _ = cls.objects.select_for_update().get_or_create(
+                user_id=view.user_id,
+                defaults={'decayed_at': view.timestamp},
+            )
+            profile.add_view(view.animal, view.timestamp)
+            profile.save()
+        return profile
+
+    @classmethod
+    def rebuild_for_user(cls, user):
+        """Recompute a user's profile from their full view history"""
+        from animals.models import AnimalViewHistory
+
+        profile = cls(user=user, decayed_at=timezone.now())
+        views = AnimalViewHistory.objects.filter(user=user).select_related('animal').order_by('timestamp')
+        for i, view in enumerate(views.iterator()):
+            if i == 0:
+                # Replay in order, exactly as the views were recorded
+                profile.decayed_at = view.timestamp
+            profile.add_view(view.animal, view.timestamp)
+
+        with transaction.atomic():
+            cls.objects.filter(user=user).delete()
+            profile.save()
+        return profile
+
+
+class SimilarAnimals(models.Model):
+    """Precomputed content-similar neighbors of an available animal, best first"""
+    animal = models.OneToOneField(Animal, on_delete=models.CASCADE, primary_key=True, related_name='similar_animals')
+    neighbor_ids = models.JSONField(default=list, help_text="Ids of the most similar animals, best first")
+    scores = models.JSONField(default=list, help_text="Cosine similarity of each neighbor")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Similar animals"
+
+    def __str__(self):
+        return f"{len(self.neighbor_ids)} neighbors for animal {self.animal_id}"
+
+
+class SimilarAnimalsRefresh(models.Model):
+    """An animal added, changed or removed since the neighbor lists were last refreshed"""
+    # Not a foreign key: deleted animals stay queued until their neighbors are back-filled
+    animal_id = models.PositiveIntegerField(primary_key=True)
+    queued_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Animal {self.animal_id} queued at {self.queued_at}"
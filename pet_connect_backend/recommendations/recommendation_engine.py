@@ -1,37 +1,90 @@
 # recommendations/recommendation_engine.py
 
+import random
+
 import numpy as np
-from django.db.models import Count, Q
+import scipy.sparse as sp
+from django.conf import settings
+from django.db.models import Case, Count, ExpressionWrapper, FloatField, IntegerField, Q, QuerySet, Value, When
+from django.db.models.functions import Cast
 from django.utils import timezone
 from datetime import timedelta
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import logging
 
+from .content_vectors import get_content_vectors
+from .als import get_factor_model
+from .catalog import get_catalog_snapshot, remove_from_catalog_snapshot
+from .coview import get_coview_model
+from .features import SMALL_ANIMALS, CatalogFeatures, lookup_column, top_k
+from .models import UserTasteProfile
+from .timing import stage
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# (reason_code, reason) of each scoring stage; preference reasons name the matched preference
+COMPONENT_REASONS = {
+    'preferences': ('preference', "Matches your preferences"),
+    'history': ('view_history', "Matches the kinds of pets you've been viewing"),
+    'similarity': ('viewed_before', "Similar to animals you've viewed before"),
+    'coview': ('viewed_together', "Often viewed together with pets you've looked at"),
+    'factors': ('similar_adopters', "Popular with adopters whose interests match yours"),
+    'popular': ('popular', "Popular pet ready for adoption"),
+}
+
 class MLRecommendationEngine:
     """
     An enhanced recommendation engine for Pet Connect that combines:
     1. User preference-based filtering (from existing preferences)
     2. View history analysis (using machine learning techniques)
     3. Content-based similarity analysis
+    4. Item-item co-view collaborative filtering
+    5. Implicit-feedback matrix factorization (when a model has been trained)
     """
     
-    def __init__(self):
+    def __init__(self, scoring_mode='vectorized', retrieval_mode=None):
+        # Scoring mode: 'vectorized' scores NumPy columns in one pass,
+        # 'python' walks the Animal instances one by one, 'sql' lets the
+        # database rank users without history and is vectorized otherwise
+        self.scoring_mode = scoring_mode
+        
+        # Retrieval mode: 'full' scores every available animal, 'two_stage'
+        # scores only a bounded pool fetched with indexed queries
+        self.retrieval_mode = retrieval_mode or getattr(settings, 'RECOMMENDATION_RETRIEVAL_MODE', 'full')
+        
         # Recommendation weights
         self.preference_weight = 0.8    # Weight for explicit preferences
         self.view_history_weight = 0.3  # Weight for viewing history patterns
         self.similarity_weight = 0.2    # Weight for content similarity
+        self.coview_weight = 0.3        # Weight for "viewed together" patterns
+        self.factor_weight = 0.3        # Weight for matrix factorization scores
         
         # Adaptation settings
         self.min_views = 2              # Minimum views before using view history
         self.recency_days = 14          # Days to consider for recency weighting
         self.recency_decay = 0.9        # Daily decay factor for view importance
+        
+        # Popular fallback: order by total 'views' or decayed 'trending' score
+        self.popularity_ordering = 'views'
+        
+        # Batch scoring settings
+        self.batch_block_size = 64      # Users scored per matrix product block
+        
+        # Two-stage retrieval settings
+        self.candidate_pool_size = 500  # Most animals re-ranked per request
+        self.popular_candidates = 100   # Popular animals added to every pool
+        self.similar_seed_views = 5     # Recent views whose neighbors join the pool
     
-    def get_recommendations(self, user_id, limit=10):
-        """Get personalized animal recommendations using ML techniques"""
+    def get_recommendations(self, user_id, limit=10, with_scores=False, with_reasons=False):
+        """
+        Get personalized animal recommendations using ML techniques
+        
+        Returns a list of animal ids, or (animal_id, score) pairs when
+        with_scores is True (popular fill-ins score 0). with_reasons returns
+        (animal_id, score, component) triples instead, component being the
+        scoring stage that contributed most ('popular' for fill-ins, None
+        when no stage added anything), for get_recommendation_reasons.
+        """
         from django.contrib.auth.models import User
         from animals.models import Animal, AnimalViewHistory
         from users.models import UserProfile
@@ -43,85 +96,85 @@ class MLRecommendationEngine:
             # Log the recommendation request
             logger.info(f"Getting ML recommendations for user {user.username} (id: {user_id})")
             
-            # Get all available animals
+            # Get all available animals (the snapshot spares the vectorized path any query)
             all_animals = Animal.objects.filter(status='A')
+            with stage('catalog'):
+                snapshot = get_catalog_snapshot()
             
             # If no animals are available, return empty list
-            if not all_animals.exists():
+            if len(snapshot) == 0:
                 logger.warning("No available animals found")
                 return []
             
-            # Get user profile for preference-based recommendations
-            profile = UserProfile.objects.filter(user=user).first()
+            with stage('profile'):
+                # Get user profile for preference-based recommendations
+                profile = UserProfile.objects.filter(user=user).first()
+            
+                # Get user view history
+                view_history = AnimalViewHistory.objects.filter(user=user).order_by('-timestamp')
+                viewed_animal_ids = list(view_history.values_list('animal_id', flat=True))
             
-            # Get user view history
-            view_history = AnimalViewHistory.objects.filter(user=user).order_by('-timestamp')
-            viewed_animal_ids = list(view_history.values_list('animal_id', flat=True))
+                # Log view history stats
+                logger.info(f"User has viewed {len(viewed_animal_ids)} animals")
             
-            # Log view history stats
-            logger.info(f"User has viewed {len(viewed_animal_ids)} animals")
+                # Get the decayed viewing counters (built once for users who predate them)
+                taste_profile = UserTasteProfile.objects.filter(user=user).first()
+                if taste_profile is None and viewed_animal_ids:
+                    taste_profile = UserTasteProfile.rebuild_for_user(user)
             
             # Build candidate pool (excluding recently viewed animals)
             candidates = all_animals
-            if viewed_animal_ids:
-                # Don't exclude all viewed animals, just the 3 most recently viewed
-                recent_views = viewed_animal_ids[:3]
-                candidates = all_animals.exclude(id__in=recent_views)
+            candidate_ids = None
+            if self.retrieval_mode == 'two_stage':
+                # Only a bounded pool from indexed queries goes through the full scoring
+                with stage('retrieval'):
+                    candidate_ids = self._retrieve_candidates(profile, taste_profile, viewed_animal_ids)
+                candidates = Animal.objects.filter(id__in=candidate_ids)
             
-            # Initialize scores dictionary
-            animal_scores = {}
+            # Don't exclude all viewed animals, just the 3 most recently viewed
+            recent_views = viewed_animal_ids[:3]
+            if recent_views:
+                candidates = candidates.exclude(id__in=recent_views)
             
-            # 1. Score based on user preferences
-            if profile:
-                preference_scores = self._score_by_preferences(candidates, profile)
-                for animal_id, score in preference_scores.items():
-                    if animal_id not in animal_scores:
-                        animal_scores[animal_id] = 0
-                    animal_scores[animal_id] += score * self.preference_weight
-            
-            # 2. Score based on view history patterns (if enough views)
-            if view_history.count() >= self.min_views:
-                view_history_scores = self._score_by_view_history(candidates, view_history)
-                for animal_id, score in view_history_scores.items():
-                    if animal_id not in animal_scores:
-                        animal_scores[animal_id] = 0
-                    animal_scores[animal_id] += score * self.view_history_weight
-            
-            # 3. Score based on content similarity to viewed animals
-            if view_history.exists():
-                similarity_scores = self._score_by_content_similarity(candidates, view_history)
-                for animal_id, score in similarity_scores.items():
-                    if animal_id not in animal_scores:
-                        animal_scores[animal_id] = 0
-                    animal_scores[animal_id] += score * self.similarity_weight
+            # Score the candidate pool and pick the top animals
+            if self.scoring_mode == 'sql' and self._preferences_only(user_id, profile, viewed_animal_ids):
+                scored_animals = self._rank_sql(candidates, profile, limit)
+            elif self.scoring_mode in ('vectorized', 'sql'):
+                with stage('candidates'):
+                    columns = snapshot.columns(snapshot.select(candidate_ids, exclude_ids=recent_views))
+                scored_animals = self._rank_vectorized(
+                    user_id, columns, profile, taste_profile, viewed_animal_ids, limit
+                )
+                if scored_animals:
+                    with stage('availability'):
+                        scored_animals = self._drop_unavailable(scored_animals)
+            else:
+                scored_animals = self._rank_python(
+                    user_id, candidates, profile, taste_profile, viewed_animal_ids, limit
+                )
             
             # If we have no scores (no preferences, no history), return popular animals
-            if not animal_scores:
+            if scored_animals is None:
                 logger.info("No personalization possible, using popular animals")
-                popular_animals = self._get_popular_animals(limit)
-                return popular_animals
-            
-            # Sort animals by final score and return IDs
-            sorted_animals = sorted(animal_scores.items(), key=lambda x: x[1], reverse=True)
-            
-            # Log top scoring animals
-            logger.info(f"Top scoring animals: {sorted_animals[:min(3, len(sorted_animals))]}")
-            
-            recommended_ids = [animal_id for animal_id, _ in sorted_animals[:limit]]
+                scored_animals = [(animal_id, 0.0, 'popular') for animal_id in self._get_popular_animals(limit)]
             
             # If we don't have enough recommendations, add popular animals
-            if len(recommended_ids) < limit:
-                remaining = limit - len(recommended_ids)
-                logger.info(f"Only {len(recommended_ids)} scored animals, adding {remaining} popular animals")
+            elif len(scored_animals) < limit:
+                remaining = limit - len(scored_animals)
+                logger.info(f"Only {len(scored_animals)} scored animals, adding {remaining} popular animals")
                 
                 popular_animals = self._get_popular_animals(
                     remaining, 
-                    exclude_ids=recommended_ids + viewed_animal_ids[:5]
+                    exclude_ids=[animal_id for animal_id, _, _ in scored_animals] + viewed_animal_ids[:5]
                 )
-                recommended_ids.extend(popular_animals)
+                scored_animals.extend((animal_id, 0.0, 'popular') for animal_id in popular_animals)
             
-            logger.info(f"Returning {len(recommended_ids)} recommendations")
-            return recommended_ids
+            logger.info(f"Returning {len(scored_animals)} recommendations")
+            if with_reasons:
+                return scored_animals
+            if with_scores:
+                return [(animal_id, score) for animal_id, score, _ in scored_animals]
+            return [animal_id for animal_id, _, _ in scored_animals]
             
         except User.DoesNotExist:
             logger.error(f"User with ID {user_id} not found")
@@ -130,10 +183,616 @@ class MLRecommendationEngine:
             logger.error(f"Error generating recommendations: {str(e)}")
             return []
     
+    def get_recommendations_batch(self, user_ids, limit=10, with_scores=False):
+        """
+        Get recommendations for many users in one pass over the catalog.
+        
+        The available animals are loaded and encoded once; each block of
+        users is then scored against all of them with matrix products and
+        a per-row top-k. Returns {user_id: [animal_id, ...]}, or lists of
+        (animal_id, score, preference_score, interaction_score,
+        similarity_score) tuples when with_scores is True.
+        """
+        from django.contrib.auth.models import User
+        from animals.models import Animal, AnimalViewHistory
+        from users.models import UserProfile
+        
+        user_ids = list(User.objects.filter(id__in=list(user_ids)).values_list('id', flat=True))
+        results = {}
+        if not user_ids:
+            return results
+        
+        # Decode the available animals once
+        with stage('candidates'):
+            columns = get_catalog_snapshot().columns()
+        if len(columns) == 0:
+            logger.warning("No available animals found")
+            return {user_id: [] for user_id in user_ids}
+        
+        features = CatalogFeatures(columns)
+        rows_by_id = {animal_id: row for row, animal_id in enumerate(columns.ids.tolist())}
+        content_vectors = get_content_vectors()
+        candidate_vectors = content_vectors.vectors_for(columns.ids) if content_vectors is not None else None
+        
+        logger.info(f"Batch scoring {len(user_ids)} users against {len(columns)} animals")
+        
+        for start in range(0, len(user_ids), self.batch_block_size):
+            block = user_ids[start:start + self.batch_block_size]
+            
+            profiles = {p.user_id: p for p in UserProfile.objects.filter(user_id__in=block)}
+            taste_profiles = {t.user_id: t for t in UserTasteProfile.objects.filter(user_id__in=block)}
+            
+            # Views per user, most recent first
+            viewed = {user_id: [] for user_id in block}
+            history = AnimalViewHistory.objects.filter(user_id__in=block) \
+                .order_by('user_id', '-timestamp').values_list('user_id', 'animal_id')
+            for user_id, animal_id in history.iterator():
+                viewed[user_id].append(animal_id)
+            
+            for user_id in block:
+                if user_id not in taste_profiles and viewed[user_id]:
+                    taste_profiles[user_id] = UserTasteProfile.rebuild_for_user(User(id=user_id))
+            
+            block_scores = self._score_block(
+                block, columns, features, candidate_vectors, content_vectors,
+                profiles, taste_profiles, viewed,
+            )
+            
+            for i, user_id in enumerate(block):
+                scored, total, preference, interaction, similarity = block_scores[i]
+                viewed_animal_ids = viewed[user_id]
+                
+                if not scored:
+                    recommended = [(animal_id, 0.0, 0.0, 0.0, 0.0)
+                                   for animal_id in self._get_popular_animals(limit)]
+                else:
+                    # Don't exclude all viewed animals, just the 3 most recently viewed
+                    excluded = [rows_by_id[a] for a in viewed_animal_ids[:3] if a in rows_by_id]
+                    total[excluded] = -np.inf
+                    
+                    top_rows = top_k(np.arange(len(columns)), total, limit)
+                    top_rows = [row for row in top_rows if np.isfinite(total[row])]
+                    recommended = [
+                        (int(columns.ids[row]), float(total[row]), float(preference[row]),
+                         float(interaction[row]), float(similarity[row]))
+                        for row in top_rows
+                    ]
+                    
+                    # If we don't have enough recommendations, add popular animals
+                    if len(recommended) < limit:
+                        popular_animals = self._get_popular_animals(
+                            limit - len(recommended),
+                            exclude_ids=[r[0] for r in recommended] + viewed_animal_ids[:5]
+                        )
+                        recommended.extend((animal_id, 0.0, 0.0, 0.0, 0.0) for animal_id in popular_animals)
+                
+                if with_scores:
+                    results[user_id] = recommended
+                else:
+                    results[user_id] = [r[0] for r in recommended]
+        
+        return results
+    
+    def _score_block(self, block, columns, features, candidate_vectors, content_vectors,
+                     profiles, taste_profiles, viewed):
+        """
+        Score a block of users against the whole catalog.
+        
+        Returns one (scored, total, preference, interaction, similarity)
+        tuple per user, each score an array aligned with the catalog rows.
+        Components are already multiplied by their stage weights; the
+        interaction component covers the view history, co-view and factor
+        scores.
+        """
+        n_users = len(block)
+        preference_weights = np.zeros((n_users, features.width))
+        taste_weights = np.zeros((n_users, features.width))
+        age_min = np.full(n_users, np.inf)
+        age_max = np.full(n_users, -np.inf)
+        max_scores = np.ones(n_users)
+        has_preferences = np.zeros(n_users, dtype=bool)
+        has_history = np.zeros(n_users, dtype=bool)
+        
+        for i, user_id in enumerate(block):
+            profile = profiles.get(user_id)
+            if profile:
+                weights, max_score = self._preference_weights(profile, features)
+                preference_weights[i] = weights
+                max_scores[i] = max_score
+                age_min[i] = profile.preferred_age_min
+                age_max[i] = profile.preferred_age_max
+                has_preferences[i] = True
+            
+            taste_profile = taste_profiles.get(user_id)
+            if taste_profile and taste_profile.view_count >= self.min_views:
+                taste_weights[i] = self._taste_weights(taste_profile, features)
+                has_history[i] = True
+        
+        # Preference and view-history stages share one product with the catalog
+        preference = features.matrix @ preference_weights.T
+        preference += 2 * ((columns.age[:, None] >= age_min) & (columns.age[:, None] <= age_max))
+        preference = preference / max_scores * self.preference_weight
+        interaction = (features.matrix @ taste_weights.T) * self.view_history_weight
+        
+        # Content similarity: catalog vectors against each user's mean viewed vector
+        viewed_ids = sorted({animal_id for user_id in block for animal_id in viewed[user_id]})
+        similarity = np.zeros((len(columns), n_users))
+        has_similarity = np.zeros(n_users, dtype=bool)
+        if viewed_ids:
+            # Skipped until content vectors have been published
+            if content_vectors is not None:
+                try:
+                    viewed_index = {animal_id: i for i, animal_id in enumerate(viewed_ids)}
+                    rows, cols = [], []
+                    for i, user_id in enumerate(block):
+                        for animal_id in set(viewed[user_id]):
+                            rows.append(i)
+                            cols.append(viewed_index[animal_id])
+                    
+                    membership = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_users, len(viewed_ids)))
+                    counts = np.asarray(membership.sum(axis=1)).ravel()
+                    membership = sp.diags(1 / np.maximum(counts, 1)) @ membership
+                    
+                    mean_viewed = (membership @ content_vectors.vectors_for(viewed_ids)).toarray()
+                    similarity = np.asarray(candidate_vectors @ mean_viewed.T) * self.similarity_weight
+                    has_similarity = counts > 0
+                except Exception as e:
+                    logger.error(f"Error calculating batch content similarity: {str(e)}")
+            
+            # Co-view: each user's viewed animals against the item-item similarity
+            try:
+                coview_model = get_coview_model()
+                if coview_model is not None:
+                    coview = coview_model.score_users([viewed[user_id] for user_id in block], columns.ids)
+                    interaction += coview.T * self.coview_weight
+                    has_history |= np.array([bool(viewed[user_id]) for user_id in block])
+            except Exception as e:
+                logger.error(f"Error calculating batch co-view scores: {str(e)}")
+        
+        # Factors: one product of the block's user factors with the catalog's
+        try:
+            model = get_factor_model()
+            if model is not None:
+                factor_scores, known_users = model.score_users(block, columns.ids)
+                interaction += factor_scores.T * self.factor_weight
+                has_history |= known_users
+        except Exception as e:
+            logger.error(f"Error calculating batch factor scores: {str(e)}")
+        
+        results = []
+        for i in range(n_users):
+            total = np.zeros(len(columns))
+            if has_preferences[i]:
+                total += preference[:, i]
+            if has_history[i]:
+                total += interaction[:, i]
+            if has_similarity[i]:
+                total += similarity[:, i]
+            
+            results.append((
+                bool(has_preferences[i] or has_history[i] or has_similarity[i]),
+                total,
+                preference[:, i] if has_preferences[i] else np.zeros(len(columns)),
+                interaction[:, i] if has_history[i] else np.zeros(len(columns)),
+                similarity[:, i] if has_similarity[i] else np.zeros(len(columns)),
+            ))
+        return results
+    
+    def _preference_weights(self, profile, features):
+        """Express _score_by_preferences as weights over the catalog feature columns"""
+        weights = np.zeros(features.width)
+        max_score = 0
+        
+        def add(field, value, points):
+            column = features.column(field, value)
+            if column is not None:
+                weights[column] += points
+        
+        # Species preference (highest weight)
+        if profile.preferred_species:
+            max_score += 4
+            add('species', profile.preferred_species, 4)
+            if profile.preferred_species == 'Small Animal':
+                add('flag', 'small_animal', 4)
+        
+        # Size preference
+        if profile.preferred_size:
+            max_score += 2
+            add('size', profile.preferred_size, 2)
+        
+        # Age preference is a range check, scored separately
+        max_score += 2
+        
+        # Energy level preference
+        if profile.preferred_energy_level:
+            max_score += 2
+            add('energy_level', profile.preferred_energy_level, 2)
+        
+        # Compatibility preferences
+        if profile.good_with_children:
+            max_score += 1
+            add('flag', 'good_with_kids', 1)
+        
+        if profile.good_with_other_pets:
+            max_score += 1
+            add('flag', 'good_with_other_pets', 1)
+        
+        return weights, max_score
+    
+    def _taste_weights(self, taste_profile, features):
+        """Express _score_by_view_history as weights over the catalog feature columns"""
+        weights = np.zeros(features.width)
+        species_counts, breed_counts, size_counts, feature_counts = taste_profile.normalized_counts()
+        
+        for field, counts, share in [('species', species_counts, 0.4),
+                                     ('breed', breed_counts, 0.3),
+                                     ('size', size_counts, 0.2)]:
+            for value, weight in counts.items():
+                column = features.column(field, value)
+                if column is not None:
+                    weights[column] += weight * share
+        
+        for feature_key, weight in feature_counts.items():
+            if feature_key.startswith('energy_level_'):
+                column = features.column('energy_level', feature_key[len('energy_level_'):])
+            elif feature_key.endswith('_True'):
+                column = features.column('flag', feature_key[:-len('_True')])
+            else:
+                column = None
+            if column is not None:
+                weights[column] += weight * 0.1 / 4
+        
+        return weights
+    
+    def _rank_python(self, user_id, candidates, profile, taste_profile, viewed_animal_ids, limit):
+        """Score candidates one model instance at a time and return the top (id, score, component) triples"""
+        # Weighted scores of every stage that applies, keyed by the stage name
+        contributions = {}
+        
+        # 1. Score based on user preferences
+        if profile:
+            with stage('preferences'):
+                preference_scores = self._score_by_preferences(candidates, profile)
+            contributions['preferences'] = {
+                animal_id: score * self.preference_weight for animal_id, score in preference_scores.items()
+            }
+        
+        # 2. Score based on view history patterns (if enough views)
+        if taste_profile and taste_profile.view_count >= self.min_views:
+            with stage('history'):
+                view_history_scores = self._score_by_view_history(candidates, taste_profile)
+            contributions['history'] = {
+                animal_id: score * self.view_history_weight for animal_id, score in view_history_scores.items()
+            }
+        
+        # 3. Score based on content similarity to viewed animals
+        if viewed_animal_ids:
+            with stage('similarity'):
+                similarity_scores = self._score_by_content_similarity(candidates, viewed_animal_ids)
+            contributions['similarity'] = {
+                animal_id: score * self.similarity_weight for animal_id, score in similarity_scores.items()
+            }
+        
+        # 4. Score based on what other viewers of the same animals looked at
+        if viewed_animal_ids:
+            with stage('coview'):
+                coview_scores = self._score_by_coview(candidates, viewed_animal_ids)
+            contributions['coview'] = {
+                animal_id: score * self.coview_weight for animal_id, score in coview_scores.items()
+            }
+        
+        # 5. Score with the trained user and animal factors
+        with stage('factors'):
+            factor_scores = self._score_by_factors(candidates, user_id)
+        contributions['factors'] = {
+            animal_id: score * self.factor_weight for animal_id, score in factor_scores.items()
+        }
+        
+        # Initialize scores dictionary
+        animal_scores = {}
+        for scores in contributions.values():
+            for animal_id, score in scores.items():
+                animal_scores[animal_id] = animal_scores.get(animal_id, 0) + score
+        
+        if not animal_scores:
+            return None
+        
+        # Sort animals by final score (ties by id, like the other modes) and return IDs
+        sorted_animals = sorted(animal_scores.items(), key=lambda x: (-x[1], x[0]))[:limit]
+        
+        # Log top scoring animals
+        logger.info(f"Top scoring animals: {sorted_animals[:min(3, len(sorted_animals))]}")
+        
+        scored_animals = []
+        for animal_id, score in sorted_animals:
+            name, contribution = max(
+                ((name, scores.get(animal_id, 0)) for name, scores in contributions.items()),
+                key=lambda pair: pair[1],
+            )
+            scored_animals.append((animal_id, score, name if contribution > 0 else None))
+        return scored_animals
+    
+    def _rank_vectorized(self, user_id, columns, profile, taste_profile, viewed_animal_ids, limit):
+        """
+        Score the candidate AnimalColumns and return the top (id, score, component)
+        triples, component naming the stage that contributed most to the score
+        """
+        if len(columns) == 0:
+            return None
+        
+        # Weighted score of every stage that applies, keyed by the stage name
+        contributions = {}
+        
+        # 1. Score based on user preferences
+        if profile:
+            with stage('preferences'):
+                contributions['preferences'] = self._score_by_preferences_vectorized(columns, profile) * self.preference_weight
+        
+        # 2. Score based on view history patterns (if enough views)
+        if taste_profile and taste_profile.view_count >= self.min_views:
+            with stage('history'):
+                contributions['history'] = self._score_by_view_history_vectorized(columns, taste_profile) * self.view_history_weight
+        
+        # 3. Score based on content similarity to viewed animals
+        if viewed_animal_ids:
+            with stage('similarity'):
+                similarity_scores = self._score_by_content_similarity(columns.ids, viewed_animal_ids)
+            if similarity_scores:
+                contributions['similarity'] = columns.align(similarity_scores) * self.similarity_weight
+        
+        # 4. Score based on what other viewers of the same animals looked at
+        if viewed_animal_ids:
+            with stage('coview'):
+                coview_scores = self._score_by_coview(columns.ids, viewed_animal_ids)
+            if coview_scores:
+                contributions['coview'] = columns.align(coview_scores) * self.coview_weight
+        
+        # 5. Score with the trained user and animal factors
+        with stage('factors'):
+            factor_scores = self._score_by_factors(columns.ids, user_id)
+        if factor_scores:
+            contributions['factors'] = columns.align(factor_scores) * self.factor_weight
+        
+        if not contributions:
+            return None
+        
+        total_scores = np.zeros(len(columns))
+        for scores in contributions.values():
+            total_scores += scores
+        
+        # Partial top-k selection instead of sorting the whole pool
+        top_rows = top_k(np.arange(len(columns)), total_scores, limit)
+        components = self._top_components(contributions, top_rows)
+        scored_animals = [
+            (int(columns.ids[row]), float(total_scores[row]), component)
+            for row, component in zip(top_rows, components)
+        ]
+        
+        # Log top scoring animals
+        logger.info(f"Top scoring animals: {scored_animals[:3]}")
+        
+        return scored_animals
+    
+    @staticmethod
+    def _top_components(contributions, rows):
+        """The stage that contributed most to each row's score, or None when none added anything"""
+        if len(rows) == 0:
+            return []
+        names = list(contributions)
+        stacked = np.vstack([np.asarray(contributions[name])[rows] for name in names])
+        best = stacked.argmax(axis=0)
+        return [names[i] if stacked[i, column] > 0 else None for column, i in enumerate(best)]
+    
+    def _drop_unavailable(self, scored_animals):
+        """
+        Drop ranked animals that were adopted or deleted since the snapshot was built.
+        
+        Changes made by other worker processes only reach this process's
+        snapshot when it is rebuilt, so the few ids about to be returned are
+        checked by primary key; stale ones are removed from the snapshot.
+        """
+        from animals.models import Animal
+        
+        ranked_ids = [entry[0] for entry in scored_animals]
+        available = {
+            animal_id for animal_id, status in Animal.objects.filter(id__in=ranked_ids).values_list('id', 'status')
+            if status == 'A'
+        }
+        stale_ids = [animal_id for animal_id in ranked_ids if animal_id not in available]
+        if stale_ids:
+            logger.info(f"Dropping {len(stale_ids)} animals that are no longer available")
+            remove_from_catalog_snapshot(stale_ids)
+        return [entry for entry in scored_animals if entry[0] in available]
+    
+    def _preferences_only(self, user_id, profile, viewed_animal_ids):
+        """Whether the profile is the only signal for this user, so SQL can rank alone"""
+        if not profile or viewed_animal_ids:
+            return False
+        model = get_factor_model()
+        return model is None or model.user_vector(user_id) is None
+    
+    def _rank_sql(self, candidates, profile, limit):
+        """Rank candidates by preference score in the database and fetch only the top (id, score, component) triples"""
+        scored = self._annotate_preference_score(candidates, profile) \
+            .order_by('-preference_score', 'id') \
+            .values_list('id', 'preference_score')[:limit]
+        scored_animals = [
+            (animal_id, score * self.preference_weight, 'preferences' if score > 0 else None)
+            for animal_id, score in scored
+        ]
+        if not scored_animals:
+            return None
+        
+        logger.info(f"Top scoring animals: {scored_animals[:3]}")
+        return scored_animals
+    
+    def _annotate_preference_score(self, candidates, profile):
+        """
+        Annotate candidates with _score_by_preferences as a SQL expression.
+        
+        Each criterion is a CASE WHEN worth the same points as in Python and
+        the sum is normalized by the points available, so the annotated
+        preference_score matches the Python scorer on SQLite and PostgreSQL.
+        """
+        criteria = []
+        
+        # Species preference (highest weight)
+        if profile.preferred_species:
+            species_match = Q(species=profile.preferred_species)
+            
+            # Handle 'Small Animal' preference
+            if profile.preferred_species == 'Small Animal':
+                species_match |= Q(species__in=SMALL_ANIMALS)
+            criteria.append((species_match, 4))
+        
+        # Size preference
+        if profile.preferred_size:
+            criteria.append((Q(size=profile.preferred_size), 2))
+        
+        # Age preference, on age_years + age_months / 12 like the Python scorer
+        if hasattr(profile, 'preferred_age_min') and hasattr(profile, 'preferred_age_max'):
+            candidates = candidates.annotate(age_in_years=ExpressionWrapper(
+                Cast('age_years', FloatField()) + Cast('age_months', FloatField()) / Value(12.0),
+                output_field=FloatField(),
+            ))
+            criteria.append((Q(age_in_years__gte=profile.preferred_age_min,
+                               age_in_years__lte=profile.preferred_age_max), 2))
+        
+        # Energy level preference
+        if profile.preferred_energy_level:
+            criteria.append((Q(energy_level=profile.preferred_energy_level), 2))
+        
+        # Good with children preference
+        if profile.good_with_children:
+            criteria.append((Q(good_with_kids=True), 1))
+        
+        # Good with other pets preference
+        if profile.good_with_other_pets:
+            criteria.append((Q(good_with_cats=True) | Q(good_with_dogs=True), 1))
+        
+        max_score = sum(points for _, points in criteria)
+        if max_score == 0:
+            return candidates.annotate(preference_score=Value(0.0, output_field=FloatField()))
+        
+        points = Value(0, output_field=IntegerField())
+        for condition, weight in criteria:
+            points = points + Case(When(condition, then=Value(weight)), default=Value(0),
+                                   output_field=IntegerField())
+        
+        # Normalize score (0-1)
+        return candidates.annotate(preference_score=ExpressionWrapper(
+            Cast(points, FloatField()) / Value(float(max_score)), output_field=FloatField(),
+        ))
+    
+    def _retrieve_candidates(self, profile, taste_profile, viewed_animal_ids):
+        """
+        Collect the ids of a bounded candidate pool for the re-ranking stage.
+        
+        Index-ordered buckets are read until candidate_pool_size ids are
+        collected: animals matching the profile's species, size and age
+        (then its species alone), then the breeds and species the user views
+        most. Neighbors of recently viewed animals and popular animals are
+        added on top. The profile's compatibility requirements are hard
+        constraints on the whole pool.
+        """
+        from animals.models import Animal, AnimalPopularity
+        from .models import SimilarAnimals
+        
+        compatibility = Q()
+        if profile:
+            if profile.good_with_children:
+                compatibility &= Q(good_with_kids=True)
+            if profile.good_with_other_pets:
+                compatibility &= Q(good_with_cats=True) | Q(good_with_dogs=True)
+        
+        buckets = []
+        
+        # Explicit preferences, strictest bucket first
+        if profile:
+            species = Q()
+            if profile.preferred_species == 'Small Animal':
+                species = Q(species__in=SMALL_ANIMALS)
+            elif profile.preferred_species:
+                species = Q(species=profile.preferred_species)
+            
+            strict = species
+            if profile.preferred_size:
+                strict &= Q(size=profile.preferred_size)
+            if profile.preferred_age_min is not None and profile.preferred_age_max is not None:
+                strict &= Q(age_years__gte=int(profile.preferred_age_min),
+                            age_years__lte=int(profile.preferred_age_max))
+            buckets.append(strict)
+            if species:
+                buckets.append(species)
+        
+        # What the user has been viewing
+        if taste_profile and taste_profile.view_count >= self.min_views:
+            species_counts, breed_counts, _, _ = taste_profile.normalized_counts()
+            top_breeds = sorted(breed_counts, key=breed_counts.get, reverse=True)[:3]
+            top_species = sorted(species_counts, key=species_counts.get, reverse=True)[:2]
+            if top_breeds:
+                buckets.append(Q(breed__in=top_breeds))
+            if top_species:
+                buckets.append(Q(species__in=top_species))
+        
+        # Read each bucket in (status, species, size, age_years) index order so
+        # the LIMIT ends the scan early instead of sorting the whole bucket
+        candidate_ids = {}
+        for bucket in buckets:
+            if len(candidate_ids) >= self.candidate_pool_size:
+                break
+            query = Animal.objects.filter(bucket, compatibility, status='A').order_by()
+            candidate_ids.update(dict.fromkeys(query.values_list('id', flat=True)[:self.candidate_pool_size]))
+        candidate_ids = dict.fromkeys(list(candidate_ids)[:self.candidate_pool_size])
+        
+        # Neighbors of what was just viewed, by content and by co-views
+        related_ids = []
+        recent_ids = list(dict.fromkeys(viewed_animal_ids))[:self.similar_seed_views]
+        if recent_ids:
+            for neighbor_ids in SimilarAnimals.objects.filter(animal_id__in=recent_ids) \
+                    .values_list('neighbor_ids', flat=True):
+                related_ids.extend(neighbor_ids)
+            try:
+                coview_model = get_coview_model()
+                if coview_model is not None:
+                    related_ids.extend(coview_model.neighbors_of(recent_ids))
+            except Exception as e:
+                logger.error(f"Error retrieving co-viewed candidates: {str(e)}")
+        
+        # Walk the popularity counter index alone; availability is checked below
+        ordering = '-trending_score' if self.popularity_ordering == 'trending' else '-view_count'
+        related_ids.extend(AnimalPopularity.objects.filter(view_count__gt=0).order_by(ordering)
+                           .values_list('animal_id', flat=True)[:self.popular_candidates])
+        
+        # Related and popular animals may have been adopted or not be compatible.
+        # Filtering by primary key alone keeps SQLite on the primary key index.
+        related_ids = [animal_id for animal_id in dict.fromkeys(related_ids) if animal_id not in candidate_ids]
+        if related_ids:
+            related = Animal.objects.filter(id__in=related_ids).values_list('id', 'status', *self.COMPATIBILITY_FIELDS)
+            for animal_id, status, *flags in related:
+                if status == 'A' and self._is_compatible(profile, dict(zip(self.COMPATIBILITY_FIELDS, flags))):
+                    candidate_ids[animal_id] = None
+        
+        logger.info(f"Retrieved {len(candidate_ids)} candidates from {len(buckets)} indexed buckets")
+        return list(candidate_ids)
+    
+    COMPATIBILITY_FIELDS = ('good_with_kids', 'good_with_cats', 'good_with_dogs')
+    
+    @staticmethod
+    def _is_compatible(profile, flags):
+        """The compatibility hard constraints of _retrieve_candidates, for one animal"""
+        if profile is None:
+            return True
+        if profile.good_with_children and not flags['good_with_kids']:
+            return False
+        if profile.good_with_other_pets and not (flags['good_with_cats'] or flags['good_with_dogs']):
+            return False
+        return True
+    
     def _score_by_preferences(self, candidates, profile):
         """Score animals based on user preferences from profile"""
         scores = {}
-        small_animals = ['Hamster', 'Guinea Pig', 'Rabbit', 'Gerbil', 'Mouse', 'Rat', 'Ferret']
+        small_animals = SMALL_ANIMALS
         
         # Log preferences for debugging
         logger.info(f"Scoring with preferences - Species: {profile.preferred_species}, "
@@ -210,70 +869,62 @@ class MLRecommendationEngine:
         
         return scores
     
-    def _score_by_view_history(self, candidates, view_history):
-        """Score animals based on patterns in user viewing history"""
-        scores = {}
+    def _score_by_preferences_vectorized(self, columns, profile):
+        """Score an AnimalColumns pool against the profile with boolean masks"""
+        scores = np.zeros(len(columns))
+        max_score = 0
         
-        # Count how many times each species/breed/characteristic has been viewed
-        species_counts = {}
-        breed_counts = {}
-        size_counts = {}
-        feature_counts = {}
+        # Species preference (highest weight)
+        if profile.preferred_species:
+            max_score += 4
+            species_match = columns.species == profile.preferred_species
+            
+            # Handle 'Small Animal' preference
+            if profile.preferred_species == 'Small Animal':
+                species_match |= np.isin(columns.species, SMALL_ANIMALS)
+            scores += 4 * species_match
         
-        # Apply recency weighting to views
-        now = timezone.now()
+        # Size preference
+        if profile.preferred_size:
+            max_score += 2
+            scores += 2 * (columns.size == profile.preferred_size)
         
-        for view in view_history:
-            animal = view.animal
-            
-            # Calculate recency weight
-            days_ago = (now - view.timestamp).days
-            recency_weight = self.recency_decay ** min(days_ago, self.recency_days)
-            
-            # Count species views with recency weighting
-            species = animal.species
-            if species not in species_counts:
-                species_counts[species] = 0
-            species_counts[species] += recency_weight
-            
-            # Count breed views with recency weighting
-            if hasattr(animal, 'breed') and animal.breed:
-                breed = animal.breed
-                if breed not in breed_counts:
-                    breed_counts[breed] = 0
-                breed_counts[breed] += recency_weight
-            
-            # Count size views with recency weighting
-            if hasattr(animal, 'size') and animal.size:
-                size = animal.size
-                if size not in size_counts:
-                    size_counts[size] = 0
-                size_counts[size] += recency_weight
-            
-            # Count feature views with recency weighting
-            for feature in ['good_with_kids', 'good_with_cats', 'good_with_dogs', 'energy_level']:
-                if hasattr(animal, feature):
-                    value = getattr(animal, feature)
-                    if value:  # Only count True boolean values or non-empty strings
-                        feature_key = f"{feature}_{value}"
-                        if feature_key not in feature_counts:
-                            feature_counts[feature_key] = 0
-                        feature_counts[feature_key] += recency_weight
+        # Age preference
+        if hasattr(profile, 'preferred_age_min') and hasattr(profile, 'preferred_age_max'):
+            max_score += 2
+            scores += 2 * ((columns.age >= profile.preferred_age_min) &
+                           (columns.age <= profile.preferred_age_max))
         
-        # Normalize counts to get probabilities
-        total_views = sum(species_counts.values())
-        if total_views > 0:
-            for species in species_counts:
-                species_counts[species] /= total_views
-            
-            for breed in breed_counts:
-                breed_counts[breed] /= total_views
-            
-            for size in size_counts:
-                size_counts[size] /= total_views
-            
-            for feature in feature_counts:
-                feature_counts[feature] /= total_views
+        # Energy level preference
+        if profile.preferred_energy_level:
+            max_score += 2
+            scores += 2 * (columns.energy_level == profile.preferred_energy_level)
+        
+        # Good with children preference
+        if profile.good_with_children:
+            max_score += 1
+            scores += columns.good_with_kids
+        
+        # Good with other pets preference
+        if profile.good_with_other_pets:
+            max_score += 1
+            scores += columns.good_with_cats | columns.good_with_dogs
+        
+        # Normalize score (0-1)
+        if max_score > 0:
+            scores /= max_score
+        
+        logger.debug(f"{int((scores > 0.7).sum())} of {len(columns)} animals scored above 0.7 for preferences")
+        
+        return scores
+    
+    def _score_by_view_history(self, candidates, taste_profile):
+        """Score animals based on patterns in user viewing history"""
+        scores = {}
+        
+        # Share of the (recency weighted) views per species/breed/size/feature,
+        # maintained incrementally in the user's taste profile
+        species_counts, breed_counts, size_counts, feature_counts = taste_profile.normalized_counts()
         
         # Log view patterns
         logger.debug(f"Species viewing pattern: {dict(species_counts)}")
@@ -296,7 +947,7 @@ class MLRecommendationEngine:
                 score += size_counts[animal.size] * 0.2  # 20% weight to size
             
             # Score based on features
-            for feature in ['good_with_kids', 'good_with_cats', 'good_with_dogs', 'energy_level']:
+            for feature in UserTasteProfile.FEATURES:
                 if hasattr(animal, feature):
                     value = getattr(animal, feature)
                     if value:
@@ -308,209 +959,332 @@ class MLRecommendationEngine:
         
         return scores
     
-    def _score_by_content_similarity(self, candidates, view_history):
-        """Score animals based on content similarity to viewed animals"""
-        from animals.models import Animal
+    def _score_by_view_history_vectorized(self, columns, taste_profile):
+        """Score an AnimalColumns pool against the user's taste profile"""
+        species_counts, breed_counts, size_counts, feature_counts = taste_profile.normalized_counts()
+        
+        scores = lookup_column(columns.species, species_counts) * 0.4
+        scores += lookup_column(columns.breed, breed_counts) * 0.3
+        scores += lookup_column(columns.size, size_counts) * 0.2
         
-        # Get the animals user has viewed
-        viewed_animal_ids = view_history.values_list('animal_id', flat=True)
-        viewed_animals = Animal.objects.filter(id__in=viewed_animal_ids)
+        # Boolean features only count when True, like "good_with_kids_True"
+        for feature in ['good_with_kids', 'good_with_cats', 'good_with_dogs']:
+            weight = feature_counts.get(f"{feature}_True", 0.0)
+            scores += getattr(columns, feature) * weight * 0.1 / 4
         
-        if not viewed_animals.exists():
+        energy_counts = {
+            key[len('energy_level_'):]: value
+            for key, value in feature_counts.items() if key.startswith('energy_level_')
+        }
+        scores += lookup_column(columns.energy_level, energy_counts) * 0.1 / 4
+        
+        return scores
+    
+    @staticmethod
+    def _candidate_ids(candidates):
+        """Ids of a candidate pool given as an Animal queryset or as an id array"""
+        if isinstance(candidates, QuerySet):
+            return list(candidates.values_list('id', flat=True))
+        return [int(animal_id) for animal_id in candidates]
+    
+    def _score_by_content_similarity(self, candidates, viewed_animal_ids):
+        """Score animals based on content similarity to viewed animals"""
+        # Get the distinct animals user has viewed
+        viewed_animal_ids = sorted(set(viewed_animal_ids))
+        if not viewed_animal_ids:
             return {}
         
-        # Create feature vectors for all animals (viewed + candidates)
-        all_animals = list(viewed_animals) + list(candidates)
+        candidate_ids = self._candidate_ids(candidates)
+        if not candidate_ids:
+            return {}
         
-        # Create feature vectors
-        features = []
-        for animal in all_animals:
-            # Create a combined text feature
-            text_features = []
-            
-            # Add species as a feature
-            if hasattr(animal, 'species'):
-                text_features.append(f"species_{animal.species}")
-            
-            # Add breed as a feature
-            if hasattr(animal, 'breed') and animal.breed:
-                text_features.append(f"breed_{animal.breed}")
-            
-            # Add size as a feature
-            if hasattr(animal, 'size') and animal.size:
-                text_features.append(f"size_{animal.size}")
-            
-            # Add age as a feature
-            age_in_years = animal.age_years
-            if hasattr(animal, 'age_months'):
-                age_in_years += animal.age_months / 12
-            
-            age_category = "young" if age_in_years < 2 else "adult" if age_in_years < 8 else "senior"
-            text_features.append(f"age_{age_category}")
+        try:
+            # Vectors come from the fixed vocabulary, nothing is refit here
+            vectors = get_content_vectors()
+            if vectors is None:
+                return {}
+            viewed_matrix = vectors.vectors_for(viewed_animal_ids)
+            candidate_matrix = vectors.vectors_for(candidate_ids)
             
-            # Add energy level as a feature
-            if hasattr(animal, 'energy_level') and animal.energy_level:
-                text_features.append(f"energy_{animal.energy_level}")
+            # Rows are L2-normalised, so the average cosine similarity to the
+            # viewed animals is the dot product with their mean vector
+            mean_viewed = np.asarray(viewed_matrix.mean(axis=0)).ravel()
+            similarities = candidate_matrix @ mean_viewed
             
-            # Add compatibility features
-            for field in ['good_with_kids', 'good_with_cats', 'good_with_dogs']:
-                if hasattr(animal, field) and getattr(animal, field):
-                    text_features.append(field)
+            return dict(zip(candidate_ids, similarities.tolist()))
             
-            features.append(" ".join(text_features))
+        except Exception as e:
+            logger.error(f"Error calculating content similarity: {str(e)}")
+            return {}
+    
+    def _score_by_coview(self, candidates, viewed_animal_ids):
+        """Score animals by how often people who viewed the same animals viewed them too"""
+        if not viewed_animal_ids:
+            return {}
+        
+        candidate_ids = self._candidate_ids(candidates)
+        if not candidate_ids:
+            return {}
         
         try:
-            # Use TF-IDF to vectorize features
-            vectorizer = TfidfVectorizer()
-            feature_matrix = vectorizer.fit_transform(features)
+            # Skipped until a co-view model has been published
+            model = get_coview_model()
+            if model is None:
+                return {}
             
-            # Calculate similarity between viewed animals and candidates
-            viewed_indices = list(range(len(viewed_animals)))
-            candidate_indices = list(range(len(viewed_animals), len(all_animals)))
+            # Mean item-item cosine similarity to the distinct viewed animals
+            scores = model.score_users([viewed_animal_ids], candidate_ids)[0]
+            return dict(zip(candidate_ids, scores.tolist()))
             
-            # Calculate similarity scores
-            similarity_scores = {}
+        except Exception as e:
+            logger.error(f"Error calculating co-view scores: {str(e)}")
+            return {}
+    
+    def _score_by_factors(self, candidates, user_id):
+        """Score animals with the dot product of the user's and each animal's factors"""
+        try:
+            model = get_factor_model()
+            if model is None or model.user_vector(user_id) is None:
+                return {}
             
-            for cand_idx in candidate_indices:
-                cand_vector = feature_matrix[cand_idx]
-                
-                # Calculate average similarity to viewed animals
-                total_sim = 0
-                for viewed_idx in viewed_indices:
-                    viewed_vector = feature_matrix[viewed_idx]
-                    sim = cosine_similarity(cand_vector, viewed_vector)[0][0]
-                    total_sim += sim
-                
-                avg_sim = total_sim / len(viewed_indices) if viewed_indices else 0
-                animal_id = all_animals[cand_idx].id
-                similarity_scores[animal_id] = avg_sim
+            candidate_ids = self._candidate_ids(candidates)
+            if not candidate_ids:
+                return {}
             
-            return similarity_scores
+            scores, _ = model.score_users([user_id], candidate_ids)
+            return dict(zip(candidate_ids, scores[0].tolist()))
             
         except Exception as e:
-            logger.error(f"Error calculating content similarity: {str(e)}")
+            logger.error(f"Error calculating factor scores: {str(e)}")
             return {}
     
     def _get_popular_animals(self, limit, exclude_ids=None):
-        """Get popular animals based on view count"""
-        from animals.models import Animal, AnimalViewHistory
-        from django.db.models import Count
+        """Get popular animals from the materialized view counters"""
+        if limit <= 0:
+            return []
         
-        query = Animal.objects.filter(status='A')
+        with stage('popularity'):
+            return self._popular_animal_ids(limit, exclude_ids)
+    
+    def _popular_animal_ids(self, limit, exclude_ids):
+        """Walk the popularity counters, topping up with a random sample"""
+        from animals.models import AnimalPopularity
         
+        popular = AnimalPopularity.objects.filter(animal__status='A', view_count__gt=0)
         if exclude_ids:
-            query = query.exclude(id__in=exclude_ids)
+            popular = popular.exclude(animal_id__in=exclude_ids)
         
-        # Get animals with most views
-        popular = query.annotate(
-            view_count=Count('animalviewhistory')
-        ).order_by('-view_count')
+        # Walk the indexed counter column instead of counting view rows
+        if self.popularity_ordering == 'trending':
+            popular = popular.order_by('-trending_score', 'animal_id')
+        else:
+            popular = popular.order_by('-view_count', 'animal_id')
+        popular_ids = list(popular.values_list('animal_id', flat=True)[:limit])
         
-        # If no views exist, return random animals
-        if not popular.exists() or popular.first().view_count == 0:
-            logger.info("No view data available, using random selection for popular animals")
-            return list(query.order_by('?')[:limit].values_list('id', flat=True))
+        # Top up with a random sample when too few animals have been viewed
+        if len(popular_ids) < limit:
+            if not popular_ids:
+                logger.info("No view data available, using random selection for popular animals")
+            popular_ids.extend(self._sample_available_animals(
+                limit - len(popular_ids),
+                exclude_ids=list(exclude_ids or []) + popular_ids
+            ))
         
-        return list(popular[:limit].values_list('id', flat=True))
+        return popular_ids
+    
+    def _sample_available_animals(self, limit, exclude_ids=None):
+        """
+        Pick random available animals from the catalog snapshot's ids.
+        
+        Sampling positions of a range costs O(limit), not O(catalog), and
+        only the sampled ids are checked against the table, by primary key.
+        """
+        from animals.models import Animal
+        
+        snapshot = get_catalog_snapshot()
+        excluded = set(exclude_ids or [])
+        
+        # Oversample so the excluded ids can be dropped and still leave limit
+        size = limit + len(excluded)
+        while True:
+            size = min(size, len(snapshot))
+            sampled_ids = [int(snapshot.ids[row]) for row in random.sample(range(len(snapshot)), size)]
+            sampled_ids = [animal_id for animal_id in sampled_ids if animal_id not in excluded]
+            
+            # The snapshot may not have caught up with adoptions made by other processes
+            available = set(Animal.objects.filter(id__in=sampled_ids, status='A').values_list('id', flat=True))
+            sampled_ids = [animal_id for animal_id in sampled_ids if animal_id in available]
+            if len(sampled_ids) >= limit or size == len(snapshot):
+                return sampled_ids[:limit]
+            size *= 2
     
     def get_recommendation_reason(self, user_id, animal):
         """Generate a personalized reason for a recommendation"""
-        from django.contrib.auth.models import User
-        from users.models import UserProfile
+        reason_code, reason = self.get_recommendation_reasons(user_id, [animal])[animal.id]
+        return reason
+    
+    def get_recommendation_reasons(self, user_id, animals, components=None):
+        """
+        Generate personalized reasons for several recommended animals at once
+        
+        Each reason comes from the scoring stage that contributed most to the
+        animal's score: pass the {animal_id: component} the ranking returned
+        (see get_recommendations(with_reasons=True)), or leave it out to
+        score the animals here. Preference reasons say which preference
+        matched, from the profile; view history and similarity reasons say
+        which species or breed the user has been viewing, from the decayed
+        counters of the taste profile. Each is loaded once, and only when a
+        component needs it. Returns {animal_id: (reason_code, reason)}.
+        """
         from animals.models import AnimalViewHistory
+        from users.models import UserProfile
         
         try:
-            user = User.objects.get(id=user_id)
-            
-            # Check for previous interactions with this animal
-            previous_views = AnimalViewHistory.objects.filter(user=user, animal=animal).count()
-            if previous_views > 0:
-                return f"Similar to animals you've viewed before"
-            
-            # Get user preferences
-            user_pref = UserProfile.objects.filter(user=user).first()
-            
-            if user_pref:
-                # Check if the animal matches species preference
-                if hasattr(user_pref, 'preferred_species') and user_pref.preferred_species:
-                    # Handle Small Animal special case
-                    if user_pref.preferred_species == 'Small Animal':
-                        small_animals = ['Hamster', 'Guinea Pig', 'Rabbit', 'Gerbil', 'Mouse', 'Rat', 'Ferret']
-                        if hasattr(animal, 'species') and animal.species in small_animals:
-                            return f"Matches your preference for small animals"
-                    
-                    # Regular species matching
-                    elif hasattr(animal, 'species') and animal.species == user_pref.preferred_species:
-                        return f"Matches your {animal.species.lower()} preference"
-                
-                # Check size preference
-                if hasattr(user_pref, 'preferred_size') and hasattr(animal, 'size'):
-                    if user_pref.preferred_size == animal.size:
-                        return f"Matches your preference for {animal.size.lower()} sized pets"
-                
-                # Check energy level preference
-                if hasattr(user_pref, 'preferred_energy_level') and hasattr(animal, 'energy_level'):
-                    if user_pref.preferred_energy_level == animal.energy_level:
-                        return f"Matches your preference for {animal.energy_level.lower()} energy pets"
-                
-                # Check age preference
-                if (hasattr(user_pref, 'preferred_age_min') and 
-                    hasattr(user_pref, 'preferred_age_max') and
-                    hasattr(animal, 'age_years')):
-                    age_in_years = animal.age_years
-                    if hasattr(animal, 'age_months'):
-                        age_in_years += animal.age_months / 12
-                    
-                    if user_pref.preferred_age_min <= age_in_years <= user_pref.preferred_age_max:
-                        if age_in_years < 2:
-                            return "Young pet within your preferred age range"
-                        elif age_in_years < 8:
-                            return "Adult pet within your preferred age range"
-                        else:
-                            return "Senior pet within your preferred age range"
-                
-                # Check compatibility preferences
-                if hasattr(user_pref, 'good_with_children') and user_pref.good_with_children:
-                    if hasattr(animal, 'good_with_kids') and animal.good_with_kids:
-                        return "Great with children"
-                
-                if hasattr(user_pref, 'good_with_other_pets') and user_pref.good_with_other_pets:
-                    if (hasattr(animal, 'good_with_cats') and animal.good_with_cats) or \
-                       (hasattr(animal, 'good_with_dogs') and animal.good_with_dogs):
-                        return "Gets along well with other pets"
-            
-            # Check user view history for patterns
-            view_history = AnimalViewHistory.objects.filter(user=user).exclude(animal=animal)
-            
-            if view_history.exists():
-                # Check if user has viewed animals of the same species
-                same_species_views = view_history.filter(animal__species=animal.species).count()
-                if same_species_views > 0:
-                    return f"Similar to {animal.species.lower()}s you've viewed"
-                
-                # Check if user has viewed animals of the same breed
-                if hasattr(animal, 'breed') and animal.breed:
-                    same_breed_views = view_history.filter(animal__breed=animal.breed).count()
-                    if same_breed_views > 0:
-                        return f"Similar breed to animals you've viewed"
-            
-            # Default species-based reasons
-            if hasattr(animal, 'species'):
-                if animal.species == "Dog":
-                    return "Loyal and friendly companion"
-                elif animal.species == "Cat":
-                    return "Independent and affectionate pet"
-                elif animal.species == "Rabbit":
-                    return "Adorable and low-maintenance pet"
-                elif animal.species == "Guinea Pig":
-                    return "Sociable and gentle pet"
-                elif animal.species == "Hamster":
-                    return "Compact and entertaining companion"
-                else:
-                    return "Wonderful pet looking for a home"
-                    
-        except User.DoesNotExist:
-            return "Popular pet ready for adoption"
+            profile = taste_profile = None
+            viewed_ids = set()
+            if components is None:
+                components, profile, taste_profile, viewed_ids = self._score_components(
+                    user_id, [animal.id for animal in animals]
+                )
+            else:
+                if 'preferences' in components.values():
+                    profile = UserProfile.objects.filter(user_id=user_id).first()
+                if {'history', 'similarity'} & set(components.values()):
+                    taste_profile = UserTasteProfile.objects.filter(user_id=user_id).first()
+                    viewed_ids = set(AnimalViewHistory.objects.filter(
+                        user_id=user_id, animal_id__in=[animal.id for animal in animals]
+                    ).values_list('animal_id', flat=True))
         except Exception as e:
             logger.error(f"Error generating recommendation reason: {str(e)}")
-            return "Recommended based on availability"
\ No newline at end of file
+            return {animal.id: ('available', "Recommended based on availability") for animal in animals}
+        
+        reasons = {}
+        for animal in animals:
+            try:
+                reasons[animal.id] = self._reason_for_component(
+                    components.get(animal.id), profile, animal, taste_profile, viewed_ids
+                )
+            except Exception as e:
+                logger.error(f"Error generating recommendation reason: {str(e)}")
+                reasons[animal.id] = ('available', "Recommended based on availability")
+        return reasons
+    
+    def _score_components(self, user_id, animal_ids):
+        """
+        Score the given animals for a user.
+        
+        Returns ({animal_id: top component}, profile, taste profile, viewed
+        animal ids), the user data loaded for the scoring.
+        """
+        from animals.models import AnimalViewHistory
+        from users.models import UserProfile
+        
+        profile = UserProfile.objects.filter(user_id=user_id).first()
+        viewed_animal_ids = list(
+            AnimalViewHistory.objects.filter(user_id=user_id).order_by('-timestamp').values_list('animal_id', flat=True)
+        )
+        taste_profile = UserTasteProfile.objects.filter(user_id=user_id).first() if viewed_animal_ids else None
+        
+        snapshot = get_catalog_snapshot()
+        columns = snapshot.columns(snapshot.select(animal_ids))
+        scored = self._rank_vectorized(user_id, columns, profile, taste_profile, viewed_animal_ids, len(columns))
+        components = {animal_id: component for animal_id, _, component in scored or []}
+        return components, profile, taste_profile, set(viewed_animal_ids)
+    
+    def _reason_for_component(self, component, user_pref, animal, taste_profile=None, viewed_ids=()):
+        """The (reason_code, reason) for an animal whose score came mostly from component"""
+        if component == 'preferences' and user_pref:
+            reason = self._preference_reason(user_pref, animal)
+            if reason:
+                return reason
+        
+        if component in ('history', 'similarity'):
+            reason = self._history_reason(taste_profile, viewed_ids, animal)
+            if reason:
+                return reason
+
+        if component in COMPONENT_REASONS:
+            return COMPONENT_REASONS[component]
+        
+        # Default species-based reasons
+        if animal.species == "Dog":
+            return ('species_default', "Loyal and friendly companion")
+        elif animal.species == "Cat":
+            return ('species_default', "Independent and affectionate pet")
+        elif animal.species == "Rabbit":
+            return ('species_default', "Adorable and low-maintenance pet")
+        elif animal.species == "Guinea Pig":
+            return ('species_default', "Sociable and gentle pet")
+        elif animal.species == "Hamster":
+            return ('species_default', "Compact and entertaining companion")
+        else:
+            return ('species_default', "Wonderful pet looking for a home")
+    
+    @staticmethod
+    def _history_reason(taste_profile, viewed_ids, animal):
+        """What the animal has in common with the user's views: itself, then its species, then its breed"""
+        if animal.id in viewed_ids:
+            return ('viewed_before', "Similar to animals you've viewed before")
+        
+        if taste_profile is None:
+            return None
+        
+        if taste_profile.species_counts.get(animal.species, 0) > 0:
+            return ('similar_species', f"Similar to {animal.species.lower()}s you've viewed")
+        
+        if animal.breed and taste_profile.breed_counts.get(animal.breed, 0) > 0:
+            return ('similar_breed', "Similar breed to animals you've viewed")
+        
+        return None
+    
+    @staticmethod
+    def _preference_reason(user_pref, animal):
+        """Which of the user's preferences the animal matches, most heavily weighted first"""
+        # Check if the animal matches species preference
+        if hasattr(user_pref, 'preferred_species') and user_pref.preferred_species:
+            # Handle Small Animal special case
+            if user_pref.preferred_species == 'Small Animal':
+                if hasattr(animal, 'species') and animal.species in SMALL_ANIMALS:
+                    return ('small_animal_preference', f"Matches your preference for small animals")
+            
+            # Regular species matching
+            elif hasattr(animal, 'species') and animal.species == user_pref.preferred_species:
+                return ('species_preference', f"Matches your {animal.species.lower()} preference")
+        
+        # Check size preference
+        if hasattr(user_pref, 'preferred_size') and hasattr(animal, 'size'):
+            if user_pref.preferred_size == animal.size:
+                return ('size_preference', f"Matches your preference for {animal.size.lower()} sized pets")
+        
+        # Check energy level preference
+        if hasattr(user_pref, 'preferred_energy_level') and hasattr(animal, 'energy_level'):
+            if user_pref.preferred_energy_level == animal.energy_level:
+                return ('energy_preference', f"Matches your preference for {animal.energy_level.lower()} energy pets")
+        
+        # Check age preference
+        if (hasattr(user_pref, 'preferred_age_min') and 
+            hasattr(user_pref, 'preferred_age_max') and
+            hasattr(animal, 'age_years')):
+            age_in_years = animal.age_years
+            if hasattr(animal, 'age_months'):
+                age_in_years += animal.age_months / 12
+            
+            if user_pref.preferred_age_min <= age_in_years <= user_pref.preferred_age_max:
+                if age_in_years < 2:
+                    return ('age_preference', "Young pet within your preferred age range")
+                elif age_in_years < 8:
+                    return ('age_preference', "Adult pet within your preferred age range")
+                else:
+                    return ('age_preference', "Senior pet within your preferred age range")
+        
+        # Check compatibility preferences
+        if hasattr(user_pref, 'good_with_children') and user_pref.good_with_children:
+            if hasattr(animal, 'good_with_kids') and animal.good_with_kids:
+                return ('good_with_children', "Great with children")
+        
+        if hasattr(user_pref, 'good_with_other_pets') and user_pref.good_with_other_pets:
+            if (hasattr(animal, 'good_with_cats') and animal.good_with_cats) or \
+               (hasattr(animal, 'good_with_dogs') and animal.good_with_dogs):
+                return ('good_with_other_pets', "Gets along well with other pets")
+        
+        return None
@@ -0,0 +1,96 @@
+# recommendations/signals.py
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from animals.models import Animal, AnimalViewHistory
+from users.models import UserProfile
+from pet_connect_backend.metrics import VIEWS_RECORDED
+from .cache import invalidate_animal, invalidate_user
+from .catalog import patch_catalog_snapshot, remove_from_catalog_snapshot
+from .models import UserTasteProfile
+from .similar_animals import queue_similar_animals_refresh
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=AnimalViewHistory)
+def count_recorded_view(sender, instance, created, **kwargs):
+    """Feed the view-logging write rate metric."""
+    if created:
+        VIEWS_RECORDED.inc()
+
+
+@receiver(post_save, sender=AnimalViewHistory)
+def update_taste_profile_on_view(sender, instance, created, **kwargs):
+    """Fold every newly logged view into the viewer's taste profile."""
+    if not created:
+        return
+
+    try:
+        UserTasteProfile.record_view(instance)
+    except Exception as e:
+        # Never fail the view logging because of the profile update
+        logger.error(f"Error updating taste profile for user {instance.user_id}: {str(e)}")
+
+
+@receiver(post_save, sender=AnimalViewHistory)
+def invalidate_recommendations_on_view(sender, instance, created, **kwargs):
+    """A new view changes the viewer's history scores."""
+    if created:
+        invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_recommendations_on_profile_change(sender, instance, **kwargs):
+    """Changed preferences change the viewer's preference scores."""
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Animal)
+def invalidate_recommendations_on_status_change(sender, instance, **kwargs):
+    """Animals that are no longer available must drop out of cached lists."""
+    if instance.status != 'A':
+        # After the commit, or a list rebuilt from the old row meanwhile would be cached as fresh
+        animal_id = instance.id
+        transaction.on_commit(lambda: invalidate_animal(animal_id))
+
+
+@receiver(post_delete, sender=Animal)
+def invalidate_recommendations_on_delete(sender, instance, **kwargs):
+    animal_id = instance.id
+    transaction.on_commit(lambda: invalidate_animal(animal_id))
+
+
+def _queue_similar_animals_refresh(animal_id):
+    try:
+        queue_similar_animals_refresh(animal_id)
+    except Exception as e:
+        logger.error(f"Error queueing similar animals refresh for animal {animal_id}: {str(e)}")
+
+
+@receiver(post_save, sender=Animal)
+def queue_similar_animals_refresh_on_save(sender, instance, **kwargs):
+    """New, changed and adopted animals are queued for the next batch refresh of the neighbor lists."""
+    animal_id = instance.id
+    transaction.on_commit(lambda: _queue_similar_animals_refresh(animal_id))
+
+
+@receiver(post_delete, sender=Animal)
+def queue_similar_animals_refresh_on_delete(sender, instance, **kwargs):
+    animal_id = instance.id
+    transaction.on_commit(lambda: _queue_similar_animals_refresh(animal_id))
+
+
+@receiver(post_save, sender=Animal)
+def patch_catalog_on_save(sender, instance, **kwargs):
+    """Keep this process's catalog snapshot in step with committed animal changes."""
+    transaction.on_commit(lambda: patch_catalog_snapshot(instance))
+
+
+@receiver(post_delete, sender=Animal)
+def patch_catalog_on_delete(sender, instance, **kwargs):
+    animal_id = instance.id
+    transaction.on_commit(lambda: remove_from_catalog_snapshot([animal_id]))
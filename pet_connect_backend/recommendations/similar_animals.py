@@ -0,0 +1,166 @@
+# recommendations/similar_animals.py
+
+import logging
+
+import numpy as np
+import scipy.sparse as sp
+from django.db import transaction
+from django.utils import timezone
+
+from .content_vectors import get_content_vectors
+from .features import AnimalColumns, CANDIDATE_FIELDS, top_k
+
+logger = logging.getLogger(__name__)
+
+# Neighbors kept per animal
+DEFAULT_NEIGHBORS = 10
+
+
+def _top_neighbors(similarities, ids, n_neighbors):
+    """Return the (ids, scores) of the n highest similarities, best first"""
+    if len(similarities) == 0 or n_neighbors <= 0:
+        return [], []
+    # ids are sorted, so top_k's positional tie-break orders ties by id
+    top = np.asarray(top_k(np.arange(len(ids)), similarities, n_neighbors), dtype=np.int64)
+    top = top[similarities[top] > 0]
+    return ids[top].tolist(), [round(float(score), 6) for score in similarities[top]]
+
+
+def build_similar_animals(n_neighbors=DEFAULT_NEIGHBORS, block_size=512):
+    """
+    Compute the neighbor lists of every available animal from scratch.
+
+    Similarities are the same TF-IDF cosine scores _score_by_content_similarity
+    uses, computed block by block so memory stays bounded.
+    """
+    from animals.models import Animal
+    from .models import SimilarAnimals, SimilarAnimalsRefresh
+
+    started = timezone.now()
+    vectors = get_content_vectors()
+    if vectors is None:
+        logger.warning("No content vectors published, run build_content_vectors before building similar animals")
+        return 0
+
+    ids = np.asarray(
+        Animal.objects.filter(status='A').order_by('id').values_list('id', flat=True), dtype=np.int64
+    )
+    matrix = vectors.vectors_for(ids)
+
+    rows = []
+    for start in range(0, len(ids), block_size):
+        block = (matrix[start:start + block_size] @ matrix.T).toarray()
+        for offset, similarities in enumerate(block):
+            similarities[start + offset] = -np.inf  # An animal is not its own neighbor
+            neighbor_ids, scores = _top_neighbors(similarities, ids, n_neighbors)
+            rows.append(SimilarAnimals(animal_id=int(ids[start + offset]), neighbor_ids=neighbor_ids, scores=scores))
+
+    with transaction.atomic():
+        SimilarAnimals.objects.all().delete()
+        SimilarAnimals.objects.bulk_create(rows, batch_size=1000)
+        # Every change queued before the build is part of it
+        SimilarAnimalsRefresh.objects.filter(queued_at__lte=started).delete()
+
+    logger.info(f"Built similar animal lists for {len(rows)} animals")
+    return len(rows)
+
+
+def queue_similar_animals_refresh(animal_id):
+    """Queue an added, changed or removed animal for the next refresh_similar_animals run"""
+    from .models import SimilarAnimalsRefresh
+
+    SimilarAnimalsRefresh.objects.update_or_create(animal_id=animal_id)
+
+
+def refresh_similar_animals(n_neighbors=DEFAULT_NEIGHBORS, block_size=512):
+    """
+    Patch the neighbor lists for the animals queued since the last run.
+
+    Queued animals that are available get a fresh list, from their current
+    fields (the vectors artifact may predate the change), and are merged
+    into the lists of their new neighbors. Every list that names a queued
+    animal is recomputed as well, so lists that lose an adopted, deleted or
+    changed animal are back-filled with the next most similar ones instead
+    of shrinking. Run it often (see the build_similar_animals command);
+    one run costs one block of similarity products for the whole batch.
+    """
+    from animals.models import Animal
+    from .models import SimilarAnimals, SimilarAnimalsRefresh
+
+    vectors = get_content_vectors()
+    if vectors is None:
+        logger.warning("No content vectors published, leaving the similar animals queue for a later run")
+        return 0
+
+    started = timezone.now()
+    queued = set(SimilarAnimalsRefresh.objects.filter(queued_at__lte=started).values_list('animal_id', flat=True))
+    if not queued:
+        return 0
+
+    available = Animal.objects.filter(status='A').order_by('id')
+    ids = np.asarray(available.values_list('id', flat=True), dtype=np.int64)
+    available_ids = set(ids.tolist())
+    changed = sorted(queued & available_ids)
+
+    # Lists that name a queued animal hold a stale score or a gap to fill
+    affected = {
+        similar.animal_id
+        for similar in SimilarAnimals.objects.only('animal_id', 'neighbor_ids').iterator()
+        if queued.intersection(similar.neighbor_ids)
+    }
+    recompute = np.asarray(sorted((set(changed) | affected) & available_ids), dtype=np.int64)
+
+    matrix = vectors.vectors_for(ids)
+    if changed:
+        # Swap in vectors of the changed animals' current fields
+        positions = np.searchsorted(ids, changed)
+        fresh = vectors.transform(AnimalColumns.from_queryset(available.filter(id__in=changed)).feature_texts())
+        keep = np.ones(len(ids))
+        keep[positions] = 0
+        placement = sp.csr_matrix(
+            (np.ones(len(changed)), (positions, np.arange(len(changed)))), shape=(len(ids), len(changed))
+        )
+        matrix = (sp.diags(keep) @ matrix + placement @ fresh).tocsr()
+
+    lists = {}
+    positions = np.searchsorted(ids, recompute)
+    for start in range(0, len(positions), block_size):
+        block_positions = positions[start:start + block_size]
+        block = (matrix[block_positions] @ matrix.T).toarray()
+        for position, similarities in zip(block_positions, block):
+            similarities[position] = -np.inf  # An animal is not its own neighbor
+            lists[int(ids[position])] = _top_neighbors(similarities, ids, n_neighbors)
+
+    # Changed animals join the lists that weren't recomputed (similarity is symmetric)
+    merges = {}
+    for animal_id in changed:
+        for neighbor_id, score in zip(*lists[animal_id]):
+            if neighbor_id not in lists:
+                merges.setdefault(neighbor_id, []).append((animal_id, score))
+
+    with transaction.atomic():
+        SimilarAnimals.objects.filter(animal_id__in=queued - available_ids).delete()
+        SimilarAnimals.objects.filter(animal_id__in=list(lists)).delete()
+        SimilarAnimals.objects.bulk_create([
+            SimilarAnimals(animal_id=animal_id, neighbor_ids=neighbor_ids, scores=scores)
+            for animal_id, (neighbor_ids, scores) in lists.items()
+        ], batch_size=1000)
+        for similar in SimilarAnimals.objects.select_for_update().filter(animal_id__in=list(merges)):
+            for animal_id, score in merges[similar.animal_id]:
+                _insert_neighbor(similar, animal_id, score, n_neighbors)
+        # Animals queued again while this ran wait for the next run
+        SimilarAnimalsRefresh.objects.filter(animal_id__in=queued, queued_at__lte=started).delete()
+
+    logger.info(f"Refreshed similar animal lists of {len(lists)} animals for {len(queued)} queued changes")
+    return len(lists)
+
+
+def _insert_neighbor(similar, animal_id, score, n_neighbors):
+    pairs = [(n, s) for n, s in zip(similar.neighbor_ids, similar.scores) if n != animal_id]
+    pairs.append((animal_id, score))
+    pairs.sort(key=lambda pair: (-pair[1], pair[0]))
+    pairs = pairs[:n_neighbors]
+    if [n for n, _ in pairs] != similar.neighbor_ids or [s for _, s in pairs] != similar.scores:
+        similar.neighbor_ids = [n for n, _ in pairs]
+        similar.scores = [s for _, s in pairs]
+        similar.save(update_fields=['neighbor_ids', 'scores', 'updated_at'])
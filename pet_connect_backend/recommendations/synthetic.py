@@ -0,0 +1,129 @@
+# recommendations/synthetic.py
+
+import io
+import random
+import logging
+from datetime import timedelta
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Species and breeds the synthetic catalog draws from
+SPECIES_BREEDS = {
+    'Dog': ['Labrador', 'Beagle', 'German Shepherd', 'Poodle', 'Bulldog', 'Boxer', 'Husky', 'Mixed'],
+    'Cat': ['Siamese', 'Persian', 'Maine Coon', 'Bengal', 'Ragdoll', 'Domestic Shorthair'],
+    'Rabbit': ['Holland Lop', 'Netherland Dwarf', 'Lionhead'],
+    'Guinea Pig': ['American', 'Abyssinian', 'Peruvian'],
+    'Hamster': ['Syrian', 'Dwarf'],
+    'Bird': ['Parakeet', 'Cockatiel', 'Canary'],
+}
+SPECIES_WEIGHTS = [0.4, 0.3, 0.1, 0.08, 0.07, 0.05]
+SIZES = ['Small', 'Medium', 'Large']
+ENERGY_LEVELS = ['Low', 'Medium', 'High']
+
+
+class SyntheticData:
+    """Ids of the rows created by create_synthetic_data"""
+
+    def __init__(self, animal_ids, user_ids, view_count):
+        self.animal_ids = animal_ids
+        self.user_ids = user_ids
+        self.view_count = view_count
+
+
+def create_synthetic_data(n_animals, n_users, views_per_user=20, seed=0, days=90, batch_size=2000):
+    """
+    Fill the database with a seeded synthetic catalog, users and view history.
+
+    Every user favours one species and most of their views go to it, so the
+    history has structure the engine can learn from. Rows are written with
+    bulk_create (no signals fire), then the taste profiles and popularity
+    counters are rebuilt the same way the management commands do. Meant for
+    an isolated database (see evaluation.isolated_database) or a TestCase.
+    """
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from animals.models import Animal, AnimalViewHistory
+    from users.models import UserProfile
+    from .models import UserTasteProfile
+
+    rng = random.Random(seed)
+    species_names = list(SPECIES_BREEDS)
+    now = timezone.now()
+
+    # Catalog
+    animals = []
+    for i in range(n_animals):
+        species = rng.choices(species_names, SPECIES_WEIGHTS)[0]
+        animals.append(Animal(
+            name=f"Synthetic {i}",
+            species=species,
+            breed=rng.choice(SPECIES_BREEDS[species]),
+            age_years=rng.randint(0, 14),
+            age_months=rng.randint(0, 11),
+            gender=rng.choice(['M', 'F']),
+            size=rng.choice(SIZES),
+            energy_level=rng.choice(ENERGY_LEVELS),
+            good_with_kids=rng.random() < 0.6,
+            good_with_cats=rng.random() < 0.5,
+            good_with_dogs=rng.random() < 0.5,
+            status=rng.choices(['A', 'P', 'AD'], [0.85, 0.05, 0.1])[0],
+            arrival_date=(now - timedelta(days=rng.randint(0, 365))).date(),
+        ))
+        animals[-1].update_filter_columns()
+    Animal.objects.bulk_create(animals, batch_size=batch_size)
+
+    animal_ids = []
+    ids_by_species = {species: [] for species in species_names}
+    created = Animal.objects.filter(name__startswith='Synthetic ').order_by('id').values_list('id', 'species')
+    for animal_id, species in created.iterator():
+        animal_ids.append(animal_id)
+        ids_by_species[species].append(animal_id)
+
+    # Users and their preferences
+    prefix = f"synthetic_{seed}_"
+    User.objects.bulk_create(
+        [User(username=f"{prefix}{i}", password='!') for i in range(n_users)], batch_size=batch_size
+    )
+    user_ids = list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+
+    favourites = {}
+    profiles = []
+    for user_id in user_ids:
+        favourites[user_id] = rng.choices(species_names, SPECIES_WEIGHTS)[0]
+        age_min = rng.randint(0, 6)
+        profiles.append(UserProfile(
+            user_id=user_id,
+            preferred_species=favourites[user_id] if rng.random() < 0.7 else None,
+            preferred_age_min=age_min,
+            preferred_age_max=age_min + rng.randint(2, 10),
+            preferred_size=rng.choice(SIZES + [None]),
+            preferred_energy_level=rng.choice(ENERGY_LEVELS + [None]),
+            good_with_children=rng.random() < 0.4,
+            good_with_other_pets=rng.random() < 0.4,
+        ))
+    UserProfile.objects.bulk_create(profiles, batch_size=batch_size)
+
+    # View history, mostly of each user's favourite species
+    views = []
+    for user_id in user_ids:
+        for _ in range(views_per_user):
+            pool = ids_by_species[favourites[user_id]] if rng.random() < 0.7 else animal_ids
+            if not pool:
+                pool = animal_ids
+            views.append(AnimalViewHistory(
+                user_id=user_id,
+                animal_id=rng.choice(pool),
+                timestamp=now - timedelta(seconds=rng.randint(0, days * 86400)),
+                view_duration=int(rng.expovariate(1 / 30)),
+            ))
+    AnimalViewHistory.objects.bulk_create(views, batch_size=batch_size)
+
+    for user in User.objects.filter(username__startswith=prefix).iterator():
+        UserTasteProfile.rebuild_for_user(user)
+    call_command('rebuild_popularity', stdout=io.StringIO())
+
+    logger.info(f"Created {len(animal_ids)} synthetic animals, {len(user_ids)} users and {len(views)} views")
+    return SyntheticData(animal_ids, user_ids, len(views))
+
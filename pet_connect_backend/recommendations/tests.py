@@ -6,814 +6,1316 @@ Unit tests for the recommendation engine components.
 Author: Macayla van der Merwe
 """
 
-import unittest
-from unittest import mock
-import pandas as pd
-import numpy as np
+import json
 import os
+import shutil
+import subprocess
+import sys
 import tempfile
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from prometheus_client import REGISTRY
 from django.utils import timezone
-from datetime import timedelta
+from rest_framework.test import APIClient
 
-from pets.models import Pet, Shelter, UserPreference, UserViewHistory, PetRecommendation
-from pets.recommendation_engine import HybridRecommendationEngine
-from pets.views import get_user_recommendations, log_pet_view
+from animals.models import Animal, AnimalViewHistory
+from users.models import UserProfile
+from recommendations.als import FactorModel, ImplicitALS, get_factor_model, load_interactions, train_factor_model
+from recommendations.artifacts import (
+    ArtifactRegistry, ArtifactStore, get_artifact_registry, get_artifact_store, preload_artifacts,
+    reset_artifact_registry,
+)
+from recommendations.benchmarks import STAGES, benchmark_stages, compare_to_baseline, create_benchmark_user
+from recommendations.cache import cache_recommendations, get_cached_recommendations, get_recommendation_cache
+from recommendations.catalog import (
+    CATALOG_ARTIFACT, CatalogSnapshot, get_catalog_snapshot, publish_catalog_snapshot, reset_catalog_snapshot,
+)
+from recommendations.content_vectors import CONTENT_VECTORS_ARTIFACT, build_content_vectors, get_content_vectors
+from recommendations.coview import COVIEW_ARTIFACT, CoviewModel, get_coview_model
+from recommendations.evaluation import evaluate_chronological_split
+from recommendations.features import AnimalColumns
+from recommendations.models import AnimalRecommendation, SimilarAnimals, SimilarAnimalsRefresh, UserTasteProfile
+from recommendations.recommendation_engine import MLRecommendationEngine
+from recommendations.similar_animals import build_similar_animals, refresh_similar_animals
+from recommendations.synthetic import create_synthetic_data
+from recommendations.timing import StageHistograms, stage_histograms
 
 
-class ContentBasedRecommendationTests(unittest.TestCase):
-    """Test content-based filtering recommendations."""
-    
-    def setUp(self):
-        """Set up test data."""
-        # Create a temporary directory for model files
-        self.temp_dir = tempfile.mkdtemp()
-        
-        # Create the recommendation engine
-        self.engine = HybridRecommendationEngine(model_dir=self.temp_dir)
-        
-        # Create sample pet data
-        self.pet_data = pd.DataFrame({
-            'id': range(1, 11),
-            'name': [f'Pet{i}' for i in range(1, 11)],
-            'species': ['Dog', 'Dog', 'Dog', 'Cat', 'Cat', 'Cat', 'Small Animal', 'Small Animal', 'Bird', 'Reptile'],
-            'breed': ['Labrador', 'Labrador', 'Poodle', 'Siamese', 'Siamese', 'Persian', 'Hamster', 'Guinea Pig', 'Canary', 'Gecko'],
-            'age': [2, 3, 5, 1, 2, 4, 1, 2, 1, 3],
-            'gender': ['Male', 'Female', 'Male', 'Female', 'Male', 'Female', 'Male', 'Female', 'Male', 'Female'],
-            'size': ['Large', 'Large', 'Medium', 'Small', 'Small', 'Medium', 'Small', 'Small', 'Small', 'Small'],
-            'energy_level': ['High', 'High', 'Medium', 'Low', 'Medium', 'Low', 'High', 'Medium', 'Medium', 'Low'],
-            'health_status': ['Healthy'] * 10,
-            'behavior_traits': [
-                'Friendly, Playful, Good with children',
-                'Friendly, Playful, Good with other dogs',
-                'Friendly, Calm, Good with children',
-                'Independent, Calm, Good with other cats',
-                'Friendly, Playful, Good with children',
-                'Independent, Calm',
-                'Active, Nocturnal',
-                'Friendly, Social',
-                'Vocal, Active',
-                'Calm, Easy to care for'
-            ],
-            'description': [
-                'A friendly Labrador who loves to play fetch.',
-                'A playful Labrador who gets along well with other dogs.',
-                'A calm Poodle who is great with kids.',
-                'A calm Siamese cat who likes to be independent.',
-                'A playful Siamese cat who loves attention.',
-                'A calm Persian cat who prefers to be alone.',
-                'An active hamster who is mainly active at night.',
-                'A friendly guinea pig who enjoys socializing.',
-                'A vocal canary who sings beautifully.',
-                'A calm gecko who is easy to take care of.'
-            ]
-        })
-    
-    def tearDown(self):
-        """Clean up after tests."""
-        # Remove temporary directory and all files
-        import shutil
-        shutil.rmtree(self.temp_dir)
-    
-    def test_content_model_training(self):
-        """Test that the content-based model can be trained."""
-        # Train the model
-        self.engine.train_content_based_model(self.pet_data)
-        
-        # Check that model components are created
-        self.assertIsNotNone(self.engine.content_transformer)
-        self.assertIsNotNone(self.engine.pet_features)
-        self.assertIsNotNone(self.engine.pet_similarity)
-        
-        # Check similarity matrix dimensions
-        self.assertEqual(self.engine.pet_similarity.shape, (10, 10))
-    
-    def test_content_based_recommendations(self):
-        """Test getting content-based recommendations."""
-        # Train the model
-        self.engine.train_content_based_model(self.pet_data)
-        
-        # Get recommendations for a Labrador
-        recs = self.engine.get_content_based_recommendations([1], num_recommendations=3)
-        
-        # Should recommend other dogs, especially Labradors
-        self.assertEqual(len(recs), 3)
-        self.assertIn(2, recs)  # Other Labrador should be recommended
-        
-        # Get recommendations for a Siamese cat
-        recs = self.engine.get_content_based_recommendations([4], num_recommendations=3)
-        
-        # Should recommend other cats, especially Siamese
-        self.assertEqual(len(recs), 3)
-        self.assertIn(5, recs)  # Other Siamese should be recommended
-    
-    def test_multiple_pet_recommendations(self):
-        """Test recommendations based on multiple pets."""
-        # Train the model
-        self.engine.train_content_based_model(self.pet_data)
-        
-        # Get recommendations for a Labrador and a Siamese cat
-        recs = self.engine.get_content_based_recommendations([1, 4], num_recommendations=6)
-        
-        # Should include both dogs and cats
-        self.assertEqual(len(recs), 6)
-        
-        # Count species in recommendations
-        species_counts = {}
-        for pet_id in recs:
-            species = self.pet_data.loc[self.pet_data['id'] == pet_id, 'species'].iloc[0]
-            species_counts[species] = species_counts.get(species, 0) + 1
-        
-        # Both dogs and cats should be represented
-        self.assertIn('Dog', species_counts)
-        self.assertIn('Cat', species_counts)
-
-
-class CollaborativeRecommendationTests(unittest.TestCase):
-    """Test collaborative filtering recommendations."""
-    
-    def setUp(self):
-        """Set up test data."""
-        # Create a temporary directory for model files
-        self.temp_dir = tempfile.mkdtemp()
-        
-        # Create the recommendation engine
-        self.engine = HybridRecommendationEngine(model_dir=self.temp_dir)
-        
-        # Create sample pet data
-        self.pet_data = pd.DataFrame({
-            'id': range(1, 11),
-            'species': ['Dog', 'Dog', 'Dog', 'Cat', 'Cat', 'Cat', 'Small Animal', 'Small Animal', 'Bird', 'Reptile'],
-        })
-        
-        # Create sample interaction data
-        # User 1 likes dogs and birds
-        # User 2 likes cats and reptiles
-        # User 3 likes dogs and small animals
-        interactions = []
-        
-        # User 1 interactions
-        for pet_id in [1, 2, 3, 9]:  # Dogs and bird
-            interactions.append({
-                'user_id': 1,
-                'pet_id': pet_id,
-                'interaction_type': 'view',
-                'timestamp': timezone.now(),
-                'duration': 60
-            })
-        
-        # User 2 interactions
-        for pet_id in [4, 5, 6, 10]:  # Cats and reptile
-            interactions.append({
-                'user_id': 2,
-                'pet_id': pet_id,
-                'interaction_type': 'view',
-                'timestamp': timezone.now(),
-                'duration': 60
-            })
-        
-        # User 3 interactions
-        for pet_id in [1, 3, 7, 8]:  # Dogs and small animals
-            interactions.append({
-                'user_id': 3,
-                'pet_id': pet_id,
-                'interaction_type': 'view',
-                'timestamp': timezone.now(),
-                'duration': 60
-            })
-        
-        # Additional shared interests to establish similarity
-        # Both User 1 and User 3 like Pet 1 and 3
-        # Both User 2 and User 4 like Pet 5
-        
-        # User 4 interactions (similar to User 2)
-        for pet_id in [5, 6]:  # Some cats
-            interactions.append({
-                'user_id': 4,
-                'pet_id': pet_id,
-                'interaction_type': 'view',
-                'timestamp': timezone.now(),
-                'duration': 60
-            })
-        
-        # User 5 interactions (similar to User 1)
-        for pet_id in [1, 9]:  # Some dogs and bird
-            interactions.append({
-                'user_id': 5,
-                'pet_id': pet_id,
-                'interaction_type': 'view',
-                'timestamp': timezone.now(),
-                'duration': 60
-            })
-        
-        self.interaction_data = pd.DataFrame(interactions)
-    
-    def tearDown(self):
-        """Clean up after tests."""
-        # Remove temporary directory and all files
-        import shutil
-        shutil.rmtree(self.temp_dir)
-    
-    def test_collaborative_model_training(self):
-        """Test that the collaborative model can be trained."""
-        # Train the model
-        self.engine.train_collaborative_model(self.interaction_data)
-        
-        # Check that model components are created
-        self.assertIsNotNone(self.engine.interaction_matrix)
-        self.assertIsNotNone(self.engine.user_similarity)
-        
-        # Check matrix dimensions
-        self.assertEqual(self.engine.interaction_matrix.shape, (5, 10))  # 5 users, 10 pets
-        self.assertEqual(self.engine.user_similarity.shape, (5, 5))  # 5 users
-    
-    def test_collaborative_recommendations(self):
-        """Test getting collaborative recommendations."""
-        # Train the model
-        self.engine.train_collaborative_model(self.interaction_data)
-        
-        # Get recommendations for User 4 (similar to User 2)
-        recs = self.engine.get_collaborative_recommendations(4, num_recommendations=3)
-        
-        # Should recommend pets that User 2 liked but User 4 hasn't seen
-        self.assertGreater(len(recs), 0)
-        
-        # User 4 has only seen Pet 5 and 6, so should recommend Pet 4 (cat) and Pet 10 (reptile)
-        for pet_id in recs:
-            self.assertNotIn(pet_id, [5, 6])  # Shouldn't recommend pets the user has already seen
-        
-        # Check if Pet 4 or Pet 10 is in recommendations
-        pet_ids_in_recs = set(recs)
-        self.assertTrue(len(pet_ids_in_recs.intersection({4, 10})) > 0)
-    
-    def test_cold_start_collaborative(self):
-        """Test collaborative recommendations for a new user with no history."""
-        # Train the model
-        self.engine.train_collaborative_model(self.interaction_data)
-        
-        # Get recommendations for a new user
-        recs = self.engine.get_collaborative_recommendations(6, num_recommendations=3)
-        
-        # Should return an empty list for a user with no history
-        self.assertEqual(len(recs), 0)
-
-
-class HybridRecommendationTests(unittest.TestCase):
-    """Test hybrid recommendation system."""
-    
+def create_user(username, profile=True, **preferences):
+    """A user whose profile (created with the user) has preferences, or who has no profile at all"""
+    user = User.objects.create_user(username=username, password='password123')
+    if not profile:
+        UserProfile.objects.filter(user=user).delete()
+    elif preferences:
+        UserProfile.objects.filter(user=user).update(**preferences)
+    return user
+
+
+def create_animal(name, species='Dog', **fields):
+    return Animal.objects.create(name=name, species=species, **{'age_years': 2, 'gender': 'M', **fields})
+
+
+def create_dogs():
+    """Four large, high energy dogs: two Labradors (3 and 7 years), a Beagle and a Poodle"""
+    return [
+        create_animal(f'Dog {i}', 'Dog', breed=breed, age_years=age, size='Large', energy_level='High')
+        for i, (breed, age) in enumerate([('Labrador', 3), ('Beagle', 2), ('Labrador', 7), ('Poodle', 4)])
+    ]
+
+
+def create_cats():
+    """Three small, low energy cats: two Siamese (1 and 3 years) and a Persian"""
+    return [
+        create_animal(f'Cat {i}', 'Cat', breed=breed, age_years=age, gender='F', size='Small', energy_level='Low')
+        for i, (breed, age) in enumerate([('Siamese', 1), ('Persian', 6), ('Siamese', 3)])
+    ]
+
+
+def create_hamster():
+    return create_animal('Hammy', 'Hamster', age_years=1, size='Small')
+
+
+def view(user, animal, minutes_ago=0, duration=30):
+    return AnimalViewHistory.objects.create(
+        user=user, animal=animal, species=animal.species, view_duration=duration,
+        timestamp=timezone.now() - timedelta(minutes=minutes_ago),
+    )
+
+
+class RecommendationTestCase(TestCase):
+    """An isolated artifact directory and an empty recommendation cache for every test"""
+
     def setUp(self):
-        """Set up test data."""
-        # Create a temporary directory for model files
-        self.temp_dir = tempfile.mkdtemp()
-        
-        # Create the recommendation engine
-        self.engine = HybridRecommendationEngine(model_dir=self.temp_dir)
-        
-        # Create sample pet data
-        self.pet_data = pd.DataFrame({
-            'id': range(1, 11),
-            'name': [f'Pet{i}' for i in range(1, 11)],
-            'species': ['Dog', 'Dog', 'Dog', 'Cat', 'Cat', 'Cat', 'Small Animal', 'Small Animal', 'Bird', 'Reptile'],
-            'breed': ['Labrador', 'Labrador', 'Poodle', 'Siamese', 'Siamese', 'Persian', 'Hamster', 'Guinea Pig', 'Canary', 'Gecko'],
-            'age': [2, 3, 5, 1, 2, 4, 1, 2, 1, 3],
-            'gender': ['Male', 'Female', 'Male', 'Female', 'Male', 'Female', 'Male', 'Female', 'Male', 'Female'],
-            'size': ['Large', 'Large', 'Medium', 'Small', 'Small', 'Medium', 'Small', 'Small', 'Small', 'Small'],
-            'energy_level': ['High', 'High', 'Medium', 'Low', 'Medium', 'Low', 'High', 'Medium', 'Medium', 'Low'],
-            'health_status': ['Healthy'] * 10,
-            'behavior_traits': ['Friendly'] * 10,
-            'description': ['A pet description.'] * 10
-        })
-        
-        # Create sample interaction data
-        interactions = []
-        
-        # User 1 interactions (likes dogs)
-        for pet_id in [1, 2, 3]:
-            interactions.append({
-                'user_id': 1,
-                'pet_id': pet_id,
-                'interaction_type': 'view',
-                'timestamp': timezone.now(),
-                'duration': 60
-            })
-        
-        # User 2 interactions (likes cats)
-        for pet_id in [4, 5, 6]:
-            interactions.append({
-                'user_id': 2,
-                'pet_id': pet_id,
-                'interaction_type': 'view',
-                'timestamp': timezone.now(),
-                'duration': 60
-            })
-        
-        self.interaction_data = pd.DataFrame(interactions)
-        
-        # Train both models
-        self.engine.train_content_based_model(self.pet_data)
-        self.engine.train_collaborative_model(self.interaction_data)
-    
+        # Keep published artifacts and cached lists out of the real directories
+        self.artifact_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            RECOMMENDATION_ARTIFACT_DIR=self.artifact_dir, RECOMMENDATION_ARTIFACT_CHECK_INTERVAL=0
+        )
+        self.settings_override.enable()
+        reset_artifact_registry()
+        reset_catalog_snapshot()
+        get_recommendation_cache().clear()
+
     def tearDown(self):
-        """Clean up after tests."""
-        # Remove temporary directory and all files
-        import shutil
-        shutil.rmtree(self.temp_dir)
-    
-    def test_hybrid_recommendations(self):
-        """Test getting hybrid recommendations."""
-        # Mock the _get_user_history and _get_user_adopted_pets methods
-        with mock.patch.object(self.engine, '_get_user_history', return_value=[1, 2, 3]):
-            with mock.patch.object(self.engine, '_get_user_adopted_pets', return_value=[]):
-                # Get recommendations for User 1 (who likes dogs)
-                recs = self.engine.get_hybrid_recommendations(1, num_recommendations=5)
-                
-                # Should return recommendations with scores
-                self.assertGreater(len(recs), 0)
-                self.assertEqual(len(recs[0]), 2)  # (pet_id, score)
-                
-                # Check that returned scores are normalized between 0 and 1
-                for pet_id, score in recs:
-                    self.assertGreaterEqual(score, 0)
-                    self.assertLessEqual(score, 1)
-    
-    def test_personalized_recommendations(self):
-        """Test getting personalized recommendations with preferences."""
-        # Mock internal methods to return specific values
-        with mock.patch.object(self.engine, '_get_user_history', return_value=[1, 2, 3]):
-            with mock.patch.object(self.engine, '_get_user_adopted_pets', return_value=[]):
-                with mock.patch.object(self.engine, '_get_recent_views', return_value=[1, 2]):
-                    with mock.patch.object(self.engine, '_get_user_preferences', return_value={
-                        'preferred_species': 'Dog',
-                        'preferred_age_min': 1,
-                        'preferred_age_max': 5
-                    }):
-                        with mock.patch.object(self.engine, '_get_pet_details', return_value={
-                            'id': 1,
-                            'species': 'Dog',
-                            'breed': 'Labrador',
-                            'age': 2,
-                            'gender': 'Male',
-                            'size': 'Large',
-                            'energy_level': 'High'
-                        }):
-                            # Get personalized recommendations
-                            recs = self.engine.get_recommendations_for_user(1, num_recommendations=3)
-                            
-                            # Should return recommendations with scores and reasons
-                            self.assertGreater(len(recs), 0)
-                            self.assertIn('pet_id', recs[0])
-                            self.assertIn('score', recs[0])
-                            self.assertIn('reason', recs[0])
-
-
-class DjangoModelTests(TestCase):
-    """Test Django models related to recommendations."""
-    
+        self.settings_override.disable()
+        reset_artifact_registry()
+        reset_catalog_snapshot()
+        shutil.rmtree(self.artifact_dir, ignore_errors=True)
+
+
+class RecommendationEngineTests(RecommendationTestCase):
+    """Test cases for the recommendation engine"""
+
     def setUp(self):
-        """Set up test data."""
-        # Create a test shelter
-        self.shelter = Shelter.objects.create(
-            name='Test Shelter',
-            address='123 Test St',
-            phone='1234567890',
-            email='test@example.com'
-        )
-        
-        # Create test pets
-        self.pet1 = Pet.objects.create(
-            name='Buddy',
-            species='Dog',
-            breed='Labrador',
-            age=2,
-            gender='Male',
-            size='Large',
-            energy_level='High',
-            health_status='Healthy',
-            behavior_traits='Friendly, Playful',
-            description='A friendly Labrador who loves to play fetch.',
-            location='Test Location',
-            shelter=self.shelter,
-            available=True,
-            arrival_date=timezone.now().date()
-        )
-        
-        self.pet2 = Pet.objects.create(
-            name='Whiskers',
-            species='Cat',
-            breed='Siamese',
-            age=3,
-            gender='Female',
-            size='Small',
-            energy_level='Medium',
-            health_status='Healthy',
-            behavior_traits='Independent, Calm',
-            description='A calm Siamese cat who likes to be independent.',
-            location='Test Location',
-            shelter=self.shelter,
-            available=True,
-            arrival_date=timezone.now().date()
-        )
-        
-        # Create test users
-        self.user = User.objects.create_user(
-            username='testuser',
-            email='test@example.com',
-            password='testpass'
-        )
-        
-        # Create user preferences
-        self.preferences = UserPreference.objects.create(
-            user=self.user,
-            preferred_species='Dog',
-            preferred_age_min=1,
-            preferred_age_max=5,
-            preferred_size='Large',
-            preferred_energy_level='High'
-        )
-    
-    def test_user_preference_to_dict(self):
-        """Test the to_dict method of UserPreference."""
-        prefs_dict = self.preferences.to_dict()
-        
-        self.assertEqual(prefs_dict['preferred_species'], 'Dog')
-        self.assertEqual(prefs_dict['preferred_age_min'], 1)
-        self.assertEqual(prefs_dict['preferred_age_max'], 5)
-        self.assertEqual(prefs_dict['preferred_size'], 'Large')
-        self.assertEqual(prefs_dict['preferred_energy_level'], 'High')
-    
-    def test_user_view_history(self):
-        """Test creating and retrieving user view history."""
-        # Create a view record
-        view = UserViewHistory.objects.create(
-            user=self.user,
-            pet=self.pet1,
-            view_duration=60,
-            species=self.pet1.species
-        )
-        
-        # Check values
-        self.assertEqual(view.user, self.user)
-        self.assertEqual(view.pet, self.pet1)
-        self.assertEqual(view.species, 'Dog')
-        
-        # Test retrieval
-        user_views = UserViewHistory.objects.filter(user=self.user)
-        self.assertEqual(user_views.count(), 1)
-        self.assertEqual(user_views[0].pet, self.pet1)
-    
-    def test_pet_recommendation(self):
-        """Test creating and retrieving pet recommendations."""
-        # Create a recommendation
-        rec = PetRecommendation.objects.create(
-            user=self.user,
-            pet=self.pet1,
-            score=0.95,
-            reason='Based on your preferences'
+        super().setUp()
+        self.engine = MLRecommendationEngine()
+
+    def test_get_recommendations_without_history(self):
+        """Preferences alone put the preferred species first"""
+        dog_lover = create_user('doglover', preferred_species='Dog')
+        cat_lover = create_user('catlover', preferred_species='Cat')
+        dogs = [create_animal('Rex', 'Dog'), create_animal('Max', 'Dog')]
+        cats = [create_animal('Tom', 'Cat'), create_animal('Kit', 'Cat')]
+
+        self.assertEqual(set(self.engine.get_recommendations(dog_lover.id, limit=2)), {dog.id for dog in dogs})
+        self.assertEqual(set(self.engine.get_recommendations(cat_lover.id, limit=2)), {cat.id for cat in cats})
+
+    def test_recently_viewed_animals_are_excluded(self):
+        user = create_user('doglover', preferred_species='Dog')
+        dogs = [create_animal(f'Dog {i}', 'Dog') for i in range(4)]
+        for minutes_ago, dog in enumerate(dogs[:3]):
+            view(user, dog, minutes_ago=minutes_ago)
+
+        recommendations = self.engine.get_recommendations(user.id, limit=5)
+        for dog in dogs[:3]:
+            self.assertNotIn(dog.id, recommendations)
+        self.assertEqual(recommendations[0], dogs[3].id)
+
+    def test_adopted_animals_are_never_recommended(self):
+        user = create_user('doglover', preferred_species='Dog')
+        adopted = create_animal('Rex', 'Dog', status='AD')
+        create_animal('Max', 'Dog')
+
+        self.assertNotIn(adopted.id, self.engine.get_recommendations(user.id, limit=10))
+
+    def test_popular_fallback_without_profile(self):
+        visitor = create_user('visitor', profile=False)
+        hamster = create_hamster()
+        create_animal('Rex', 'Dog')
+        create_animal('Tom', 'Cat')
+        view(create_user('viewer'), hamster)
+
+        recommendations = self.engine.get_recommendations(visitor.id, limit=3)
+        self.assertEqual(len(recommendations), 3)
+        self.assertEqual(recommendations[0], hamster.id)
+
+    def test_random_fill_ins_are_sampled_from_the_snapshot(self):
+        animals = [create_animal(f'Pet {i}') for i in range(6)]
+        get_catalog_snapshot()
+        # Adopted through another process, the snapshot still lists it
+        Animal.objects.filter(id=animals[0].id).update(status='AD')
+
+        with CaptureQueriesContext(connection) as queries:
+            sampled = self.engine._sample_available_animals(4, exclude_ids=[animals[1].id])
+
+        self.assertEqual(sorted(sampled), [animal.id for animal in animals[2:]])
+        self.assertTrue(all('IN (' in query['sql'] for query in queries.captured_queries))
+
+    def test_content_similarity_is_skipped_until_vectors_are_published(self):
+        user = create_user('doglover', preferred_species='Dog')
+        cat = create_animal('Tom', 'Cat')
+        create_animal('Rex', 'Dog')
+        create_animal('Max', 'Dog')
+        view(user, cat)
+
+        self.assertIsNone(get_content_vectors())
+        self.assertEqual(self.engine._score_by_content_similarity(Animal.objects.all(), [cat.id]), {})
+        self.assertEqual(len(self.engine.get_recommendations(user.id, limit=2)), 2)
+        self.assertIsNone(get_artifact_registry().get(CONTENT_VECTORS_ARTIFACT))
+
+    def test_unknown_user_gets_nothing(self):
+        self.assertEqual(self.engine.get_recommendations(999999, limit=5), [])
+
+    def test_vectorized_scoring_matches_python_scoring(self):
+        dog_lover = create_user('doglover', preferred_species='Dog', preferred_age_min=1, preferred_age_max=5)
+        cat_lover = create_user('catlover', preferred_species='Cat')
+        create_dogs()
+        cats = create_cats()
+        hamster = create_hamster()
+        view(dog_lover, cats[0], minutes_ago=10)
+        view(dog_lover, cats[1], minutes_ago=5)
+        view(dog_lover, hamster, minutes_ago=1)
+
+        python_engine = MLRecommendationEngine(scoring_mode='python')
+        for user in [dog_lover, cat_lover]:
+            vectorized = self.engine.get_recommendations(user.id, limit=8, with_scores=True)
+            python = python_engine.get_recommendations(user.id, limit=8, with_scores=True)
+            self.assertEqual([a for a, _ in vectorized], [a for a, _ in python])
+            np.testing.assert_allclose([s for _, s in vectorized], [s for _, s in python])
+
+    def test_vectorized_scorers_match_python_scorers(self):
+        user = create_user('doglover')
+        dogs = create_dogs()
+        cats = create_cats()
+        create_hamster()
+        create_animal('Rex', 'Dog', good_with_kids=True, good_with_cats=True, energy_level='Medium')
+        for minutes_ago, animal in [(30, dogs[0]), (20, cats[1]), (10, dogs[2])]:
+            view(user, animal, minutes_ago=minutes_ago)
+        taste_profile = UserTasteProfile.objects.get(user=user)
+        profiles = [
+            UserProfile(preferred_species='Dog', preferred_size='Large', preferred_age_min=2, preferred_age_max=3.5),
+            UserProfile(preferred_species='Small Animal', good_with_children=True, good_with_other_pets=True),
+            UserProfile(preferred_energy_level='Low', preferred_age_min=1.5, preferred_age_max=6),
+            UserProfile(),
+        ]
+
+        candidates = Animal.objects.filter(status='A').order_by('id')
+        columns = AnimalColumns.from_queryset(candidates)
+        for profile in profiles:
+            python = self.engine._score_by_preferences(candidates, profile)
+            vectorized = self.engine._score_by_preferences_vectorized(columns, profile)
+            np.testing.assert_allclose(vectorized, [python[animal_id] for animal_id in columns.ids])
+
+        python = self.engine._score_by_view_history(candidates, taste_profile)
+        vectorized = self.engine._score_by_view_history_vectorized(columns, taste_profile)
+        np.testing.assert_allclose(vectorized, [python[animal_id] for animal_id in columns.ids])
+
+    def test_batch_matches_single_user(self):
+        dog_lover = create_user('doglover', preferred_species='Dog', preferred_age_min=1, preferred_age_max=5)
+        cat_lover = create_user('catlover', preferred_species='Cat')
+        dogs = create_dogs()
+        cats = create_cats()
+        view(dog_lover, dogs[0], minutes_ago=10)
+        view(dog_lover, cats[2], minutes_ago=5)
+        view(cat_lover, cats[0], minutes_ago=3)
+
+        user_ids = [dog_lover.id, cat_lover.id]
+        batch = self.engine.get_recommendations_batch(user_ids, limit=6)
+        for user_id in user_ids:
+            self.assertEqual(batch[user_id], self.engine.get_recommendations(user_id, limit=6))
+
+    def test_batch_blocks_and_users_without_profiles(self):
+        visitor = create_user('visitor', profile=False)
+        dog_lover = create_user('doglover', preferred_species='Dog')
+        cat_lover = create_user('catlover', preferred_species='Cat')
+        dogs = create_dogs()
+        cats = create_cats()
+        viewer = create_user('viewer')
+        view(viewer, cats[1], minutes_ago=5)
+        view(viewer, cats[1])
+        view(cat_lover, cats[0])
+
+        user_ids = [visitor.id, dog_lover.id, cat_lover.id, 999999]
+        batch = self.engine.get_recommendations_batch(user_ids, limit=4)
+        self.engine.batch_block_size = 1
+        one_by_one = self.engine.get_recommendations_batch(user_ids, limit=4)
+
+        self.assertEqual(set(batch), {visitor.id, dog_lover.id, cat_lover.id})
+        # Beyond the one viewed animal, the visitor's fallback is random fill-ins
+        self.assertEqual([batch[visitor.id][0], one_by_one[visitor.id][0]], [cats[1].id, cats[1].id])
+        for user in [dog_lover, cat_lover]:
+            self.assertEqual(batch[user.id], one_by_one[user.id])
+        self.assertEqual(set(batch[dog_lover.id]), {dog.id for dog in dogs})
+        self.assertNotIn(cats[0].id, batch[cat_lover.id])
+
+    def test_preference_reasons_follow_the_top_component(self):
+        user = create_user('doglover', preferred_species='Dog')
+        dogs = [create_animal(f'Dog {i}', 'Dog') for i in range(3)]
+        cat = create_animal('Tom', 'Cat')
+
+        reasons = self.engine.get_recommendation_reasons(user.id, [dogs[0], cat])
+        self.assertEqual(reasons[dogs[0].id][0], 'species_preference')
+        self.assertIn('dog', reasons[dogs[0].id][1])
+
+        ranked = self.engine.get_recommendations(user.id, limit=3, with_reasons=True)
+        self.assertEqual({component for _, _, component in ranked}, {'preferences'})
+
+    def test_view_history_reasons_name_what_was_viewed(self):
+        # Without a profile, only the viewed cat scores the other Siamese
+        user = create_user('visitor', profile=False)
+        cats = create_cats()
+        create_dogs()
+        build_content_vectors()
+        view(user, cats[0])
+
+        reason = self.engine.get_recommendation_reason(user.id, cats[2])
+        self.assertEqual(reason, "Similar to cats you've viewed")
+
+        # Components from the ranking, as the view passes them
+        reasons = self.engine.get_recommendation_reasons(
+            user.id, [cats[0], cats[1]], {cats[0].id: 'similarity', cats[1].id: 'history'}
         )
-        
-        # Check values
-        self.assertEqual(rec.user, self.user)
-        self.assertEqual(rec.pet, self.pet1)
-        self.assertEqual(rec.score, 0.95)
-        self.assertEqual(rec.reason, 'Based on your preferences')
-        self.assertFalse(rec.viewed)
-        
-        # Test retrieval
-        user_recs = PetRecommendation.objects.filter(user=self.user)
-        self.assertEqual(user_recs.count(), 1)
-        self.assertEqual(user_recs[0].pet, self.pet1)
-
-
-class RecommendationViewsTests(TestCase):
-    """Test views related to recommendations."""
-    
+        self.assertEqual(reasons[cats[0].id], ('viewed_before', "Similar to animals you've viewed before"))
+        self.assertEqual(reasons[cats[1].id], ('similar_species', "Similar to cats you've viewed"))
+
+
+class ContentVectorsTests(RecommendationTestCase):
+    """TF-IDF content vectors with a vocabulary fit once, offline"""
+
+    def test_same_breed_is_most_similar(self):
+        cats = create_cats()
+        dogs = create_dogs()
+        build_content_vectors()
+
+        scores = MLRecommendationEngine()._score_by_content_similarity(Animal.objects.all(), [cats[0].id])
+
+        self.assertAlmostEqual(scores[cats[0].id], 1.0)
+        self.assertGreater(scores[cats[2].id], scores[cats[1].id])
+        self.assertGreater(scores[cats[1].id], max(scores[dog.id] for dog in dogs))
+
+    def test_new_animals_are_vectorized_with_the_fixed_vocabulary(self):
+        create_cats()
+        vectors = build_content_vectors()
+        vocabulary = dict(vectors.vocabulary)
+        newcomer = create_animal('Newcomer', 'Cat', breed='Siamese', size='Small', energy_level='Low')
+
+        row = vectors.vectors_for([newcomer.id])
+        expected = vectors.transform(AnimalColumns.from_queryset(Animal.objects.filter(id=newcomer.id)).feature_texts())
+
+        self.assertEqual(vectors.vocabulary, vocabulary)
+        self.assertEqual(row.shape, (1, len(vocabulary)))
+        np.testing.assert_allclose(row.toarray(), expected.toarray())
+        self.assertAlmostEqual(float(row.multiply(row).sum()), 1.0)
+
+    def test_published_vectors_are_memory_mapped(self):
+        create_dogs()
+        built = build_content_vectors()
+
+        loaded = get_content_vectors()
+
+        self.assertIsInstance(loaded.animal_ids, np.memmap)
+        # The CSR arrays are read-only views of the mapped file, not copies
+        self.assertFalse(loaded.matrix.data.flags.writeable)
+        np.testing.assert_array_equal(loaded.animal_ids, built.animal_ids)
+        np.testing.assert_allclose(loaded.matrix.toarray(), built.matrix.toarray())
+
+
+class CatalogSnapshotTests(RecommendationTestCase):
+    """The in-memory catalog the vectorized engine scores"""
+
+    def assert_matches_database(self, snapshot):
+        expected = AnimalColumns.from_queryset(Animal.objects.filter(status='A').order_by('id'))
+        columns = snapshot.columns()
+        for field in ['ids', 'species', 'breed', 'size', 'energy_level', 'age',
+                      'good_with_kids', 'good_with_cats', 'good_with_dogs']:
+            np.testing.assert_array_equal(getattr(columns, field), getattr(expected, field), err_msg=field)
+
+    def test_build_matches_queryset_columns(self):
+        create_animal('Rex', 'Dog', breed='Beagle', age_months=7, good_with_kids=True, size='Large')
+        create_animal('Tom', 'Cat', breed='Siamese', energy_level='Low', good_with_dogs=False)
+        self.assert_matches_database(CatalogSnapshot.build())
+
+    def test_patched_on_commit(self):
+        dog = create_animal('Rex', 'Dog')
+        cat = create_animal('Tom', 'Cat', breed='Siamese')
+        hamster = create_hamster()
+        snapshot = get_catalog_snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dog.status = 'AD'
+            dog.save()
+            cat.breed = 'Maine Coon'
+            cat.save()
+            rabbit = create_animal('Bun', 'Rabbit', age_months=3, gender='F', size='Small', good_with_cats=True)
+            hamster.delete()
+
+        patched = get_catalog_snapshot()
+        self.assertIsNot(patched, snapshot)
+        self.assertEqual(len(snapshot), 3)   # The old snapshot is never modified
+        self.assert_matches_database(patched)
+        self.assertEqual(patched.select([rabbit.id, dog.id]).tolist(), patched.rows_for([rabbit.id]).tolist())
+
+    def test_vectorized_engine_runs_without_candidate_queries(self):
+        user = create_user('doglover', preferred_species='Dog')
+        create_animal('Rex', 'Dog')
+        view(user, create_animal('Tom', 'Cat'), minutes_ago=1)
+        engine = MLRecommendationEngine()
+        engine.get_recommendations(user.id, limit=5)   # Builds the snapshot and models
+
+        with CaptureQueriesContext(connection) as queries:
+            engine.get_recommendations(user.id, limit=5)
+        self.assertFalse([q for q in queries.captured_queries if 'good_with_dogs' in q['sql']])
+
+    def test_stale_snapshot_never_returns_unavailable_animals(self):
+        user = create_user('doglover', preferred_species='Dog')
+        dog = create_animal('Rex', 'Dog')
+        create_animal('Tom', 'Cat')
+        create_animal('Kit', 'Cat')
+
+        # Adopted through another process: no signal reaches this snapshot
+        get_catalog_snapshot()
+        Animal.objects.filter(id=dog.id).update(status='AD')
+
+        recommendations = MLRecommendationEngine().get_recommendations(user.id, limit=2)
+        self.assertNotIn(dog.id, recommendations)
+        self.assertEqual(len(recommendations), 2)
+        self.assertNotIn(dog.id, get_catalog_snapshot().ids.tolist())
+
+    def test_published_snapshot_is_memory_mapped(self):
+        create_animal('Rex', 'Dog', breed='Beagle')
+        cat = create_animal('Tom', 'Cat', breed='Siamese')
+        call_command('build_catalog_snapshot', stdout=open(os.devnull, 'w'))
+        published = get_catalog_snapshot()
+        self.assertIsInstance(published.ids, np.memmap)
+        self.assertIsInstance(published.codes['breed'], np.memmap)
+        self.assert_matches_database(published)
+
+        # Local changes go to a private copy, never into the shared file
+        with self.captureOnCommitCallbacks(execute=True):
+            cat.status = 'AD'
+            cat.save()
+        patched = get_catalog_snapshot()
+        self.assertNotIsInstance(patched.ids, np.memmap)
+        self.assertEqual(len(published), 2)
+        self.assert_matches_database(patched)
+
+        # A newer published version replaces the patched copy
+        time.sleep(0.01)
+        publish_catalog_snapshot()
+        self.assertIsInstance(get_catalog_snapshot().ids, np.memmap)
+        self.assert_matches_database(get_catalog_snapshot())
+
+    @override_settings(RECOMMENDATION_CATALOG_MAX_AGE=0)
+    def test_requests_never_republish_a_stale_snapshot(self):
+        dog = create_animal('Rex', 'Dog')
+        create_animal('Tom', 'Cat')
+        publish_catalog_snapshot()
+        stale = get_artifact_store().read_manifest()[CATALOG_ARTIFACT]['version']
+        # Adopted through another process
+        Animal.objects.filter(id=dog.id).update(status='AD')
+
+        self.assertIn(dog.id, get_catalog_snapshot().ids.tolist())
+        self.assertEqual(get_artifact_store().read_manifest()[CATALOG_ARTIFACT]['version'], stale)
+
+        # The next republish reaches every worker through the manifest
+        time.sleep(0.01)
+        call_command('build_catalog_snapshot', stdout=open(os.devnull, 'w'))
+        snapshot = get_catalog_snapshot()
+        self.assertIsInstance(snapshot.ids, np.memmap)
+        self.assert_matches_database(snapshot)
+
+    def test_watch_republishes_until_stopped(self):
+        create_animal('Rex', 'Dog')
+
+        with mock.patch('time.sleep', side_effect=KeyboardInterrupt) as sleep:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('build_catalog_snapshot', watch=True, stdout=open(os.devnull, 'w'))
+
+        self.assertIn(CATALOG_ARTIFACT, get_artifact_store().read_manifest())
+        self.assertLessEqual(sleep.call_args[0][0], settings.RECOMMENDATION_CATALOG_MAX_AGE)
+
+    def test_private_copy_until_a_snapshot_is_published(self):
+        create_animal('Rex', 'Dog')
+
+        snapshot = get_catalog_snapshot()
+
+        self.assertNotIsInstance(snapshot.ids, np.memmap)
+        self.assertIs(get_catalog_snapshot(), snapshot)
+        self.assertEqual(get_artifact_store().read_manifest(), {})
+        self.assert_matches_database(snapshot)
+
+    def test_preload_artifacts(self):
+        create_animal('Rex', 'Dog')
+        create_animal('Tom', 'Cat')
+        vectors = build_content_vectors()
+        reset_artifact_registry()
+        preload_artifacts()
+        self.assertIsInstance(get_catalog_snapshot().ids, np.memmap)
+        np.testing.assert_array_equal(get_content_vectors().animal_ids, vectors.animal_ids)
+
+    @override_settings(RECOMMENDATION_ARTIFACT_CHECK_INTERVAL=3600)
+    def test_preload_publishes_missing_models(self):
+        user = create_user('doglover')
+        dog, cat = create_animal('Rex', 'Dog'), create_animal('Tom', 'Cat')
+        view(user, dog)
+        view(user, cat)
+        reset_artifact_registry()
+
+        preload_artifacts()
+
+        self.assertIsNotNone(get_content_vectors())
+        self.assertIsNotNone(get_artifact_registry().get(COVIEW_ARTIFACT))
+        self.assertEqual(set(get_artifact_store().read_manifest()), {CATALOG_ARTIFACT, CONTENT_VECTORS_ARTIFACT, COVIEW_ARTIFACT})
+
+
+class SqlScoringTests(RecommendationTestCase):
+    """Preference scoring pushed down into one annotated query"""
+
     def setUp(self):
-        """Set up test data."""
-        # Create a test shelter
-        self.shelter = Shelter.objects.create(
-            name='Test Shelter',
-            address='123 Test St',
-            phone='1234567890',
-            email='test@example.com'
-        )
-        
-        # Create test pets
-        self.pet1 = Pet.objects.create(
-            name='Buddy',
-            species='Dog',
-            breed='Labrador',
-            age=2,
-            gender='Male',
-            size='Large',
-            energy_level='High',
-            health_status='Healthy',
-            behavior_traits='Friendly, Playful',
-            description='A friendly Labrador who loves to play fetch.',
-            location='Test Location',
-            shelter=self.shelter,
-            available=True,
-            arrival_date=timezone.now().date()
-        )
-        
-        self.pet2 = Pet.objects.create(
-            name='Whiskers',
-            species='Cat',
-            breed='Siamese',
-            age=3,
-            gender='Female',
-            size='Small',
-            energy_level='Medium',
-            health_status='Healthy',
-            behavior_traits='Independent, Calm',
-            description='A calm Siamese cat who likes to be independent.',
-            location='Test Location',
-            shelter=self.shelter,
-            available=True,
-            arrival_date=timezone.now().date()
-        )
-        
-        # Create test users
-        self.user = User.objects.create_user(
-            username='testuser',
-            email='test@example.com',
-            password='testpass'
-        )
-        
-        # Create user preferences
-        self.preferences = UserPreference.objects.create(
-            user=self.user,
-            preferred_species='Dog',
-            preferred_age_min=1,
-            preferred_age_max=5,
-            preferred_size='Large',
-            preferred_energy_level='High'
-        )
-        
-        # Create a recommendation
-        self.recommendation = PetRecommendation.objects.create(
-            user=self.user,
-            pet=self.pet1,
-            score=0.95,
-            reason='Based on your preferences'
+        super().setUp()
+        self.engine = MLRecommendationEngine(scoring_mode='sql')
+
+    def test_matches_python_scorer(self):
+        create_dogs()
+        create_cats()
+        create_hamster()
+        profiles = [
+            UserProfile(preferred_species='Dog', preferred_size='Large', preferred_age_min=2, preferred_age_max=3.5),
+            UserProfile(preferred_species='Small Animal', good_with_children=True, good_with_other_pets=True),
+            UserProfile(preferred_energy_level='Low', preferred_age_min=1.5, preferred_age_max=6),
+            UserProfile(),
+        ]
+
+        candidates = Animal.objects.filter(status='A')
+        for profile in profiles:
+            python = self.engine._score_by_preferences(candidates, profile)
+            sql = dict(self.engine._annotate_preference_score(candidates, profile).values_list('id', 'preference_score'))
+            self.assertEqual(python, sql)
+
+    def test_ranks_users_without_history_in_the_database(self):
+        user = create_user('doglover', preferred_species='Dog', preferred_age_min=1, preferred_age_max=5)
+        create_dogs()
+        create_cats()
+        vectorized = MLRecommendationEngine(scoring_mode='vectorized')
+
+        recommendations = self.engine.get_recommendations(user.id, limit=5, with_scores=True)
+
+        self.assertEqual(recommendations[:4], sorted(recommendations[:4], key=lambda pair: (-pair[1], pair[0])))
+        self.assertEqual(
+            sorted(score for _, score in recommendations),
+            sorted(score for _, score in vectorized.get_recommendations(user.id, limit=5, with_scores=True)),
         )
-        
-        # Login the user
-        self.client.login(username='testuser', password='testpass')
-    
-    def test_get_user_recommendations(self):
-        """Test the get_user_recommendations helper function."""
-        with mock.patch('pets.views.generate_recommendations') as mock_generate:
-            # Mock the generate_recommendations function to return a list of recommendations
-            mock_recommendations = [self.recommendation]
-            mock_generate.return_value = mock_recommendations
-            
-            # Call the get_user_recommendations function
-            recommendations = get_user_recommendations(self.user.id)
-            
-            # Check that it returns the mocked recommendations
-            self.assertEqual(recommendations, mock_recommendations)
-            
-            # Verify that generate_recommendations was not called (since we have recent recommendations)
-            mock_generate.assert_not_called()
-            
-            # Delete the recommendation and create an old one (older than 24 hours)
-            self.recommendation.delete()
-            old_date = timezone.now() - timedelta(hours=25)
-            old_recommendation = PetRecommendation.objects.create(
-                user=self.user,
-                pet=self.pet1,
-                score=0.95,
-                reason='Based on your preferences',
-                created_at=old_date
-            )
-            
-            # Call the get_user_recommendations function again
-            recommendations = get_user_recommendations(self.user.id)
-            
-            # This time generate_recommendations should be called
-            mock_generate.assert_called_once_with(self.user.id, 10)
-    
-    def test_log_pet_view(self):
-        """Test the log_pet_view helper function."""
-        # Count initial views
-        initial_count = UserViewHistory.objects.filter(user=self.user, pet=self.pet1).count()
-        
-        # Log a view
-        log_pet_view(self.user.id, self.pet1.id, 60)
-        
-        # Count views after logging
-        after_count = UserViewHistory.objects.filter(user=self.user, pet=self.pet1).count()
-        
-        # Should have created a new view record
-        self.assertEqual(after_count, initial_count + 1)
-        
-        # Check the view record
-        view = UserViewHistory.objects.filter(user=self.user, pet=self.pet1).latest('timestamp')
-        self.assertEqual(view.view_duration, 60)
-        self.assertEqual(view.species, self.pet1.species)
-        
-        # Create a recommendation for the pet
-        recommendation = PetRecommendation.objects.create(
-            user=self.user,
-            pet=self.pet1,
-            score=0.95,
-            reason='Based on your preferences',
-            viewed=False
+
+    def test_users_with_history_fall_back_to_vectorized(self):
+        user = create_user('doglover', preferred_species='Dog')
+        create_dogs()
+        cats = create_cats()
+        view(user, cats[0], minutes_ago=1)
+        view(user, cats[1])
+
+        self.assertFalse(self.engine._preferences_only(user.id, UserProfile.objects.get(user=user), [cats[1].id]))
+        self.assertEqual(
+            self.engine.get_recommendations(user.id, limit=5, with_scores=True),
+            MLRecommendationEngine().get_recommendations(user.id, limit=5, with_scores=True),
         )
-        
-        # Log another view
-        log_pet_view(self.user.id, self.pet1.id, 30)
-        
-        # Check that the recommendation was marked as viewed
-        recommendation.refresh_from_db()
-        self.assertTrue(recommendation.viewed)
-
-
-class RecommendationSystemIntegrationTest(TestCase):
-    """Integration test for the recommendation system."""
-    
+
+
+class TwoStageRetrievalTests(RecommendationTestCase):
+    """Indexed candidate retrieval followed by the full re-ranking"""
+
     def setUp(self):
-        """Set up test data."""
-        # Create a test shelter
-        self.shelter = Shelter.objects.create(
-            name='Test Shelter',
-            address='123 Test St',
-            phone='1234567890',
-            email='test@example.com'
-        )
-        
-        # Create test pets (6 dogs, 4 cats)
-        self.dogs = []
-        self.cats = []
-        
-        for i in range(6):
-            dog = Pet.objects.create(
-                name=f'Dog{i+1}',
-                species='Dog',
-                breed='Mix',
-                age=i+1,
-                gender='Male' if i % 2 == 0 else 'Female',
-                size='Medium',
-                energy_level='Medium',
-                health_status='Healthy',
-                behavior_traits='Friendly',
-                description='A friendly dog.',
-                location='Test Location',
-                shelter=self.shelter,
-                available=True,
-                arrival_date=timezone.now().date()
-            )
-            self.dogs.append(dog)
-        
-        for i in range(4):
-            cat = Pet.objects.create(
-                name=f'Cat{i+1}',
-                species='Cat',
-                breed='Mix',
-                age=i+1,
-                gender='Male' if i % 2 == 0 else 'Female',
-                size='Small',
-                energy_level='Low',
-                health_status='Healthy',
-                behavior_traits='Independent',
-                description='A calm cat.',
-                location='Test Location',
-                shelter=self.shelter,
-                available=True,
-                arrival_date=timezone.now().date()
-            )
-            self.cats.append(cat)
-        
-        # Create test users
-        self.dog_lover = User.objects.create_user(
-            username='doglover',
-            email='dog@example.com',
-            password='testpass'
-        )
-        
-        self.cat_lover = User.objects.create_user(
-            username='catlover',
-            email='cat@example.com',
-            password='testpass'
-        )
-        
-        self.undecided = User.objects.create_user(
-            username='undecided',
-            email='undecided@example.com',
-            password='testpass'
-        )
-        
-        # Create user preferences
-        UserPreference.objects.create(
-            user=self.dog_lover,
-            preferred_species='Dog',
-            preferred_age_min=1,
-            preferred_age_max=5,
-            preferred_size='Medium',
-            preferred_energy_level='Medium'
-        )
-        
-        UserPreference.objects.create(
-            user=self.cat_lover,
-            preferred_species='Cat',
-            preferred_age_min=1,
-            preferred_age_max=5,
-            preferred_size='Small',
-            preferred_energy_level='Low'
-        )
-        
-        # No preferences for undecided user
-        
-        # Create view history for users
-        # Dog lover views mostly dogs
-        for i in range(4):
-            UserViewHistory.objects.create(
-                user=self.dog_lover,
-                pet=self.dogs[i],
-                species='Dog',
-                view_duration=60
-            )
-        
-        # But also one cat
-        UserViewHistory.objects.create(
-            user=self.dog_lover,
-            pet=self.cats[0],
-            species='Cat',
-            view_duration=30
-        )
-        
-        # Cat lover views only cats
-        for i in range(3):
-            UserViewHistory.objects.create(
-                user=self.cat_lover,
-                pet=self.cats[i],
-                species='Cat',
-                view_duration=60
-            )
-        
-        # Undecided user views both
-        UserViewHistory.objects.create(
-            user=self.undecided,
-            pet=self.dogs[0],
-            species='Dog',
-            view_duration=60
+        super().setUp()
+        self.engine = MLRecommendationEngine(retrieval_mode='two_stage')
+        self.profile = UserProfile(preferred_species='Dog', preferred_age_min=1, preferred_age_max=5)
+
+    def test_matches_full_ranking_when_pool_covers_matches(self):
+        user = create_user('doglover', preferred_species='Dog', preferred_age_min=1, preferred_age_max=5)
+        create_dogs()
+        create_cats()
+
+        two_stage = self.engine.get_recommendations(user.id, limit=3, with_scores=True)
+        full = MLRecommendationEngine(retrieval_mode='full').get_recommendations(user.id, limit=3, with_scores=True)
+
+        # Ties may come back in a different order
+        self.assertEqual(sorted(two_stage), sorted(full))
+
+    def test_pool_is_bounded(self):
+        dogs = create_dogs()
+        create_cats()
+        self.engine.candidate_pool_size = 2
+
+        candidate_ids = self.engine._retrieve_candidates(self.profile, None, [])
+
+        self.assertEqual(len(candidate_ids), 2)
+        self.assertTrue(set(candidate_ids) <= {dog.id for dog in dogs})
+
+    def test_compatibility_is_a_hard_constraint(self):
+        self.profile.good_with_children = True
+        unsuitable = create_animal('Rex', 'Dog', good_with_kids=False)
+        suitable = create_animal('Max', 'Dog')
+        view(create_user('viewer'), unsuitable)
+
+        candidate_ids = self.engine._retrieve_candidates(self.profile, None, [])
+
+        self.assertNotIn(unsuitable.id, candidate_ids)
+        self.assertIn(suitable.id, candidate_ids)
+
+    def test_neighbors_and_popular_animals_join_the_pool(self):
+        cats = create_cats()
+        hamster = create_hamster()
+        build_content_vectors()
+        build_similar_animals(n_neighbors=1)
+        view(create_user('viewer'), hamster)
+
+        candidate_ids = self.engine._retrieve_candidates(self.profile, None, [cats[0].id])
+
+        self.assertIn(cats[2].id, candidate_ids)
+        self.assertIn(hamster.id, candidate_ids)
+        self.assertNotIn(cats[1].id, candidate_ids)
+
+
+class TasteProfileTests(RecommendationTestCase):
+    """The incrementally maintained taste profile matches a full rebuild"""
+
+    def test_incremental_profile_matches_rebuild(self):
+        user = create_user('doglover')
+        labrador = create_animal('Rex', 'Dog', breed='Labrador', size='Large')
+        beagle = create_animal('Max', 'Dog', breed='Beagle', good_with_kids=True)
+        persian = create_animal('Tom', 'Cat', breed='Persian', size='Small', energy_level='Low')
+        for minutes_ago, animal in [(300, labrador), (200, persian), (100, beagle), (5, labrador)]:
+            view(user, animal, minutes_ago=minutes_ago)
+
+        incremental = UserTasteProfile.objects.get(user=user)
+        rebuilt = UserTasteProfile.rebuild_for_user(user)
+
+        self.assertEqual(incremental.view_count, 4)
+        self.assertEqual(rebuilt.view_count, 4)
+        for field in ['species_counts', 'breed_counts', 'size_counts', 'feature_counts']:
+            incremental_counts, rebuilt_counts = getattr(incremental, field), getattr(rebuilt, field)
+            self.assertEqual(set(incremental_counts), set(rebuilt_counts))
+            for key, value in incremental_counts.items():
+                self.assertAlmostEqual(value, rebuilt_counts[key])
+
+    def test_recent_views_outweigh_older_ones(self):
+        user = create_user('doglover')
+        dog, cat = create_animal('Rex', 'Dog'), create_animal('Tom', 'Cat')
+        view(user, dog, minutes_ago=10 * 24 * 60)
+        view(user, cat)
+
+        species_counts = UserTasteProfile.objects.get(user=user).normalized_counts()[0]
+
+        decayed = UserTasteProfile.DAILY_DECAY ** 10
+        self.assertAlmostEqual(species_counts['Dog'], decayed / (1 + decayed), places=5)
+        self.assertAlmostEqual(species_counts['Cat'], 1 / (1 + decayed), places=5)
+
+    def test_rebuild_command_recreates_viewer_profiles(self):
+        viewer, lurker = create_user('viewer'), create_user('lurker')
+        dogs = create_dogs()
+        view(viewer, dogs[0], minutes_ago=60)
+        view(viewer, dogs[1])
+        UserTasteProfile.objects.all().delete()
+
+        call_command('rebuild_taste_profiles', stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(UserTasteProfile.objects.get(user=viewer).view_count, 2)
+        self.assertFalse(UserTasteProfile.objects.filter(user=lurker).exists())
+
+
+class RecommendationCacheTests(RecommendationTestCase):
+    """Cached lists are served until something that changes them happens"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('doglover', preferred_species='Dog')
+        self.dog = create_animal('Rex', 'Dog')
+        self.cat = create_animal('Tom', 'Cat')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_get_recommendations(self):
+        response = self.client.get('/api/recommendations/')
+
+        self.assertEqual(response.status_code, 200)
+        first = response.data['recommendations'][0]
+        self.assertEqual(first['id'], self.dog.id)
+        self.assertEqual(first['reason_code'], 'species_preference')
+        self.assertIsNotNone(get_cached_recommendations(self.user.id, 10))
+
+    def test_view_invalidates_cached_list(self):
+        self.client.get('/api/recommendations/')
+        view(self.user, self.cat)
+        self.assertIsNone(get_cached_recommendations(self.user.id, 10))
+
+    def test_adoption_invalidates_cached_list(self):
+        self.client.get('/api/recommendations/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dog.status = 'AD'
+            self.dog.save()
+        self.assertIsNone(get_cached_recommendations(self.user.id, 10))
+
+    def test_unrelated_adoption_keeps_cached_list(self):
+        self.client.get('/api/recommendations/')
+        with self.captureOnCommitCallbacks(execute=True):
+            newcomer = create_animal('Newcomer', 'Dog')
+            newcomer.status = 'AD'
+            newcomer.save()
+        self.assertIsNotNone(get_cached_recommendations(self.user.id, 10))
+
+    def test_cache_hit_skips_ranking(self):
+        self.client.get('/api/recommendations/')
+
+        with mock.patch.object(MLRecommendationEngine, 'get_recommendations') as get_recommendations:
+            response = self.client.get('/api/recommendations/')
+
+        get_recommendations.assert_not_called()
+        self.assertEqual(response.data['recommendations'][0]['id'], self.dog.id)
+
+    def test_profile_change_invalidates_cached_list(self):
+        self.client.get('/api/recommendations/')
+        profile = UserProfile.objects.get(user=self.user)
+        profile.preferred_species = 'Cat'
+        profile.save()
+
+        self.assertIsNone(get_cached_recommendations(self.user.id, 10))
+        self.assertEqual(self.client.get('/api/recommendations/').data['recommendations'][0]['id'], self.cat.id)
+
+    def test_lists_are_cached_per_limit(self):
+        cache_recommendations(self.user.id, 5, [(self.dog.id, 1.0, 'preferences')])
+
+        self.assertIsNone(get_cached_recommendations(self.user.id, 10))
+        self.assertEqual(get_cached_recommendations(self.user.id, 5), [(self.dog.id, 1.0, 'preferences')])
+
+    def test_cache_hit_skips_adopted_animals(self):
+        self.client.get('/api/recommendations/')
+        # Adopted but not yet invalidated, the transaction hasn't committed
+        self.dog.status = 'AD'
+        self.dog.save()
+
+        response = self.client.get('/api/recommendations/')
+
+        returned = [animal['id'] for animal in response.data['recommendations']]
+        self.assertNotIn(self.dog.id, returned)
+
+    def test_record_view(self):
+        response = self.client.post('/api/recommendations/record-view/', {'animal_id': self.cat.id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(AnimalViewHistory.objects.filter(user=self.user, animal=self.cat).exists())
+        self.assertEqual(UserTasteProfile.objects.get(user=self.user).view_count, 1)
+
+
+class RecommendationViewTests(RecommendationTestCase):
+    """The recommendations endpoint assembles its response in a fixed number of queries"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('doglover', preferred_species='Dog')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_response_is_assembled_in_bulk(self):
+        dogs = [create_animal(f'Dog {i}', 'Dog', breed='Labrador') for i in range(12)]
+        view(self.user, create_animal('Tom', 'Cat'), minutes_ago=10)
+        view(self.user, dogs[0])
+        get_catalog_snapshot()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recommendations/')
+
+        self.assertEqual(len(response.data['recommendations']), 10)
+        # Leaving out the cache's own queries, nothing runs once per recommended animal
+        queries = [query['sql'] for query in queries.captured_queries
+                   if 'recommendation_cache' not in query['sql'] and 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len([sql for sql in queries if '"animals_animal"."name"' in sql]), 1)
+        self.assertLessEqual(len(queries), 8)
+
+    def test_every_animal_gets_a_reason(self):
+        dogs = create_dogs()
+        create_cats()
+        build_content_vectors()
+        view(self.user, dogs[1], minutes_ago=10)
+        view(self.user, dogs[0])
+
+        recommendations = self.client.get('/api/recommendations/').data['recommendations']
+
+        self.assertEqual(len(recommendations), 5)
+        for animal in recommendations:
+            self.assertTrue(animal['reason_code'])
+            self.assertTrue(animal['recommendation_reason'])
+
+
+class SimilarAnimalsTests(RecommendationTestCase):
+    """Precomputed neighbor lists and the similar animals endpoint"""
+
+    def test_neighbors_share_attributes(self):
+        dogs = create_dogs()
+        create_cats()
+        build_content_vectors()
+
+        build_similar_animals(n_neighbors=3)
+
+        similar = SimilarAnimals.objects.get(animal=dogs[0])
+        self.assertEqual(similar.neighbor_ids[0], dogs[2].id)
+        self.assertNotIn(dogs[0].id, similar.neighbor_ids)
+        self.assertEqual(similar.scores, sorted(similar.scores, reverse=True))
+
+    def test_endpoint_serves_available_neighbors(self):
+        dogs = create_dogs()
+        create_cats()
+        build_content_vectors()
+        build_similar_animals(n_neighbors=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            dogs[2].status = 'AD'
+            dogs[2].save()
+
+        response = APIClient().get(f'/api/animals/{dogs[0].id}/similar/')
+
+        self.assertEqual(response.status_code, 200)
+        returned = [animal['id'] for animal in response.data['similar']]
+        self.assertNotIn(dogs[2].id, returned)
+        self.assertTrue(all(animal['species'] == 'Dog' for animal in response.data['similar']))
+
+    def test_block_size_does_not_change_the_lists(self):
+        create_dogs()
+        create_cats()
+        create_hamster()
+        build_content_vectors()
+
+        build_similar_animals(n_neighbors=3, block_size=2)
+        blocked = {similar.animal_id: similar.neighbor_ids for similar in SimilarAnimals.objects.all()}
+        build_similar_animals(n_neighbors=3)
+
+        self.assertEqual(blocked, {similar.animal_id: similar.neighbor_ids for similar in SimilarAnimals.objects.all()})
+
+    def test_endpoint_limit(self):
+        dogs = create_dogs()
+        build_content_vectors()
+        build_similar_animals(n_neighbors=3)
+
+        response = APIClient().get(f'/api/animals/{dogs[0].id}/similar/', {'limit': 1})
+        self.assertEqual([animal['id'] for animal in response.data['similar']], [dogs[2].id])
+        self.assertEqual(APIClient().get(f'/api/animals/{dogs[0].id}/similar/', {'limit': 'all'}).status_code, 400)
+
+    def test_pending_command_drains_the_queue(self):
+        dogs = create_dogs()
+        build_content_vectors()
+        build_similar_animals(n_neighbors=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            newcomer = create_animal('Newcomer', 'Dog', breed='Poodle', age_years=4, size='Large', energy_level='High')
+
+        call_command('build_similar_animals', neighbors=3, pending=True, stdout=open(os.devnull, 'w'))
+
+        self.assertFalse(SimilarAnimalsRefresh.objects.exists())
+        self.assertEqual(SimilarAnimals.objects.get(animal=newcomer).neighbor_ids[0], dogs[3].id)
+        self.assertEqual(SimilarAnimals.objects.get(animal=dogs[3]).neighbor_ids[0], newcomer.id)
+
+    def test_new_animal_joins_neighbor_lists(self):
+        dogs = create_dogs()
+        build_content_vectors()
+        build_similar_animals(n_neighbors=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            twin = create_animal('Twin', 'Dog', breed='Labrador', age_years=3, gender='F',
+                                 size='Large', energy_level='High')
+        self.assertFalse(SimilarAnimals.objects.filter(animal=twin).exists())   # Saving only queues it
+
+        self.assertGreater(refresh_similar_animals(n_neighbors=3), 0)
+
+        self.assertEqual(SimilarAnimals.objects.get(animal=twin).neighbor_ids[0], dogs[0].id)
+        self.assertIn(twin.id, SimilarAnimals.objects.get(animal=dogs[0]).neighbor_ids)
+        self.assertFalse(SimilarAnimalsRefresh.objects.exists())
+
+    def test_removed_neighbors_are_back_filled(self):
+        dogs = create_dogs()
+        create_cats()
+        build_content_vectors()
+        build_similar_animals(n_neighbors=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            dogs[2].status = 'AD'
+            dogs[2].save()
+            dogs[3].delete()
+
+        refresh_similar_animals(n_neighbors=3)
+
+        neighbor_ids = SimilarAnimals.objects.get(animal=dogs[0]).neighbor_ids
+        self.assertEqual(len(neighbor_ids), 3)
+        self.assertFalse({dogs[2].id, dogs[3].id} & set(neighbor_ids))
+        self.assertFalse(SimilarAnimals.objects.filter(animal=dogs[2]).exists())
+
+    def test_endpoint_never_writes(self):
+        dog = create_animal('Rex', 'Dog')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(f'/api/animals/{dog.id}/similar/')
+
+        self.assertEqual(response.data['similar'], [])
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries.captured_queries))
+
+    def test_unknown_animal(self):
+        self.assertEqual(APIClient().get('/api/animals/999999/similar/').status_code, 404)
+
+
+class CoviewModelTests(RecommendationTestCase):
+    """Item-item co-view model"""
+
+    def test_coviewed_animals_are_similar(self):
+        users = [create_user('first'), create_user('second')]
+        dog, cat, hamster, unseen = [create_animal(name) for name in ['Rex', 'Tom', 'Hammy', 'Max']]
+        for user in users:
+            view(user, dog)
+            view(user, cat)
+        view(users[1], hamster)
+
+        model = CoviewModel.build()
+        scores = model.score_users([[dog.id]], [cat.id, hamster.id, unseen.id])[0]
+
+        self.assertAlmostEqual(scores[0], 1.0)
+        self.assertTrue(0 < scores[1] < scores[0])
+        self.assertEqual(scores[2], 0)
+
+    def test_stage_is_skipped_until_a_model_is_published(self):
+        users = [create_user('first'), create_user('second')]
+        dog, cat = create_animal('Rex', 'Dog'), create_animal('Tom', 'Cat')
+        view(users[0], dog)
+        view(users[1], dog)
+        view(users[1], cat)
+        engine = MLRecommendationEngine()
+
+        self.assertEqual(engine._score_by_coview(Animal.objects.all(), [dog.id]), {})
+        self.assertIsNone(get_artifact_registry().get(COVIEW_ARTIFACT))
+
+        call_command('build_coview_model', stdout=open(os.devnull, 'w'))
+        self.assertGreater(engine._score_by_coview(Animal.objects.all(), [dog.id])[cat.id], 0)
+
+    def test_incremental_update_matches_full_build(self):
+        users = [create_user('first'), create_user('second')]
+        dog, cat, hamster = [create_animal(name) for name in ['Rex', 'Tom', 'Hammy']]
+        view(users[0], dog)
+        view(users[0], cat)
+        model = CoviewModel.build(block_size=1)
+
+        view(users[0], hamster)
+        view(users[1], cat)
+        view(users[1], hamster)
+        self.assertEqual(model.update(block_size=1), 3)
+
+        rebuilt = CoviewModel.build()
+        np.testing.assert_array_equal(model.animal_ids, rebuilt.animal_ids)
+        np.testing.assert_allclose(model.cooccurrence.toarray(), rebuilt.cooccurrence.toarray())
+        np.testing.assert_allclose(model.similarity.toarray(), rebuilt.similarity.toarray())
+
+
+    def test_rows_keep_only_the_strongest_neighbors(self):
+        users = [create_user(f'user{i}') for i in range(3)]
+        animals = [create_animal(f'Pet {i}') for i in range(4)]
+        for user in users:
+            view(user, animals[0])
+            view(user, animals[1])
+        view(users[0], animals[2])
+        view(users[0], animals[3])
+        view(users[1], animals[2])
+
+        model = CoviewModel.build(neighbors=2)
+
+        self.assertTrue((np.diff(model.similarity.indptr) <= 2).all())
+        self.assertEqual(sorted(model.neighbors_of([animals[0].id])), [animals[1].id, animals[2].id])
+
+    def test_update_command_publishes_only_when_there_are_new_views(self):
+        users = [create_user('first'), create_user('second')]
+        dog, cat = create_animal('Rex', 'Dog'), create_animal('Tom', 'Cat')
+        view(users[0], dog)
+        view(users[0], cat)
+        store = get_artifact_store()
+        call_command('build_coview_model', stdout=open(os.devnull, 'w'))
+        built = store.read_manifest()[COVIEW_ARTIFACT]['version']
+
+        call_command('build_coview_model', update=True, stdout=open(os.devnull, 'w'))
+        self.assertEqual(store.read_manifest()[COVIEW_ARTIFACT]['version'], built)
+
+        latest = view(users[1], cat)
+        time.sleep(0.01)
+        call_command('build_coview_model', update=True, stdout=open(os.devnull, 'w'))
+        self.assertNotEqual(store.read_manifest()[COVIEW_ARTIFACT]['version'], built)
+        self.assertEqual(get_coview_model().watermark, latest.id)
+
+
+class FactorModelTests(RecommendationTestCase):
+    """Implicit ALS trainer and the factor scoring stage"""
+
+    def test_observed_pairs_score_higher(self):
+        dog_lover, cat_lover = create_user('doglover'), create_user('catlover')
+        hamster = create_hamster()
+        for user in [dog_lover, cat_lover]:
+            view(user, hamster, duration=120)
+        for dog in create_dogs():
+            view(dog_lover, dog)
+        for cat in create_cats():
+            view(cat_lover, cat)
+
+        user_ids, animal_ids, matrix = load_interactions()
+        user_factors, item_factors = ImplicitALS(factors=4, iterations=10, workers=2, block_size=1).fit(matrix)
+        model = FactorModel(user_ids, animal_ids, user_factors, item_factors)
+        scores, known = model.score_users([dog_lover.id, 999999], animal_ids)
+
+        self.assertEqual(known.tolist(), [True, False])
+        observed = matrix.toarray()[list(user_ids).index(dog_lover.id)] > 0
+        self.assertGreater(scores[0][observed].min(), scores[0][~observed].max())
+
+    def test_training_publishes_a_loadable_version(self):
+        dog_lover, cat_lover = create_user('doglover', preferred_species='Dog'), create_user('catlover')
+        dog, cat = create_animal('Rex', 'Dog'), create_animal('Tom', 'Cat')
+        view(dog_lover, dog)
+        view(cat_lover, cat)
+        self.assertIsNone(get_factor_model())
+
+        model, interactions = train_factor_model(factors=4, iterations=2)
+
+        self.assertEqual(interactions, 2)
+        self.assertEqual(get_factor_model().version, model.version)
+        self.assertEqual(
+            MLRecommendationEngine().get_recommendations_batch([dog_lover.id], limit=5)[dog_lover.id],
+            MLRecommendationEngine().get_recommendations(dog_lover.id, limit=5),
         )
-        
-        UserViewHistory.objects.create(
-            user=self.undecided,
-            pet=self.cats[0],
-            species='Cat',
-            view_duration=60
+
+
+    def test_interaction_strengths(self):
+        user = create_user('doglover')
+        dog, cat = create_animal('Rex', 'Dog'), create_animal('Tom', 'Cat')
+        view(user, dog, duration=0)
+        view(user, dog, minutes_ago=30 * 24 * 60, duration=0)
+        view(user, cat, duration=60)
+
+        user_ids, animal_ids, matrix = load_interactions(half_life_days=30)
+
+        self.assertEqual(user_ids.tolist(), [user.id])
+        self.assertEqual(animal_ids.tolist(), [dog.id, cat.id])
+        # Repeat views add up, each halved per half-life it is old
+        np.testing.assert_allclose(matrix.toarray()[0], [1.5, 1 + np.log1p(60)], rtol=1e-5)
+
+    def test_command_writes_into_an_output_directory(self):
+        user = create_user('doglover')
+        view(user, create_animal('Rex', 'Dog'))
+        output = os.path.join(self.artifact_dir, 'factors')
+
+        call_command('train_recommendation_model', output=output, factors=2, iterations=1, workers=1,
+                     stdout=open(os.devnull, 'w'))
+
+        model = FactorModel.load(output)
+        self.assertEqual(model.user_ids.tolist(), [user.id])
+        self.assertEqual(model.user_factors.shape, (1, 2))
+        self.assertIsNone(get_factor_model())
+
+
+class ArtifactStoreTests(RecommendationTestCase):
+    """Versioned artifact publishing and in-process hot swaps"""
+
+    def publish_text(self, store, text):
+        def write(directory):
+            with open(os.path.join(directory, 'value.txt'), 'w') as f:
+                f.write(text)
+        return store.publish('example', write)
+
+    def test_workers_swap_to_new_versions(self):
+        store = ArtifactStore(self.artifact_dir, keep_versions=2)
+        registry = ArtifactRegistry(store, check_interval=0)
+        registry.register('example', lambda directory: open(os.path.join(directory, 'value.txt')).read())
+
+        self.assertIsNone(registry.get('example'))
+        self.publish_text(store, 'first')
+        self.assertEqual(registry.get('example'), 'first')
+        self.publish_text(store, 'second')
+        self.assertEqual(registry.get('example'), 'second')
+
+    def test_old_versions_are_collected(self):
+        store = ArtifactStore(self.artifact_dir, keep_versions=2)
+        versions = [self.publish_text(store, str(i)) for i in range(4)]
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.artifact_dir, 'example'))), versions[-2:])
+        self.assertEqual(store.read_manifest()['example']['version'], versions[-1])
+
+    def test_checks_are_throttled(self):
+        store = ArtifactStore(self.artifact_dir)
+        registry = ArtifactRegistry(store, check_interval=3600)
+        registry.register('example', lambda directory: open(os.path.join(directory, 'value.txt')).read())
+
+        self.publish_text(store, 'first')
+        self.assertEqual(registry.get('example'), 'first')
+        self.publish_text(store, 'second')
+        self.assertEqual(registry.get('example'), 'first')
+
+
+    def test_failed_build_keeps_the_current_version(self):
+        store = ArtifactStore(self.artifact_dir)
+        current = self.publish_text(store, 'first')
+
+        def write(directory):
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            store.publish('example', write)
+        self.assertEqual(store.read_manifest()['example']['version'], current)
+        self.assertEqual(os.listdir(os.path.join(self.artifact_dir, 'example')), [current])
+
+    def test_unloadable_version_keeps_the_old_object(self):
+        store = ArtifactStore(self.artifact_dir)
+        registry = ArtifactRegistry(store, check_interval=0)
+
+        def load(directory):
+            value = open(os.path.join(directory, 'value.txt')).read()
+            if value == 'corrupt':
+                raise ValueError("unreadable artifact")
+            return value
+
+        registry.register('example', load)
+        self.publish_text(store, 'first')
+        self.assertEqual(registry.get('example'), 'first')
+        time.sleep(0.01)
+        self.publish_text(store, 'corrupt')
+        self.assertEqual(registry.get('example'), 'first')
+
+    def test_override_restores_the_published_versions(self):
+        store = ArtifactStore(self.artifact_dir)
+        registry = ArtifactRegistry(store, check_interval=0)
+        registry.register('example', lambda directory: open(os.path.join(directory, 'value.txt')).read())
+        self.publish_text(store, 'published')
+
+        with registry.override(example='evaluation'):
+            self.assertEqual(registry.get('example'), 'evaluation')
+        self.assertEqual(registry.get('example'), 'published')
+
+
+class UpdateRecommendationsCommandTests(RecommendationTestCase):
+    """The bulk recompute stores every user's top list"""
+
+    def test_update_all_users(self):
+        users = [create_user('doglover', preferred_species='Dog'), create_user('catlover', preferred_species='Cat')]
+        dog = create_animal('Rex', 'Dog')
+        for name in ['Tom', 'Kit', 'Max']:
+            create_animal(name, 'Cat')
+        view(users[1], dog)
+
+        call_command('update_recommendations', limit=3, batch_size=1,
+                     checkpoint=os.path.join(self.artifact_dir, 'checkpoint.json'), stdout=open(os.devnull, 'w'))
+
+        for user in users:
+            stored = list(AnimalRecommendation.objects.filter(user=user).order_by('-score').values_list('animal_id', flat=True))
+            self.assertEqual(stored, MLRecommendationEngine().get_recommendations(user.id, limit=3))
+        self.assertFalse(os.path.exists(os.path.join(self.artifact_dir, 'checkpoint.json')))
+
+
+    def write_checkpoint(self, path, **checkpoint):
+        with open(path, 'w') as f:
+            json.dump(checkpoint, f)
+
+    def test_resumes_from_checkpoint(self):
+        done, pending = create_user('done', preferred_species='Dog'), create_user('pending', preferred_species='Dog')
+        create_dogs()
+        checkpoint = os.path.join(self.artifact_dir, 'checkpoint.json')
+        self.write_checkpoint(checkpoint, limit=3, shards=[[done.id, done.id], [pending.id, pending.id]],
+                              completed=[[done.id, done.id]])
+        # Signed up after the interrupted run started
+        newcomer = create_user('newcomer', preferred_species='Dog')
+
+        call_command('update_recommendations', limit=3, batch_size=1, checkpoint=checkpoint,
+                     stdout=open(os.devnull, 'w'))
+
+        self.assertFalse(AnimalRecommendation.objects.filter(user=done).exists())
+        self.assertEqual(AnimalRecommendation.objects.filter(user=pending).count(), 3)
+        self.assertEqual(AnimalRecommendation.objects.filter(user=newcomer).count(), 3)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpoint_with_another_limit_starts_over(self):
+        user = create_user('doglover', preferred_species='Dog')
+        create_dogs()
+        checkpoint = os.path.join(self.artifact_dir, 'checkpoint.json')
+        self.write_checkpoint(checkpoint, limit=5, shards=[[user.id, user.id]], completed=[[user.id, user.id]])
+
+        call_command('update_recommendations', limit=3, checkpoint=checkpoint, stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(AnimalRecommendation.objects.filter(user=user).count(), 3)
+
+
+class EvaluationTests(RecommendationTestCase):
+    """Offline evaluation on a chronological split"""
+
+    def test_split_metrics_and_rollback(self):
+        create_synthetic_data(60, 15, views_per_user=10, seed=1)
+        views_before = AnimalViewHistory.objects.count()
+
+        results = evaluate_chronological_split(MLRecommendationEngine(), k=5, test_fraction=0.25)
+
+        self.assertEqual(results['train_views'] + results['test_views'], views_before)
+        for metric in ['precision_at_k', 'recall_at_k', 'coverage']:
+            self.assertGreaterEqual(results[metric], 0)
+            self.assertLessEqual(results[metric], 1)
+        self.assertEqual(AnimalViewHistory.objects.count(), views_before)
+
+
+class BenchmarkTests(RecommendationTestCase):
+    """Stage microbenchmarks"""
+
+    def test_every_stage_is_measured(self):
+        user = create_benchmark_user(5, [animal.id for animal in create_dogs() + create_cats()])
+
+        results = benchmark_stages(MLRecommendationEngine(), user, min_time=0)
+
+        self.assertEqual(list(results), STAGES)
+        self.assertEqual(results['score_by_preferences']['queries'], 1)
+        self.assertEqual(results['get_recommendation_reason']['queries'], 3)
+        for result in results.values():
+            self.assertGreater(result['ops_per_sec'], 0)
+            self.assertGreaterEqual(result['allocated_blocks'], 0)
+
+    def test_regressions_against_baseline(self):
+        baseline = [{'catalog_size': 100, 'history_length': 0, 'stages': {
+            'get_popular_animals': {'ops_per_sec': 1000.0, 'queries': 1},
+            'score_by_preferences': {'ops_per_sec': 100.0, 'queries': 1},
+        }}]
+        current = [{'catalog_size': 100, 'history_length': 0, 'stages': {
+            'get_popular_animals': {'ops_per_sec': 500.0, 'queries': 1},
+            'score_by_preferences': {'ops_per_sec': 90.0, 'queries': 2},
+        }}]
+
+        regressions = compare_to_baseline(current, baseline, tolerance=0.25)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('get_popular_animals', regressions[0])
+        self.assertIn('1 -> 2 queries', regressions[1])
+
+
+class StageTimingTests(RecommendationTestCase):
+    """Server-Timing header and the per-process stage histograms"""
+
+    def setUp(self):
+        super().setUp()
+        stage_histograms.reset()
+        self.user = create_user('doglover', preferred_species='Dog')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def server_timing(self, response):
+        return {entry.split(';')[0].strip(): entry for entry in response['Server-Timing'].split(',')}
+
+    def test_stages_in_server_timing_header(self):
+        view(self.user, create_animal('Tom', 'Cat'), minutes_ago=2)
+        view(self.user, create_animal('Rex', 'Dog'), minutes_ago=1)
+        create_animal('Max', 'Dog')
+
+        timings = self.server_timing(self.client.get('/api/recommendations/'))
+
+        for name in ['cache', 'catalog', 'profile', 'candidates', 'preferences', 'history', 'similarity', 'response', 'total']:
+            self.assertIn(name, timings)
+        self.assertIn('desc="0 queries"', timings['candidates'])
+
+        # A cache hit skips the engine entirely
+        timings = self.server_timing(self.client.get('/api/recommendations/'))
+        self.assertNotIn('candidates', timings)
+        self.assertIn('response', timings)
+
+    def test_timings_endpoint(self):
+        create_animal('Rex', 'Dog')
+        self.client.get('/api/recommendations/')
+        self.assertEqual(self.client.get('/api/recommendations/timings/').status_code, 403)
+
+        admin = User.objects.create_superuser(username='operator', password='password123')
+        self.client.force_authenticate(user=admin)
+        stages = self.client.get('/api/recommendations/timings/').data['stages']
+
+        self.assertEqual(stages['total']['count'], 1)
+        self.assertEqual(stages['candidates']['buckets'][-1], ['+Inf', 1])
+
+    def test_histogram_quantiles(self):
+        histograms = StageHistograms(buckets=(10, 100, float('inf')))
+        for milliseconds in [1, 2, 3, 50, 500]:
+            histograms.observe('preferences', milliseconds / 1000, 1)
+
+        snapshot = histograms.snapshot()['preferences']
+        self.assertEqual([count for _, count in snapshot['buckets']], [3, 4, 5])
+        self.assertEqual(snapshot['p50_ms'], 10)
+        self.assertEqual(snapshot['p95_ms'], float('inf'))
+        self.assertEqual(snapshot['queries_per_call'], 1)
+
+
+class MetricsTests(RecommendationTestCase):
+    """Prometheus metrics served at /metrics"""
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_cache_stage_and_view_metrics(self):
+        user = create_user('doglover', preferred_species='Dog')
+        create_animal('Rex', 'Dog')
+        cat = create_animal('Tom', 'Cat')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        requests = self.sample('petconnect_http_request_duration_seconds_count',
+                               view='recommendations', method='GET', status='200')
+        hits = self.sample('petconnect_cache_requests_total', cache='recommendations', result='hit')
+        misses = self.sample('petconnect_cache_requests_total', cache='recommendations', result='miss')
+        candidates = self.sample('petconnect_recommendation_stage_duration_seconds_count', stage='candidates')
+        views = self.sample('petconnect_animal_views_recorded_total')
+
+        client.get('/api/recommendations/')
+        client.get('/api/recommendations/')
+        view(user, cat)
+
+        self.assertEqual(self.sample('petconnect_http_request_duration_seconds_count',
+                                     view='recommendations', method='GET', status='200'), requests + 2)
+        self.assertEqual(self.sample('petconnect_cache_requests_total', cache='recommendations', result='hit'), hits + 1)
+        self.assertEqual(self.sample('petconnect_cache_requests_total', cache='recommendations', result='miss'), misses + 1)
+        self.assertEqual(self.sample('petconnect_recommendation_stage_duration_seconds_count', stage='candidates'),
+                         candidates + 1)
+        self.assertEqual(self.sample('petconnect_animal_views_recorded_total'), views + 1)
+        self.assertGreater(self.sample('petconnect_http_request_db_queries_sum', view='recommendations'), 0)
+
+    @override_settings(DEBUG=True)
+    def test_metrics_endpoint(self):
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'# TYPE petconnect_http_request_duration_seconds histogram', response.content)
+
+    def test_gunicorn_config_puts_workers_in_multiprocess_mode(self):
+        # A fresh interpreter, as in gunicorn: read the config, then create a metric as a worker would
+        config = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+        script = (
+            "import runpy, sys\n"
+            "runpy.run_path(sys.argv[1])\n"
+            "from prometheus_client import Counter\n"
+            "Counter('petconnect_test_worker', 'test').inc()\n"
         )
-    
-    @mock.patch('pets.views.AdaptiveRecommendationEngine.get_recommendations')
-    def test_adaptive_recommendations(self, mock_get_recommendations):
-        """Test the adaptive recommendation engine."""
-        # Mock the get_recommendations method to return specific pets
-        dog_recs = [dog.id for dog in self.dogs[4:]]  # Dogs not yet viewed
-        cat_recs = [cat.id for cat in self.cats[1:]]  # Cats not yet viewed
-        
-        # Set up different returns based on user_id
-        def side_effect(user_id, *args, **kwargs):
-            if user_id == self.dog_lover.id:
-                return dog_recs  # Return dogs for dog lover
-            elif user_id == self.cat_lover.id:
-                return cat_recs  # Return cats for cat lover
-            else:
-                return dog_recs[:2] + cat_recs[:2]  # Mix for undecided user
-        
-        mock_get_recommendations.side_effect = side_effect
-        
-        # Login as dog lover and view a recommendation
-        self.client.login(username='doglover', password='testpass')
-        response = self.client.get('/')  # Home page with recommendations
-        
-        # Now log a view for a recommended dog
-        log_pet_view(self.dog_lover.id, dog_recs[0], 60)
-        
-        # Logout and login as cat lover
-        self.client.logout()
-        self.client.login(username='catlover', password='testpass')
-        response = self.client.get('/')  # Home page with recommendations
-        
-        # Now log a view for a recommended cat
-        log_pet_view(self.cat_lover.id, cat_recs[0], 60)
-        
-        # Logout and login as undecided user
-        self.client.logout()
-        self.client.login(username='undecided', password='testpass')
-        response = self.client.get('/')  # Home page with recommendations
-        
-        # Log several cat views to shift preferences
-        for cat_id in cat_recs:
-            log_pet_view(self.undecided.id, cat_id, 60)
-        
-        # Mock should have been called multiple times
-        self.assertGreater(mock_get_recommendations.call_count, 3)
-
-
-if __name__ == '__main__':
-    unittest.main()
-
-        
\ No newline at end of file
+        env = {name: value for name, value in os.environ.items() if name != 'PROMETHEUS_MULTIPROC_DIR'}
+        env['TMPDIR'] = self.artifact_dir
+        multiproc_dir = os.path.join(self.artifact_dir, 'petconnect_prometheus_multiproc')
+
+        subprocess.run([sys.executable, '-c', script, config], env=env, check=True)
+
+        self.assertTrue(any(name.startswith('counter_') for name in os.listdir(multiproc_dir)))
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=False)
+    def test_metrics_are_closed_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
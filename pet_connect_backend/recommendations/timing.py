@@ -0,0 +1,156 @@
+# recommendations/timing.py
+
+import math
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from django.db import connection
+
+from pet_connect_backend.metrics import observe_stage
+
+# Upper bounds (milliseconds) of the stage latency histogram buckets
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, math.inf)
+
+_current_timer = contextvars.ContextVar('recommendation_stage_timer', default=None)
+
+
+class StageTimer:
+    """Wall time and database queries of each stage of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.stages = {}
+
+    def count_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook counting every query of the request"""
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def record(self, name, seconds, queries):
+        # A stage can run more than once per request (e.g. popular top-ups)
+        total = self.stages.setdefault(name, [0.0, 0])
+        total[0] += seconds
+        total[1] += queries
+
+    def total(self):
+        return time.perf_counter() - self.started, self.queries
+
+    def server_timing(self):
+        """The stages as a Server-Timing header value, durations in milliseconds"""
+        entries = list(self.stages.items()) + [('total', self.total())]
+        return ', '.join(
+            f'{name};dur={seconds * 1000:.2f};desc="{queries} queries"'
+            for name, (seconds, queries) in entries
+        )
+
+
+class StageHistograms:
+    """
+    Per-process latency histograms of every stage seen by track_stages.
+
+    Buckets are cumulative, like Prometheus histograms: the count stored
+    for a bound is the number of observations at or below it.
+    """
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def observe(self, name, seconds, queries):
+        milliseconds = seconds * 1000
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {
+                    'count': 0, 'sum_ms': 0.0, 'queries': 0, 'buckets': [0] * len(self.buckets),
+                }
+            stage['count'] += 1
+            stage['sum_ms'] += milliseconds
+            stage['queries'] += queries
+            for i, bound in enumerate(self.buckets):
+                if milliseconds <= bound:
+                    stage['buckets'][i] += 1
+
+    def quantile(self, counts, count, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        rank = q * count
+        for bound, cumulative in zip(self.buckets, counts):
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self):
+        """Every stage's histogram with its mean and estimated p50/p95/p99"""
+        with self._lock:
+            stages = {name: dict(stage, buckets=list(stage['buckets'])) for name, stage in self._stages.items()}
+
+        report = {}
+        for name, stage in sorted(stages.items()):
+            count = stage['count']
+            report[name] = {
+                'count': count,
+                'sum_ms': stage['sum_ms'],
+                'mean_ms': stage['sum_ms'] / count,
+                'queries_per_call': stage['queries'] / count,
+                'p50_ms': self.quantile(stage['buckets'], count, 0.5),
+                'p95_ms': self.quantile(stage['buckets'], count, 0.95),
+                'p99_ms': self.quantile(stage['buckets'], count, 0.99),
+                'buckets': [
+                    ['+Inf' if math.isinf(bound) else bound, cumulative]
+                    for bound, cumulative in zip(self.buckets, stage['buckets'])
+                ],
+            }
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+
+stage_histograms = StageHistograms()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the current request.
+
+    Outside track_stages (management commands, the batch recompute) this
+    does nothing, so the engine can mark its stages unconditionally.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+
+    queries = timer.queries
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.record(name, time.perf_counter() - started, timer.queries - queries)
+
+
+@contextmanager
+def track_stages(histograms=stage_histograms):
+    """
+    Collect the stages marked with stage() while the block runs.
+
+    Yields the StageTimer (for the Server-Timing header) and adds every
+    stage, plus the request total, to the histograms on exit.
+    """
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        with connection.execute_wrapper(timer.count_query):
+            yield timer
+    finally:
+        _current_timer.reset(token)
+        stages = list(timer.stages.items()) + [('total', timer.total())]
+        for name, (seconds, queries) in stages:
+            histograms.observe(name, seconds, queries)
+            observe_stage(name, seconds, queries)
@@ -81,4 +81,47 @@ def get_recommendations_for_user(user, limit=10):
     update_recommendations_for_user(user)
     
     # Return the top recommendations
-    return AnimalRecommendation.objects.filter(user=user).order_by('-score')[:limit]
\ No newline at end of file
+    return AnimalRecommendation.objects.filter(user=user).order_by('-score')[:limit]
+
+def store_recommendations(results, batch_size=1000):
+    """
+    Persist precomputed recommendations as AnimalRecommendation rows
+
+    results maps user_id -> [(animal_id, score, preference_score,
+    interaction_score, similarity_score), ...], as returned by
+    MLRecommendationEngine.get_recommendations_batch(with_scores=True).
+    Rows are upserted in chunks of batch_size, then any older rows for those
+    users (animals that dropped out of their top-k) are deleted.
+    """
+    from django.db import transaction
+    from django.utils import timezone
+
+    started_at = timezone.now()
+    rows = [
+        AnimalRecommendation(
+            user_id=user_id,
+            animal_id=animal_id,
+            score=score,
+            preference_score=preference_score,
+            interaction_score=interaction_score,
+            similarity_score=similarity_score,
+        )
+        for user_id, recommendations in results.items()
+        for animal_id, score, preference_score, interaction_score, similarity_score in recommendations
+    ]
+
+    with transaction.atomic():
+        for start in range(0, len(rows), batch_size):
+            AnimalRecommendation.objects.bulk_create(
+                rows[start:start + batch_size],
+                update_conflicts=True,
+                unique_fields=['user', 'animal'],
+                update_fields=['score', 'preference_score', 'interaction_score', 'similarity_score', 'updated_at'],
+            )
+
+        # Every row written above was stamped after started_at
+        AnimalRecommendation.objects.filter(
+            user_id__in=list(results), updated_at__lt=started_at
+        ).delete()
+
+    return len(rows)
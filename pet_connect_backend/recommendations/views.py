@@ -8,16 +8,21 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt  # Add this import
+import os
 import logging
 import traceback
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from django.views.decorators.csrf import csrf_exempt
 from animals.models import Animal, AnimalViewHistory
 from django.contrib.auth.models import User
 from django.utils import timezone
 from .recommendation_engine import MLRecommendationEngine
+from .cache import cache_recommendations, get_cached_recommendations
+from .models import SimilarAnimals
+from .similar_animals import DEFAULT_NEIGHBORS
+from .timing import stage, stage_histograms, track_stages
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +37,13 @@ class RecommendationView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
+        # Time each stage for the Server-Timing header and the stage histograms
+        with track_stages() as timer:
+            response = self.get_recommendations(request)
+        response['Server-Timing'] = timer.server_timing()
+        return response
+    
+    def get_recommendations(self, request):
         try:
             # Get the current user
             user = request.user
@@ -42,18 +54,35 @@ class RecommendationView(APIView):
             # Get the recommendation engine
             engine = MLRecommendationEngine()
             
-            # Get personalized recommendations
-            recommended_ids = engine.get_recommendations(user.id, limit=10)
-            
-            # Get the full animal objects
-            recommended_animals = []
-            for animal_id in recommended_ids:
-                try:
-                    animal = Animal.objects.get(id=animal_id)
-                    
-                    # Get the reason for this recommendation
-                    reason = engine.get_recommendation_reason(user.id, animal)
-                    
+            # Get personalized recommendations, reusing the cached ranking when nothing changed
+            with stage('cache'):
+                scored_animals = get_cached_recommendations(user.id, 10)
+            if scored_animals is None:
+                scored_animals = engine.get_recommendations(user.id, limit=10, with_reasons=True)
+                if scored_animals:
+                    cache_recommendations(user.id, 10, scored_animals)
+            else:
+                logger.info(f"Using cached recommendations for user {user.id}")
+            
+            with stage('response'):
+                # Fetch all recommended animals in one query; reasons come from the stage that ranked each one
+                animals = Animal.objects.in_bulk([animal_id for animal_id, _, _ in scored_animals])
+                components = {animal_id: component for animal_id, _, component in scored_animals}
+                reasons = engine.get_recommendation_reasons(user.id, list(animals.values()), components)
+            
+                recommended_animals = []
+                for animal_id, score, _ in scored_animals:
+                    animal = animals.get(animal_id)
+                    if animal is None:
+                        logger.warning(f"Recommended animal ID {animal_id} not found in database")
+                        continue
+                    if animal.status != 'A':
+                        # A cached list can outlive an adoption that hasn't been invalidated yet
+                        logger.info(f"Skipping recommended animal {animal_id}, no longer available")
+                        continue
+                
+                    reason_code, reason = reasons[animal_id]
+                
                     # Create a dictionary of animal info
                     animal_data = {
                         'id': animal.id,
@@ -65,22 +94,17 @@ class RecommendationView(APIView):
                         'gender': animal.gender,
                         'size': animal.size if hasattr(animal, 'size') else None,
                         'photo_url': animal.photo_url if hasattr(animal, 'photo_url') else None,
-                        'recommendation_reason': reason
+                        'recommendation_reason': reason,
+                        'reason_code': reason_code,
+                        'score': score,
                     }
-                    
+                
                     # Add compatibility fields if they exist
                     for field in ['good_with_kids', 'good_with_cats', 'good_with_dogs', 'energy_level']:
                         if hasattr(animal, field):
                             animal_data[field] = getattr(animal, field)
-                    
+                
                     recommended_animals.append(animal_data)
-                    
-                except Animal.DoesNotExist:
-                    logger.warning(f"Recommended animal ID {animal_id} not found in database")
-                    continue
-                except Exception as e:
-                    logger.error(f"Error processing animal ID {animal_id}: {str(e)}")
-                    continue
             
             logger.info(f"Returning {len(recommended_animals)} recommendations to frontend")
             
@@ -92,6 +116,74 @@ class RecommendationView(APIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class RecommendationTimingsView(APIView):
+    """Operator endpoint exposing this worker's recommendation stage histograms"""
+    
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        # Histograms live in process memory, so each worker reports its own
+        return Response({'pid': os.getpid(), 'stages': stage_histograms.snapshot()})
+    
+    def delete(self, request):
+        stage_histograms.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SimilarAnimalsView(APIView):
+    """API endpoint for the animals most similar to a given animal"""
+    
+    permission_classes = [AllowAny]
+    
+    def get(self, request, pk):
+        try:
+            limit = min(max(int(request.query_params.get('limit', DEFAULT_NEIGHBORS)), 1), DEFAULT_NEIGHBORS)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            # Neighbor lists are precomputed, serving them is a primary key lookup
+            similar = SimilarAnimals.objects.filter(animal_id=pk).first()
+            if similar is None:
+                if not Animal.objects.filter(id=pk).exists():
+                    return Response({'error': 'Animal not found'}, status=status.HTTP_404_NOT_FOUND)
+                # Not refreshed yet, or no longer available; the batch refresh fills it in
+                return Response({'animal_id': pk, 'similar': []})
+            
+            scores = dict(zip(similar.neighbor_ids, similar.scores))
+            animals = Animal.objects.filter(id__in=similar.neighbor_ids, status='A').in_bulk()
+            
+            similar_animals = []
+            for animal_id in similar.neighbor_ids:
+                animal = animals.get(animal_id)
+                if animal is None:
+                    # Adopted since the list was built
+                    continue
+                similar_animals.append({
+                    'id': animal.id,
+                    'name': animal.name,
+                    'species': animal.species,
+                    'breed': animal.breed,
+                    'age_years': animal.age_years,
+                    'age_months': animal.age_months,
+                    'gender': animal.gender,
+                    'size': animal.size,
+                    'energy_level': animal.energy_level,
+                    'good_with_kids': animal.good_with_kids,
+                    'good_with_cats': animal.good_with_cats,
+                    'good_with_dogs': animal.good_with_dogs,
+                    'similarity': scores[animal_id],
+                })
+                if len(similar_animals) == limit:
+                    break
+            
+            return Response({'animal_id': pk, 'similar': similar_animals})
+            
+        except Exception as e:
+            logger.error(f"Error fetching similar animals for animal {pk}: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 # IMPORTANT: The csrf_exempt decorator MUST be the first decorator
 @csrf_exempt
 @api_view(['POST'])